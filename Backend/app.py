@@ -3,10 +3,14 @@ Plataforma de Análise de IAs Generativas para Mamografias
 Backend FastAPI - Versão corrigida com suporte a PGM
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
+# Primeiro import: a fixação de núcleos (CPU_AFFINITY) precisa valer para todos os
+# threads criados depois (NumPy, OpenCV, TensorFlow, executores)
+from services import execution_profile
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 import uvicorn
+import asyncio
 import os
 import uuid
 import json
@@ -16,14 +20,23 @@ from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, F
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.sql import func
-from PIL import Image, ImageOps, ImageEnhance
-import pydicom
+from PIL import Image
 import io
 from pydicom.errors import InvalidDicomError
-import numpy as np
-import hashlib
+import threading
+import functools
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Union
 from services.ai_service import AIService
-from services.model_service import get_model_service
+from services.model_service import MODEL_WARMUP
+from services.model_registry import get_model_registry
+from services.executors import (
+    cpu_executor, inference_executor, http_executor,
+    ExecutorSaturated, get_executor_stats, shutdown_executors
+)
+from services.job_service import job_manager, JobQueueFull
+from services import derivatives, dicom_processing, ingest_service, preprocessing, visualization
 
 # Configurações básicas
 BASE_DIR = Path(__file__).parent
@@ -65,6 +78,11 @@ class Analysis(Base):
     # Cache de resultados baseado em hash da imagem
     image_hash = Column(String(32), nullable=True, index=True)
     
+    # Resultado do modelo treinado (JSON com heatmap compacto e bbox para a visualização)
+    model_result = Column(Text, nullable=True)
+    # Versão do modelo treinado que produziu model_result
+    model_version = Column(String(64), nullable=True)
+    
     # Campos para futuras funcionalidades
     confidence_score = Column(Float, nullable=True)
     is_processed = Column(Boolean, default=False)
@@ -100,6 +118,24 @@ def run_auto_migration():
             except Exception as e:
                 print(f"⚠️  Aviso na migração automática: {str(e)}")
         
+        # Adicionar model_result se não existir
+        if 'model_result' not in columns:
+            try:
+                cursor.execute("ALTER TABLE analyses ADD COLUMN model_result TEXT")
+                conn.commit()
+                print("✅ Migração automática: coluna 'model_result' adicionada")
+            except Exception as e:
+                print(f"⚠️  Aviso na migração automática: {str(e)}")
+        
+        # Adicionar model_version se não existir
+        if 'model_version' not in columns:
+            try:
+                cursor.execute("ALTER TABLE analyses ADD COLUMN model_version VARCHAR(64)")
+                conn.commit()
+                print("✅ Migração automática: coluna 'model_version' adicionada")
+            except Exception as e:
+                print(f"⚠️  Aviso na migração automática: {str(e)}")
+        
         conn.close()
     except Exception as e:
         print(f"⚠️  Erro na migração automática (não crítico): {str(e)}")
@@ -118,8 +154,42 @@ def get_db():
 # Instância do serviço de IA
 ai_service = AIService()
 
-# Instância do serviço de modelo treinado
-model_service = get_model_service()
+# Versões do modelo treinado; a versão ativa pode ser trocada sem reiniciar
+model_registry = get_model_registry()
+
+# Visualizações do modelo treinado renderizadas sob demanda
+visualization_cache = visualization.VisualizationCache()
+
+# Imagens otimizadas (realce + até 2048px), por hash do conteúdo
+derivative_cache = derivatives.DerivativeCache()
+
+# Pixels originais (16 bits) dos uploads DICOM, por hash do conteúdo
+dicom_pixels = dicom_processing.DicomPixelStore()
+
+async def run_bounded(executor, fn, *args, **kwargs):
+    """
+    Executa trabalho bloqueante (CPU, inferência ou HTTP) fora do event loop.
+    Se o executor estiver saturado, responde 503 em vez de enfileirar sem limite.
+    """
+    try:
+        return await executor.run(fn, *args, **kwargs)
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Aquece o modelo treinado ao iniciar e libera recursos ao encerrar"""
+    model_service = model_registry.active()
+    if MODEL_WARMUP and model_service.is_available() and model_service.residency == "resident":
+        # Aquecimento em segundo plano para não atrasar o /health
+        threading.Thread(target=model_service.warmup, name="model-warmup", daemon=True).start()
+    threading.Thread(target=model_registry.purge_stale_results, name="result-cache-purge", daemon=True).start()
+    await job_manager.start()
+    yield
+    await job_manager.stop()
+    shutdown_executors()
+    preprocessing.shutdown_pool()
+    model_registry.shutdown()
 
 # Criação da instância FastAPI
 app = FastAPI(
@@ -127,7 +197,8 @@ app = FastAPI(
     description="API para análise e comparação de mamografias usando diferentes modelos de IA",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # Configuração de CORS para permitir requisições do frontend
@@ -139,6 +210,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """Recusa uploads cujo Content-Length já excede o limite, antes de receber o corpo"""
+    if request.method == "POST" and request.url.path.startswith("/api/v1/upload"):
+        max_request_size = ingest_service.max_request_size(batch=request.url.path.rstrip("/").endswith("/batch"))
+        content_length = request.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > max_request_size:
+            max_size_mb = max_request_size / (1024 * 1024)
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Arquivo muito grande. Tamanho máximo: {max_size_mb:.0f}MB"}
+            )
+    return await call_next(request)
+
 # Endpoints básicos
 @app.get("/")
 async def root():
@@ -151,7 +236,9 @@ async def root():
             "docs": "/docs",
             "health": "/health",
             "upload": "/api/v1/upload",
-            "analysis": "/api/v1/analyze"
+            "upload_batch": "/api/v1/upload/batch",
+            "analysis": "/api/v1/analyze",
+            "jobs": "/api/v1/jobs"
         }
     }
 
@@ -166,10 +253,37 @@ async def health_check():
             "results": RESULTS_DIR
         },
         "models": {
-            "trained_model_available": model_service.is_available()
-        }
+            "trained_model_available": model_registry.active().is_available(),
+            "trained_model": model_registry.active().get_status()
+        },
+        "executors": get_executor_stats(),
+        "jobs": job_manager.get_stats(),
+        "uploads": ingest_service.ingest_stats.get_stats(),
+        "derivatives": derivative_cache.get_stats(),
+        "dicom_pixels": dicom_pixels.get_stats()
     }
 
+@app.get("/api/v1/model/stats")
+async def model_stats():
+    """Estado do modelo treinado e estatísticas de micro-batching"""
+    return model_registry.active().get_stats()
+
+@app.get("/api/v1/models")
+async def list_model_versions():
+    """Versões do modelo treinado disponíveis e a versão ativa"""
+    return await run_bounded(cpu_executor, model_registry.get_stats)
+
+@app.post("/api/v1/models/{version}/activate", status_code=202)
+async def activate_model_version(version: str):
+    """
+    Carrega a versão em segundo plano e passa a usá-la após o aquecimento.
+    Análises em andamento terminam com a versão anterior.
+    """
+    try:
+        return model_registry.activate(version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Versão do modelo '{version}' não encontrada")
+
 # Endpoint para servir imagens
 @app.get("/uploads/{filename}")
 @app.head("/uploads/{filename}")
@@ -189,25 +303,18 @@ async def get_image(filename: str):
     # Se for PGM, converter para JPEG em memória para exibição
     if extension == '.pgm':
         try:
-            # Carregar imagem PGM
-            with Image.open(file_path) as img:
-                # Converter para RGB se necessário
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Salvar como JPEG em memória
-                img_buffer = io.BytesIO()
-                img.save(img_buffer, format='JPEG', quality=95, optimize=False)
-                img_buffer.seek(0)
-                
-                # Retornar JPEG convertido
-                return Response(
-                    content=img_buffer.getvalue(),
-                    media_type='image/jpeg',
-                    headers={
-                        'Content-Disposition': f'inline; filename="{Path(filename).stem}.jpg"'
-                    }
-                )
+            jpeg_content = await run_bounded(cpu_executor, convert_pgm_to_jpeg, file_path)
+            
+            # Retornar JPEG convertido
+            return Response(
+                content=jpeg_content,
+                media_type='image/jpeg',
+                headers={
+                    'Content-Disposition': f'inline; filename="{Path(filename).stem}.jpg"'
+                }
+            )
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"Erro ao converter PGM para JPEG: {str(e)}")
             # Fallback: retornar arquivo original
@@ -218,6 +325,7 @@ async def get_image(filename: str):
         '.jpg': 'image/jpeg',
         '.jpeg': 'image/jpeg',
         '.png': 'image/png',
+        '.webp': 'image/webp',
         '.dcm': 'application/dicom'
     }
     media_type = media_type_map.get(extension, 'application/octet-stream')
@@ -230,6 +338,7 @@ async def upload_mammography(file: UploadFile = File(...), db: Session = Depends
     """
     Endpoint para upload de imagem de mamografia com armazenamento no banco
     """
+    start = time.perf_counter()
     try:
         # Verificar se é uma imagem ou arquivo DICOM
         allowed_content_types = ['image/', 'application/dicom', 'application/octet-stream']
@@ -252,86 +361,72 @@ async def upload_mammography(file: UploadFile = File(...), db: Session = Depends
                 detail=f"Arquivo deve ser uma imagem válida ({', '.join(allowed_extensions)})"
             )
             
-        # Ler conteúdo do arquivo
-        content = await file.read()
-
-        # Processar arquivo DICOM se necessário
-        if file_extension == '.dcm':
-            try:
-                # Converter DICOM para imagem
-                content, dicom_info = convert_dicom_to_image(content, file.filename)
-                # Usar informações do DICOM como base
-                image_info = {
-                    "dimensions": (dicom_info["rows"], dicom_info["columns"]),
-                    "format": "DICOM",
-                    "mode": "RGB",
-                    "is_optimized": True,
-                    "was_resized": False,
-                    "original_dimensions": None,
-                    "dicom_metadata": dicom_info
-                }
-            except HTTPException as e:
-                raise
-            except Exception as e:
-                raise HTTPException(status_code=500,
-                detail=f"Erro ao processar arquivo DICOM: {str(e)}")
-        else:
-            try:
-                image_info = validate_and_process_image(content, file.filename)
-            except HTTPException as e:
-                raise
-            except Exception as e:
-                raise HTTPException(status_code=500,
-                detail=f"Erro ao processar imagem: {str(e)}")
-        
-        
-        # Verificar tamanho baseado no tipo de arquivo
+        # Limite por tipo de arquivo, aplicado enquanto o upload é lido
         is_dicom = file_extension == '.dcm'
-        max_size = 50 * 1024 * 1024 if is_dicom else 10 * 1024 * 1024  # 50MB para DICOM, 10MB para outros
+        max_size = ingest_service.max_upload_size(file_extension)
         max_size_mb = max_size / (1024*1024)
         
-        if len(content) > max_size:
+        # Copiar o upload em blocos para um arquivo temporário em uploads/,
+        # calculando o hash MD5 (cache) sem manter o arquivo inteiro em memória
+        try:
+            upload = await ingest_service.spool_upload(file, UPLOAD_DIR, max_size)
+        except ingest_service.UploadTooLarge:
             raise HTTPException(
-                status_code=400, 
+                status_code=413, 
                 detail=f"Arquivo muito grande. Tamanho máximo: {max_size_mb:.0f}MB"
             )
         
-        # Calcular hash MD5 do conteúdo para cache
-        image_hash = hashlib.md5(content).hexdigest()
-        
-        # Verificar se já existe análise com mesmo hash (cache)
-        existing_analysis = db.query(Analysis).filter(Analysis.image_hash == image_hash).first()
-        if existing_analysis and existing_analysis.gemini_analysis:
-            # Retornar análise existente do cache
-            return {
-                "message": "Upload realizado com sucesso (análise do cache)",
-                "analysis_id": existing_analysis.id,
-                "filename": existing_analysis.filename,
-                "original_filename": file.filename,
-                "info": json.loads(existing_analysis.info) if existing_analysis.info else image_info,
-                "file_size": len(content),
-                "status": "uploaded",
-                "from_cache": True
-            }
-        
-        # Gerar nome único para o arquivo
-        if file_extension == '.dcm':
-            # Para DICOM, salvar como JPEG convertido
-            unique_filename = f"{uuid.uuid4()}.jpg"
-        else:
-            unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, unique_filename)
-        
-        # Salvar arquivo original no disco
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
+        with upload:
+            # Hash MD5 do arquivo enviado, calculado durante a leitura: o índice é
+            # consultado antes de qualquer decodificação da imagem
+            image_hash = upload.md5
+            analyzed, known = find_existing_uploads(db, [image_hash])
+            existing_analysis = analyzed.get(image_hash)
+            if existing_analysis:
+                # Retornar análise existente do cache, sem decodificar a imagem
+                ingest_service.ingest_stats.record("dedup_hit", time.perf_counter() - start)
+                return {
+                    "message": "Upload realizado com sucesso (análise do cache)",
+                    "analysis_id": existing_analysis.id,
+                    "filename": existing_analysis.filename,
+                    "original_filename": file.filename,
+                    "info": json.loads(existing_analysis.info) if existing_analysis.info else None,
+                    "file_size": existing_analysis.file_size,
+                    "status": "uploaded",
+                    "from_cache": True
+                }
+            
+            # Conteúdo já validado antes (ainda sem análise): reutiliza as informações
+            # da imagem e, para DICOM, o JPEG já convertido
+            known_analysis = known.get(image_hash)
+            content = None
+            if known_analysis:
+                image_info = json.loads(known_analysis.info)
+                outcome = "info_reused"
+            else:
+                try:
+                    # Validar a imagem ou converter o DICOM
+                    image_info, content = await run_bounded(
+                        cpu_executor, decode_upload, upload.path, file.filename, image_hash
+                    )
+                except HTTPException as e:
+                    raise
+                except Exception as e:
+                    raise HTTPException(status_code=500,
+                    detail=f"Erro ao processar {'arquivo DICOM' if is_dicom else 'imagem'}: {str(e)}")
+                outcome = "decoded"
+            
+            # Mover o arquivo para uploads/ (rename atômico: nunca fica parcial)
+            unique_filename, file_path, file_size = store_upload(
+                upload, file.filename, content, known_analysis.file_path if known_analysis else None
+            )
         
         # Salvar no banco de dados
         analysis = Analysis(
             filename=unique_filename,
             original_filename=file.filename,
             file_path=file_path,
-            file_size=len(content),
+            file_size=file_size,
             processing_status="uploaded",
             info=json.dumps(image_info),
             image_hash=image_hash
@@ -340,6 +435,11 @@ async def upload_mammography(file: UploadFile = File(...), db: Session = Depends
         db.add(analysis)
         db.commit()
         db.refresh(analysis)
+        ingest_service.ingest_stats.record(outcome, time.perf_counter() - start)
+        
+        # A imagem otimizada é gerada fora do caminho do upload
+        if derivatives.DERIVATIVE_PREFETCH:
+            derivative_cache.prefetch(cpu_executor, image_hash, file_path)
         
         return {
             "message": "Upload realizado com sucesso",
@@ -347,13 +447,244 @@ async def upload_mammography(file: UploadFile = File(...), db: Session = Depends
             "filename": unique_filename,
             "original_filename": file.filename,
             "info": image_info,
-            "file_size": len(content),
+            "file_size": file_size,
             "status": "uploaded"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Erro no upload: {str(e)}")
 
+@app.post("/api/v1/upload/batch")
+async def upload_batch(files: list[UploadFile] = File(...), db: Session = Depends(get_db)):
+    """
+    Upload em lote: várias imagens e/ou arquivos ZIP/TAR (ex.: MIAS, CBIS-DDSM).
+    As imagens são validadas em paralelo no cpu_executor e todas as análises são
+    gravadas em uma única transação; o resultado é informado por arquivo.
+    """
+    start = time.perf_counter()
+    batch_limit = ingest_service.max_batch_size()
+    max_files = ingest_service.UPLOAD_BATCH_MAX_FILES
+    # (nome original, SpooledUpload ou mensagem de erro), na ordem do lote
+    entries = []
+    try:
+        total = 0
+        for file in files:
+            filename = file.filename or "arquivo"
+            extension = Path(filename).suffix.lower()
+            image_count = sum(1 for _, entry in entries if isinstance(entry, ingest_service.SpooledUpload))
+            if ingest_service.is_archive(filename):
+                try:
+                    archive = await ingest_service.spool_upload(file, UPLOAD_DIR, batch_limit - total)
+                except ingest_service.UploadTooLarge:
+                    raise HTTPException(status_code=413, detail=f"Lote maior que {batch_limit / 2 ** 20:.0f}MB")
+                with archive:
+                    try:
+                        # Extração em blocos, uma imagem por vez, fora do event loop
+                        expanded = await run_bounded(
+                            cpu_executor, ingest_service.expand_archive, archive.path, filename, UPLOAD_DIR,
+                            max_files - image_count, batch_limit - total
+                        )
+                    except ingest_service.BatchLimitExceeded as e:
+                        raise HTTPException(status_code=413, detail=str(e))
+                    except ValueError as e:
+                        raise HTTPException(status_code=400, detail=f"{filename}: {str(e)}")
+                entries.extend((f"{filename}/{name}", entry) for name, entry in expanded)
+                total += sum(entry.size for _, entry in expanded if isinstance(entry, ingest_service.SpooledUpload))
+            elif extension in ingest_service.IMAGE_EXTENSIONS:
+                if image_count >= max_files:
+                    raise HTTPException(status_code=413, detail=f"Lote com mais de {max_files} imagens")
+                max_size = ingest_service.max_upload_size(extension)
+                try:
+                    upload = await ingest_service.spool_upload(file, UPLOAD_DIR, max_size)
+                except ingest_service.UploadTooLarge:
+                    entries.append((filename, f"Arquivo muito grande. Tamanho máximo: {max_size / 2 ** 20:.0f}MB"))
+                    continue
+                entries.append((filename, upload))
+                total += upload.size
+                if total > batch_limit:
+                    raise HTTPException(status_code=413, detail=f"Lote maior que {batch_limit / 2 ** 20:.0f}MB")
+            else:
+                entries.append((filename, f"Formato não suportado. Use imagens ({', '.join(ingest_service.IMAGE_EXTENSIONS)}) "
+                                          f"ou arquivos {', '.join(ingest_service.ARCHIVE_EXTENSIONS)}"))
+        
+        return await ingest_batch(db, entries, start)
+    finally:
+        # Arquivos não gravados em uploads/ (erros, conteúdo já analisado)
+        for _, entry in entries:
+            if isinstance(entry, ingest_service.SpooledUpload):
+                entry.discard()
+
+async def ingest_batch(db: Session, entries: list, start: float) -> dict:
+    """
+    Valida/converte as imagens do lote (uma vez por conteúdo) e grava todas as
+    análises em um único commit; a deduplicação é a mesma do upload individual
+    """
+    uploads = [(name, entry) for name, entry in entries if isinstance(entry, ingest_service.SpooledUpload)]
+    analyzed, known = find_existing_uploads(db, {upload.md5 for _, upload in uploads})
+    
+    # Uma decodificação por conteúdo novo, no máximo max_workers ao mesmo tempo
+    # (o lote não ocupa a fila do cpu_executor usada pelas outras requisições)
+    to_decode = {}
+    for name, upload in uploads:
+        if upload.md5 not in analyzed and upload.md5 not in known:
+            to_decode.setdefault(upload.md5, (name, upload))
+    slots = asyncio.Semaphore(cpu_executor.max_workers)
+    
+    async def decode(name: str, upload: ingest_service.SpooledUpload):
+        async with slots:
+            try:
+                return await run_bounded(cpu_executor, decode_upload, upload.path, name, upload.md5)
+            except HTTPException as e:
+                return str(e.detail)
+            except Exception as e:
+                return f"Erro ao processar imagem: {str(e)}"
+    
+    decoded = dict(zip(to_decode, await asyncio.gather(*(decode(*item) for item in to_decode.values()))))
+    
+    results, rows, outcomes, stored = [], [], [], {}
+    try:
+        for name, entry in entries:
+            if isinstance(entry, str):
+                results.append({"original_filename": name, "status": "error", "error": entry})
+                continue
+            image_hash = entry.md5
+            if image_hash in analyzed:
+                existing = analyzed[image_hash]
+                results.append({
+                    "original_filename": name,
+                    "status": "uploaded",
+                    "from_cache": True,
+                    "analysis_id": existing.id,
+                    "filename": existing.filename,
+                    "file_size": existing.file_size
+                })
+                outcomes.append("dedup_hit")
+                continue
+            
+            # Mesmo conteúdo já gravado neste lote ou em um upload anterior
+            source = stored.get(image_hash) or known.get(image_hash)
+            if source is not None:
+                image_info, content, outcome = json.loads(source.info), None, "info_reused"
+            elif isinstance(decoded[image_hash], str):
+                results.append({"original_filename": name, "status": "error", "error": decoded[image_hash]})
+                continue
+            else:
+                (image_info, content), outcome = decoded[image_hash], "decoded"
+            
+            unique_filename, file_path, file_size = store_upload(
+                entry, name, content, source.file_path if source is not None else None
+            )
+            analysis = Analysis(
+                filename=unique_filename,
+                original_filename=name,
+                file_path=file_path,
+                file_size=file_size,
+                processing_status="uploaded",
+                info=json.dumps(image_info),
+                image_hash=image_hash
+            )
+            rows.append(analysis)
+            stored.setdefault(image_hash, analysis)
+            outcomes.append(outcome)
+            results.append({
+                "original_filename": name,
+                "status": "uploaded",
+                "filename": unique_filename,
+                "info": image_info,
+                "file_size": file_size,
+                "analysis": analysis
+            })
+        
+        # Todas as linhas em uma transação
+        db.add_all(rows)
+        db.flush()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        for analysis in rows:
+            if os.path.exists(analysis.file_path):
+                os.remove(analysis.file_path)
+        raise HTTPException(status_code=500, detail=f"Erro ao gravar o lote: {str(e)}")
+    
+    for result in results:
+        if "analysis" in result:
+            analysis = result.pop("analysis")
+            result["analysis_id"] = analysis.id
+            # A imagem otimizada é gerada fora do caminho do upload
+            if derivatives.DERIVATIVE_PREFETCH:
+                derivative_cache.prefetch(cpu_executor, analysis.image_hash, analysis.file_path)
+    
+    elapsed = time.perf_counter() - start
+    # Latência amortizada por arquivo (o lote é uma única requisição)
+    for outcome in outcomes:
+        ingest_service.ingest_stats.record(outcome, elapsed / len(outcomes))
+    
+    ingested = sum(1 for result in results if result["status"] == "uploaded")
+    return {
+        "message": f"Lote processado: {ingested} de {len(results)} arquivos",
+        "total": len(results),
+        "uploaded": ingested,
+        "from_cache": sum(1 for result in results if result.get("from_cache")),
+        "failed": len(results) - ingested,
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "files_per_second": round(len(results) / elapsed, 1) if elapsed > 0 else None,
+        "results": results
+    }
+
+def find_existing_uploads(db: Session, image_hashes) -> tuple[dict, dict]:
+    """
+    Uploads anteriores do mesmo conteúdo, por hash (uma consulta):
+    (análises com resultado, análises com informações da imagem e arquivo em disco)
+    """
+    analyzed, known = {}, {}
+    query = db.query(Analysis).filter(Analysis.image_hash.in_(list(image_hashes))).order_by(Analysis.id)
+    for analysis in query:
+        if analysis.gemini_analysis is not None or analysis.model_result is not None:
+            analyzed.setdefault(analysis.image_hash, analysis)
+        if (analysis.info is not None and analysis.image_hash not in known
+                and os.path.exists(analysis.file_path)):
+            known[analysis.image_hash] = analysis
+    return analyzed, known
+
+def decode_upload(file_path: str, filename: str, image_hash: str) -> tuple[dict, Optional[bytes]]:
+    """
+    Valida a imagem (ou converte o DICOM) de um upload já gravado em disco
+    
+    Returns:
+        tuple: (informações da imagem, JPEG convertido do DICOM ou None)
+    """
+    if Path(filename).suffix.lower() != '.dcm':
+        return validate_and_process_image(file_path, filename), None
+    
+    content, dicom_info, window = convert_dicom_to_image(file_path, filename, image_hash)
+    # Usar informações do DICOM como base
+    return dicom_processing.image_info(dicom_info, window), content
+
+def store_upload(upload: ingest_service.SpooledUpload, filename: str, content: Optional[bytes] = None,
+                 source_path: Optional[str] = None) -> tuple[str, str, int]:
+    """
+    Grava o upload em uploads/ com um nome único (rename ou cópia atômicos).
+    DICOM: grava o JPEG convertido (content) ou copia o de um upload do mesmo conteúdo (source_path)
+    
+    Returns:
+        tuple: (nome do arquivo, caminho, tamanho em bytes)
+    """
+    file_extension = Path(filename).suffix.lower()
+    is_dicom = file_extension == '.dcm'
+    # Para DICOM, salvar como JPEG convertido
+    unique_filename = f"{uuid.uuid4()}.jpg" if is_dicom else f"{uuid.uuid4()}{file_extension}"
+    file_path = os.path.join(UPLOAD_DIR, unique_filename)
+    
+    if not is_dicom:
+        upload.commit(file_path)
+    elif source_path:
+        ingest_service.copy_atomic(source_path, file_path)
+    else:
+        ingest_service.write_atomic(file_path, content)
+    return unique_filename, file_path, os.path.getsize(file_path)
+
 # Endpoint para listar uploads do banco
 @app.get("/api/v1/uploads")
 async def list_uploads(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
@@ -445,28 +776,138 @@ async def get_analysis(analysis_id: int, db: Session = Depends(get_db)):
             "info": info_data,
             "results": {
                 "gemini": analysis.gemini_analysis
-            }
+            },
+            "visualization_url": visualization_url(analysis.id) if analysis.model_result else None,
+            "model_version": analysis.model_version
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Erro ao obter análise: {str(e)}")
 
-# Endpoint de análise com IA
-@app.post("/api/v1/analyze/{analysis_id}")
-async def analyze_mammography(analysis_id: int, db: Session = Depends(get_db)):
+def visualization_url(analysis_id: int) -> str:
+    return f"/api/v1/analysis/{analysis_id}/visualization"
+
+@app.get("/api/v1/analysis/{analysis_id}/visualization")
+@app.head("/api/v1/analysis/{analysis_id}/visualization")
+async def get_analysis_visualization(analysis_id: int, request: Request, format: str = None,
+                                     size: int = None, db: Session = Depends(get_db)):
     """
-    Endpoint para análise de mamografia com IA (Gemini)
-    Verifica cache baseado em hash da imagem antes de processar
+    Visualização do diagnóstico do modelo treinado, renderizada na primeira
+    requisição e servida do cache em disco (com ETag) nas seguintes
+    """
+    analysis = get_analysis_with_file(db, analysis_id)
+    if not analysis.model_result:
+        raise HTTPException(status_code=404, detail="Análise com modelo treinado não encontrada para esta imagem")
+    
+    fmt = (format or visualization.VIZ_FORMAT).lower()
+    if fmt not in visualization.SUPPORTED_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Formato inválido. Use: {', '.join(visualization.SUPPORTED_FORMATS)}"
+        )
+    panel_size = size or visualization.VIZ_PANEL_SIZE
+    if not visualization.MIN_PANEL_SIZE <= panel_size <= visualization.MAX_PANEL_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tamanho inválido. Use entre {visualization.MIN_PANEL_SIZE} e {visualization.MAX_PANEL_SIZE} pixels"
+        )
+    
+    state = json.loads(analysis.model_result)["visualization"]
+    etag = f'"{visualization_cache.etag(state, fmt, panel_size)}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    
+    # O cliente já tem esta versão: nada para renderizar nem transferir
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    path, _ = await run_bounded(
+        cpu_executor, visualization_cache.get_or_render,
+        analysis.id, analysis.file_path, state, fmt, panel_size
+    )
+    return FileResponse(path, media_type=visualization.MEDIA_TYPES[fmt], headers=headers)
+
+@app.get("/api/v1/analysis/{analysis_id}/optimized")
+@app.head("/api/v1/analysis/{analysis_id}/optimized")
+async def get_optimized_image(analysis_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Imagem otimizada (autocontraste, contraste/brilho e até DERIVATIVE_MAX_SIZE px),
+    gerada em segundo plano após o upload ou na primeira requisição
+    """
+    analysis = get_analysis_with_file(db, analysis_id)
+    key = analysis.image_hash or f"analysis-{analysis.id}"
+    etag = f'"{derivative_cache.etag(key)}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    path = await run_bounded(cpu_executor, derivative_cache.get_or_render, key, analysis.file_path)
+    return FileResponse(path, media_type="image/jpeg", headers=headers)
+
+@app.get("/api/v1/analysis/{analysis_id}/window")
+@app.head("/api/v1/analysis/{analysis_id}/window")
+async def get_dicom_window(analysis_id: int, request: Request, center: Optional[float] = None,
+                           width: Optional[float] = None, size: Optional[int] = None,
+                           db: Session = Depends(get_db)):
+    """
+    Upload DICOM com outra janela (center/width; padrão: a janela do arquivo),
+    gerado dos pixels originais guardados no upload, sem reler o DICOM
+    """
+    analysis = get_analysis_with_file(db, analysis_id)
+    if (center is None) != (width is None):
+        raise HTTPException(status_code=400, detail="Informe center e width juntos")
+    if width is not None and width <= 0:
+        raise HTTPException(status_code=400, detail="width deve ser positivo")
+    if size is not None and size <= 0:
+        raise HTTPException(status_code=400, detail="size deve ser positivo")
+    if not analysis.image_hash or not dicom_pixels.exists(analysis.image_hash):
+        raise HTTPException(status_code=404, detail="Pixels originais não disponíveis (apenas uploads DICOM)")
+    
+    if center is not None:
+        window = dicom_processing.window_from_center(center, width)
+    else:
+        window = json.loads(analysis.info or "{}").get("window")
+    window_key = "-".join(f"{bound:g}" for bound in window) if window else "auto"
+    etag = f'"{analysis.image_hash}-{window_key}-{size or "full"}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    def render():
+        pixels = dicom_pixels.load(analysis.image_hash)
+        if pixels is None:
+            raise HTTPException(status_code=404, detail="Pixels originais não disponíveis (apenas uploads DICOM)")
+        return dicom_processing.render_window(pixels, tuple(window) if window else None, size)
+    
+    content = await run_bounded(cpu_executor, render)
+    return Response(content=content, media_type="image/jpeg", headers=headers)
+
+def get_analysis_with_file(db: Session, analysis_id: int) -> Analysis:
+    """Busca a análise e garante que o arquivo da imagem existe (404 caso contrário)"""
+    analysis = db.query(Analysis).filter(Analysis.id == analysis_id).first()
+    
+    if not analysis:
+        raise HTTPException(status_code=404, detail="Análise não encontrada")
+    
+    if not os.path.exists(analysis.file_path):
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    
+    return analysis
+
+async def perform_gemini_analysis(analysis: Analysis, db: Session, notify=None) -> dict:
+    """
+    Análise com Gemini (fallback Hugging Face), compartilhada pelo endpoint
+    síncrono e pelos jobs assíncronos.
+    notify: callback opcional chamado quando o status muda para "processing"
     """
+    analysis_id = analysis.id
     try:
-        analysis = db.query(Analysis).filter(Analysis.id == analysis_id).first()
-        
-        if not analysis:
-            raise HTTPException(status_code=404, detail="Análise não encontrada")
-        
-        if not os.path.exists(analysis.file_path):
-            raise HTTPException(status_code=404, detail="Arquivo não encontrado")
-        
         # Se já tem resultado, retornar sem reprocessar
         if analysis.gemini_analysis:
             return {
@@ -511,6 +952,8 @@ async def analyze_mammography(analysis_id: int, db: Session = Depends(get_db)):
         analysis.processing_status = "processing"
         analysis.processing_date = datetime.utcnow()
         db.commit()
+        if notify:
+            notify("processing")
         
         # Gerar image_id baseado no nome original do arquivo ou hash da imagem
         # Isso garante que a mesma imagem sempre tenha o mesmo image_id
@@ -532,7 +975,9 @@ async def analyze_mammography(analysis_id: int, db: Session = Depends(get_db)):
         
         print(f"🆔 Image ID gerado: {image_id} (original: {analysis.original_filename}, hash: {analysis.image_hash[:8] if analysis.image_hash else 'N/A'})")
         
-        gemini_result = ai_service.analyze_mammography(analysis.file_path, image_id=image_id)
+        gemini_result = await run_bounded(
+            http_executor, ai_service.analyze_mammography, analysis.file_path, image_id=image_id
+        )
         
         if gemini_result["success"]:
             # Salvar resultado no banco
@@ -551,7 +996,7 @@ async def analyze_mammography(analysis_id: int, db: Session = Depends(get_db)):
             }
         else:
             # Se Gemini falhar, tentar Hugging Face (ou outro modelo)
-            hf_result = ai_service.analyze_with_alternative_api(analysis.file_path)
+            hf_result = await run_bounded(http_executor, ai_service.analyze_with_alternative_api, analysis.file_path)
             
             if hf_result["success"]:
                 analysis.gemini_analysis = hf_result["analysis"] # Salva no mesmo campo (pode ser ajustado)
@@ -578,7 +1023,11 @@ async def analyze_mammography(analysis_id: int, db: Session = Depends(get_db)):
                     detail=f"Erro na análise: {analysis.error_message}"
                 )
         
-    except HTTPException:
+    except HTTPException as e:
+        if e.status_code == 503:
+            # Executor saturado: devolver a análise ao estado anterior
+            analysis.processing_status = "uploaded"
+            db.commit()
         raise
     except Exception as e:
         # Atualizar status de erro
@@ -587,28 +1036,32 @@ async def analyze_mammography(analysis_id: int, db: Session = Depends(get_db)):
         db.commit()
         raise HTTPException(status_code=500, detail=f"Erro na análise: {str(e)}")
 
-# Endpoint alternativo para Hugging Face
-@app.post("/api/v1/analyze-huggingface/{analysis_id}")
-async def analyze_mammography_hf(analysis_id: int, db: Session = Depends(get_db)):
+
+# Endpoint de análise com IA
+@app.post("/api/v1/analyze/{analysis_id}")
+async def analyze_mammography(analysis_id: int, db: Session = Depends(get_db)):
     """
-    Endpoint para análise de mamografia com Hugging Face
+    Endpoint para análise de mamografia com IA (Gemini)
+    Verifica cache baseado em hash da imagem antes de processar
+    """
+    analysis = get_analysis_with_file(db, analysis_id)
+    return await perform_gemini_analysis(analysis, db)
+
+async def perform_huggingface_analysis(analysis: Analysis, db: Session, notify=None) -> dict:
     """
+    Análise com Hugging Face, compartilhada pelo endpoint síncrono e pelos jobs
+    """
+    analysis_id = analysis.id
     try:
-        analysis = db.query(Analysis).filter(Analysis.id == analysis_id).first()
-        
-        if not analysis:
-            raise HTTPException(status_code=404, detail="Análise não encontrada")
-        
-        if not os.path.exists(analysis.file_path):
-            raise HTTPException(status_code=404, detail="Arquivo não encontrado")
-        
         # Atualizar status para processando
         analysis.processing_status = "processing"
         analysis.processing_date = datetime.utcnow()
         db.commit()
+        if notify:
+            notify("processing")
         
         # Fazer análise com Hugging Face
-        hf_result = ai_service.analyze_with_alternative_api(analysis.file_path)
+        hf_result = await run_bounded(http_executor, ai_service.analyze_with_alternative_api, analysis.file_path)
         
         if hf_result["success"]:
             # Salvar resultado no banco
@@ -635,7 +1088,11 @@ async def analyze_mammography_hf(analysis_id: int, db: Session = Depends(get_db)
                 detail=f"Erro na análise: {hf_result['error']}"
             )
         
-    except HTTPException:
+    except HTTPException as e:
+        if e.status_code == 503:
+            # Executor saturado: devolver a análise ao estado anterior
+            analysis.processing_status = "uploaded"
+            db.commit()
         raise
     except Exception as e:
         analysis.processing_status = "error"
@@ -643,6 +1100,16 @@ async def analyze_mammography_hf(analysis_id: int, db: Session = Depends(get_db)
         db.commit()
         raise HTTPException(status_code=500, detail=f"Erro na análise: {str(e)}")
 
+
+# Endpoint alternativo para Hugging Face
+@app.post("/api/v1/analyze-huggingface/{analysis_id}")
+async def analyze_mammography_hf(analysis_id: int, db: Session = Depends(get_db)):
+    """
+    Endpoint para análise de mamografia com Hugging Face
+    """
+    analysis = get_analysis_with_file(db, analysis_id)
+    return await perform_huggingface_analysis(analysis, db)
+
 # Endpoint para excluir análise
 @app.delete("/api/v1/analysis/{analysis_id}")
 async def delete_analysis(analysis_id: int, db: Session = Depends(get_db)):
@@ -663,6 +1130,14 @@ async def delete_analysis(analysis_id: int, db: Session = Depends(get_db)):
             except Exception as e:
                 print(f"⚠️  Erro ao excluir arquivo: {str(e)}")
         
+        visualization_cache.invalidate(analysis_id)
+        # A imagem otimizada é compartilhada por uploads do mesmo conteúdo
+        if analysis.image_hash and not db.query(Analysis).filter(
+            Analysis.image_hash == analysis.image_hash, Analysis.id != analysis_id
+        ).first():
+            derivative_cache.invalidate(analysis.image_hash)
+            dicom_pixels.invalidate(analysis.image_hash)
+        
         # Excluir do banco de dados
         db.delete(analysis)
         db.commit()
@@ -679,184 +1154,258 @@ async def delete_analysis(analysis_id: int, db: Session = Depends(get_db)):
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Erro ao excluir análise: {str(e)}")
 
-# Endpoint para análise com modelo treinado
-@app.post("/api/v1/analyze-trained-model/{analysis_id}")
-async def analyze_with_trained_model(analysis_id: int, db: Session = Depends(get_db)):
+def ensure_trained_model_available():
+    """Verifica se o modelo treinado está disponível (503 caso contrário)"""
+    if not model_registry.active().is_available():
+        raise HTTPException(
+            status_code=503, 
+            detail="Modelo treinado não está disponível no momento"
+        )
+
+async def perform_trained_model_analysis(analysis: Analysis, db: Session, notify=None,
+                                         tta: Optional[bool] = None) -> dict:
     """
-    Endpoint para análise de mamografia com modelo treinado
+    Análise com o modelo treinado, compartilhada pelo endpoint síncrono e pelos jobs.
+    tta=True força o test-time augmentation, tta=False o desliga; None segue TTA_MODE
     """
-    try:
-        # Verificar se o modelo está disponível
-        if not model_service.is_available():
-            raise HTTPException(
-                status_code=503, 
-                detail="Modelo treinado não está disponível no momento"
-            )
-        
-        analysis = db.query(Analysis).filter(Analysis.id == analysis_id).first()
-        
-        if not analysis:
-            raise HTTPException(status_code=404, detail="Análise não encontrada")
+    # Uma única versão do modelo do início ao fim, mesmo se a versão ativa for trocada
+    with model_registry.lease() as model_service:
+        analysis_id = analysis.id
+        try:
+            # Atualizar status para processando
+            analysis.processing_status = "processing"
+            analysis.processing_date = datetime.utcnow()
+            db.commit()
+            if notify:
+                notify("processing")
         
-        if not os.path.exists(analysis.file_path):
-            raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+            # Resultado já em cache para esta imagem e este modelo: sem pré-processamento
+            cached = await run_bounded(cpu_executor, model_service.has_cached_result, analysis.image_hash, tta=tta)
         
-        # Atualizar status para processando
-        analysis.processing_status = "processing"
-        analysis.processing_date = datetime.utcnow()
-        db.commit()
+            # Pré-processamento (OpenCV) no pool de CPU, inferência no pool do modelo
+            preprocessed = None
+            if not cached:
+                preprocessed = await run_bounded(
+                    cpu_executor, model_service.preprocess_image, analysis.file_path, image_hash=analysis.image_hash
+                )
         
-        # Fazer análise com modelo treinado (gera visualização automaticamente)
-        result = model_service.predict(analysis.file_path, generate_viz=True)
+            # Fazer análise com modelo treinado; a visualização só é renderizada
+            # quando solicitada em /api/v1/analysis/{id}/visualization
+            result = await run_bounded(
+                inference_executor, model_service.predict, analysis.file_path,
+                generate_viz=False, preprocessed=preprocessed, image_hash=analysis.image_hash, tta=tta
+            )
         
-        if result["success"]:
-            # Salvar resultado no banco (usando o campo gemini_analysis por simplicidade)
-            # Em produção, você pode querer adicionar um campo específico para o modelo treinado
-            analysis.gemini_analysis = result["analysis"]
-            analysis.processing_status = "completed"
-            analysis.is_processed = True
-            analysis.confidence_score = result["probability"]
-            db.commit()
+            if result["success"]:
+                # Salvar resultado no banco (usando o campo gemini_analysis por simplicidade)
+                analysis.gemini_analysis = result["analysis"]
+                analysis.model_result = json.dumps({
+                    "prediction": result["prediction"],
+                    "probability": result["probability"],
+                    "confidence": result["confidence"],
+                    "tta": result["tta"],
+                    "visualization": result["visualization_state"]
+                })
+                analysis.model_version = model_service.version
+                analysis.processing_status = "completed"
+                analysis.is_processed = True
+                analysis.confidence_score = result["probability"]
+                db.commit()
+                visualization_cache.invalidate(analysis_id)
             
-            return {
-                "message": "Análise concluída com modelo treinado",
-                "analysis_id": analysis_id,
-                "filename": analysis.filename,
-                "visualization_filename": result.get("visualization_filename"),
-                "status": "completed",
-                "model": result["model"],
-                "prediction": result["prediction"],
-                "confidence": result["confidence"],
-                "probability": result["probability"],
-                "diagnostic_report": result["diagnostic_report"],
-                "analysis": result["analysis"]
-            }
-        else:
+                return {
+                    "message": "Análise concluída com modelo treinado",
+                    "analysis_id": analysis_id,
+                    "filename": analysis.filename,
+                    "visualization_url": visualization_url(analysis_id),
+                    "status": "completed",
+                    "model": result["model"],
+                    "model_version": model_service.version,
+                    "prediction": result["prediction"],
+                    "confidence": result["confidence"],
+                    "probability": result["probability"],
+                    "diagnostic_report": result["diagnostic_report"],
+                    "tta": result["tta"],
+                    "analysis": result["analysis"]
+                }
+            else:
+                analysis.processing_status = "error"
+                analysis.error_message = result.get("error", "Unknown error in trained model")
+                db.commit()
+            
+                raise HTTPException(
+                    status_code=500, 
+                    detail=f"Erro na análise: {result.get('error', 'Unknown error')}"
+                )
+        
+        except HTTPException as e:
+            if e.status_code == 503:
+                # Executor saturado: devolver a análise ao estado anterior
+                analysis.processing_status = "uploaded"
+                db.commit()
+            raise
+        except Exception as e:
             analysis.processing_status = "error"
-            analysis.error_message = result.get("error", "Unknown error in trained model")
+            analysis.error_message = str(e)
             db.commit()
-            
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Erro na análise: {result.get('error', 'Unknown error')}"
+            raise HTTPException(status_code=500, detail=f"Erro na análise: {str(e)}")
+
+# Endpoint para análise com modelo treinado
+@app.post("/api/v1/analyze-trained-model/{analysis_id}")
+async def analyze_with_trained_model(analysis_id: int, tta: Optional[bool] = None,
+                                     db: Session = Depends(get_db)):
+    """
+    Endpoint para análise de mamografia com modelo treinado
+    (?tta=true força o test-time augmentation, ?tta=false o desliga)
+    """
+    ensure_trained_model_available()
+    analysis = get_analysis_with_file(db, analysis_id)
+    return await perform_trained_model_analysis(analysis, db, tta=tta)
+
+# Jobs assíncronos de análise
+ANALYSIS_JOB_RUNNERS = {
+    "gemini": perform_gemini_analysis,
+    "huggingface": perform_huggingface_analysis,
+    "trained": perform_trained_model_analysis
+}
+
+def make_analysis_job_handler(runner):
+    """Cria o handler do job com sua própria sessão de banco"""
+    async def handler(job):
+        db = SessionLocal()
+        try:
+            analysis = get_analysis_with_file(db, job.analysis_id)
+            return await runner(
+                analysis, db,
+                notify=lambda status: job.publish(status, "Análise em processamento")
             )
+        finally:
+            db.close()
+    return handler
+
+@app.post("/api/v1/jobs/analyze/{analysis_id}", status_code=202)
+async def submit_analysis_job(analysis_id: int, model: str = "gemini", tta: Optional[bool] = None,
+                              db: Session = Depends(get_db)):
+    """
+    Enfileira a análise e retorna imediatamente o ID do job.
+    Acompanhe por GET /api/v1/jobs/{job_id} ou pelo stream SSE em
+    GET /api/v1/jobs/{job_id}/events (queued → processing → completed/error)
+    """
+    runner = ANALYSIS_JOB_RUNNERS.get(model)
+    if runner is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Modelo inválido. Opções: {', '.join(ANALYSIS_JOB_RUNNERS)}"
+        )
+    options = {}
+    if model == "trained":
+        ensure_trained_model_available()
+        runner = functools.partial(runner, tta=tta)
+        # Um job com tta=true não pode reaproveitar o resultado de um tta=false em andamento
+        options = {"tta": tta}
+    
+    # Validar antes de enfileirar para responder 404 imediatamente
+    get_analysis_with_file(db, analysis_id)
+    
+    try:
+        job = job_manager.submit(model, analysis_id, make_analysis_job_handler(runner), options)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    
+    return {
+        "message": "Análise enfileirada",
+        "job_id": job.id,
+        "analysis_id": analysis_id,
+        "model": model,
+        "status": job.status,
+        "status_url": f"/api/v1/jobs/{job.id}",
+        "events_url": f"/api/v1/jobs/{job.id}/events"
+    }
+
+@app.get("/api/v1/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, histórico de transições e resultado de um job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job.to_dict()
+
+@app.get("/api/v1/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Server-sent events com as transições de status do job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    
+    async def event_stream():
+        async for event in job.subscribe():
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: status\ndata: {json.dumps(event)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Desativa o buffering do nginx para que os eventos cheguem na hora
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+def convert_pgm_to_jpeg(file_path: str) -> bytes:
+    """
+    Converte imagem PGM para JPEG em memória (navegadores não exibem PGM)
+    
+    Args:
+        file_path: Caminho do arquivo PGM
+    
+    Returns:
+        bytes: Conteúdo JPEG
+    """
+    with Image.open(file_path) as img:
+        # Converter para RGB se necessário
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
         
-    except HTTPException:
-        raise
-    except Exception as e:
-        analysis.processing_status = "error"
-        analysis.error_message = str(e)
-        db.commit()
-        raise HTTPException(status_code=500, detail=f"Erro na análise: {str(e)}")
+        # Salvar como JPEG em memória
+        img_buffer = io.BytesIO()
+        img.save(img_buffer, format='JPEG', quality=95, optimize=False)
+        return img_buffer.getvalue()
 
-def convert_dicom_to_image(file_content: bytes, filename: str) -> tuple[bytes, dict]:
+def convert_dicom_to_image(file_content: Union[bytes, str], filename: str,
+                           image_hash: Optional[str] = None) -> tuple[bytes, dict, Optional[tuple]]:
     """
     Converte arquivo DICOM para formato de imagem suportado
     
     Args:
-        file_content: Conteúdo binário do arquivo DICOM
+        file_content: Conteúdo binário ou caminho do arquivo DICOM
         filename: Nome do arquivo original
+        image_hash: Hash do conteúdo; se informado (e DICOM_STORE_PIXELS), os
+            pixels originais são guardados para gerar outras janelas depois
     
     Returns:
-        tuple: (conteúdo da imagem convertida, informações do DICOM)
+        tuple: (conteúdo da imagem convertida, informações do DICOM, janela aplicada ou None)
     
     Raises:
         HTTPException: Se o arquivo DICOM for inválido
     """
     try:
-        # Carregar arquivo DICOM (usar force=True para arquivos sem cabeçalho completo)
-        dicom_file = pydicom.dcmread(io.BytesIO(file_content), force=True)
-        
-        # Extrair metadados importantes
-        dicom_info = {
-            "patient_id": str(dicom_file.get("PatientID", "N/A")),
-            "study_date": str(dicom_file.get("StudyDate", "N/A")),
-            "study_time": str(dicom_file.get("StudyTime", "N/A")),
-            "modality": str(dicom_file.get("Modality", "N/A")),
-            "body_part": str(dicom_file.get("BodyPartExamined", "N/A")),
-            "study_description": str(dicom_file.get("StudyDescription", "N/A")),
-            "series_description": str(dicom_file.get("SeriesDescription", "N/A")),
-            "manufacturer": str(dicom_file.get("Manufacturer", "N/A")),
-            "manufacturer_model": str(dicom_file.get("ManufacturerModelName", "N/A")),
-            "rows": int(dicom_file.get("Rows", 0)),
-            "columns": int(dicom_file.get("Columns", 0)),
-            "bits_allocated": int(dicom_file.get("BitsAllocated", 16)),
-            "photometric_interpretation": str(dicom_file.get("PhotometricInterpretation", "N/A")),
-            "window_center": str(dicom_file.get("WindowCenter", "N/A")),
-            "window_width": str(dicom_file.get("WindowWidth", "N/A"))
-        }
-        
-        # Obter pixel array
-        pixel_array = dicom_file.pixel_array
-        
-        # Aplicar windowing se disponível (processamento determinístico)
-        if hasattr(dicom_file, 'WindowCenter') and hasattr(dicom_file, 'WindowWidth'):
-            try:
-                # Garantir que WindowCenter e WindowWidth sejam valores únicos (não listas)
-                window_center = dicom_file.WindowCenter
-                window_width = dicom_file.WindowWidth
-                
-                if isinstance(window_center, (list, tuple)):
-                    window_center = float(window_center[0])
-                else:
-                    window_center = float(window_center)
-                
-                if isinstance(window_width, (list, tuple)):
-                    window_width = float(window_width[0])
-                else:
-                    window_width = float(window_width)
-                
-                # Aplicar windowing de forma consistente
-                min_val = window_center - window_width / 2
-                max_val = window_center + window_width / 2
-                
-                pixel_array = np.clip(pixel_array, min_val, max_val)
-                # Normalizar para 0-255 de forma determinística
-                pixel_min = pixel_array.min()
-                pixel_max = pixel_array.max()
-                if pixel_max > pixel_min:
-                    pixel_array = ((pixel_array - pixel_min) / (pixel_max - pixel_min) * 255).astype(np.uint8)
-                else:
-                    pixel_array = np.zeros_like(pixel_array, dtype=np.uint8)
-            except Exception as e:
-                print(f"⚠️  Erro no windowing DICOM, usando normalização padrão: {str(e)}")
-                # Se windowing falhar, normalizar diretamente de forma determinística
-                pixel_min = pixel_array.min()
-                pixel_max = pixel_array.max()
-                if pixel_max > pixel_min:
-                    pixel_array = ((pixel_array - pixel_min) / (pixel_max - pixel_min) * 255).astype(np.uint8)
-                else:
-                    pixel_array = np.zeros_like(pixel_array, dtype=np.uint8)
-        else:
-            # Normalizar para 0-255 de forma determinística
-            pixel_min = pixel_array.min()
-            pixel_max = pixel_array.max()
-            if pixel_max > pixel_min:
-                pixel_array = ((pixel_array - pixel_min) / (pixel_max - pixel_min) * 255).astype(np.uint8)
-            else:
-                pixel_array = np.zeros_like(pixel_array, dtype=np.uint8)
-        
-        # Converter para PIL Image
-        if len(pixel_array.shape) == 3:
-            # Imagem colorida
-            image = Image.fromarray(pixel_array)
-        else:
-            # Imagem em escala de cinza
-            image = Image.fromarray(pixel_array, mode='L')
+        # Uma única decodificação dos pixels; windowing por tabela (sem temporários float64)
+        original_pixels, dicom_info, window = dicom_processing.read_pixels(file_content)
+        pixel_array = dicom_processing.to_uint8(original_pixels, window)
+        if image_hash and dicom_processing.DICOM_STORE_PIXELS:
+            dicom_pixels.save(image_hash, original_pixels)
+        del original_pixels
         
-        # Converter para RGB se necessário
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Salvar como JPEG em memória (qualidade fixa para consistência)
-        img_buffer = io.BytesIO()
-        image.save(img_buffer, format='JPEG', quality=95, optimize=False)  # optimize=False para consistência
-        img_content = img_buffer.getvalue()
+        # JPEG RGB em memória (qualidade fixa para consistência)
+        img_content = dicom_processing.to_jpeg(pixel_array)
         
         print(f"✅ DICOM convertido com sucesso: {dicom_info['rows']}x{dicom_info['columns']}px")
         print(f"📋 Modalidade: {dicom_info['modality']}, Parte do corpo: {dicom_info['body_part']}")
         
-        return img_content, dicom_info
+        return img_content, dicom_info, window
         
     except InvalidDicomError:
         raise HTTPException(
@@ -869,126 +1418,15 @@ def convert_dicom_to_image(file_content: bytes, filename: str) -> tuple[bytes, d
             detail=f"Erro ao processar arquivo DICOM: {str(e)}"
         )
 
-def validate_and_process_image(file_content: bytes, filename: str) -> dict:
+def validate_and_process_image(file_path: str, filename: str) -> dict:
     """
-    Valida e processa imagem de mamografia com redimensionamento e otimização.
+    Valida a imagem de mamografia lendo apenas o cabeçalho (UPLOAD_VALIDATION=header);
+    a imagem otimizada é gerada depois, sob demanda (services/derivatives.py).
     """
     try:
-        # Tratamento especial para arquivos DICOM
-        if filename.lower().endswith('.dcm'):
-            print("🏥 Processando arquivo DICOM...")
-            # Ler arquivo DICOM da memória
-            dataset = pydicom.dcmread(io.BytesIO(file_content))
-            
-            # Converter para array e normalizar (processamento determinístico)
-            pixel_array = dataset.pixel_array
-            
-            # Normalizar para 0-255 de forma consistente
-            pixel_min = pixel_array.min()
-            pixel_max = pixel_array.max()
-            if pixel_max > pixel_min:
-                normalized_image = ((pixel_array - pixel_min) / 
-                                 (pixel_max - pixel_min) * 255).astype('uint8')
-            else:
-                normalized_image = np.zeros_like(pixel_array, dtype=np.uint8)
-            
-            # Converter para imagem PIL
-            image = Image.fromarray(normalized_image)
-            
-            # Converter para RGB
-            image = image.convert('RGB')
-            print("🎨 Convertido DICOM para RGB")
-            
-            original_width, original_height = image.size
-        else:
-            # Processamento normal para outros tipos de imagem
-            image = Image.open(io.BytesIO(file_content))
-            original_width, original_height = image.size
-        
-        # Tratamento especial para PGM
-        if filename.lower().endswith('.pgm'):
-            print(f"🖼️ Processando imagem PGM: modo={image.mode}")
-            # Converter para RGB mantendo informações da escala de cinza
-            if image.mode in ['L', 'I']:
-                image = image.convert('RGB')
-                print("🎨 Convertido PGM para RGB")
-
-        # Verificar tamanho mínimo
-        min_width, min_height = 100, 100
-        # Limite aumentado para 8000x8000 para suportar imagens de alta resolução
-        # O modelo treinado redimensiona internamente para 224x224, então aceita qualquer tamanho
-        max_width, max_height = 8000, 8000
-
-        # Verificar tamanho mínimo
-        if original_width < min_width or original_height < min_height:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Imagem muito pequena. Mínimo de {min_width}x{min_height}px"
-            )
-        
-        # Se imagem for muito grande, redimensionar automaticamente
-        was_resized = False
-        if original_width > max_width or original_height > max_height:
-            print(f"📏 Imagem grande detectada: {original_width}x{original_height}px")
-            print(f"🔄 Redimensionando automaticamente para máximo {max_width}x{max_height}px...")
-            
-            # Calcular nova dimensão mantendo proporção
-            ratio = min(max_width / original_width, max_height / original_height)
-            new_width = int(original_width * ratio)
-            new_height = int(original_height * ratio)
-            
-            print(f"📐 Nova dimensão: {new_width}x{new_height}px (proporção: {ratio:.2f})")
-            
-            # Redimensionar com alta qualidade
-            image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            was_resized = True
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Erro ao processar imagem: {str(e)}"
-        )
-
-    # 🚨 CORREÇÃO PGM: Converte para RGB se necessário (inclui imagens PGM que são L ou I)
-    if image.mode != "RGB":
-        print(f"🎨 Convertendo imagem de {image.mode} para RGB para consistência com modelos de IA...")
-        image = image.convert("RGB")
-
-    # Otimizações para análise
-    image = ImageOps.autocontrast(image)
-    
-    # Ajustar brilho e contraste para melhor análise
-    enhancer = ImageEnhance.Contrast(image)
-    image = enhancer.enhance(1.2)  # Aumentar contraste em 20%
-    
-    enhancer = ImageEnhance.Brightness(image)
-    image = enhancer.enhance(1.1)  # Aumentar brilho em 10%
-
-    # Resolução otimizada para análise de IA
-    final_max_size = (2048, 2048)  # Tamanho ideal para IA
-    current_width, current_height = image.size
-    
-    if current_width > final_max_size[0] or current_height > final_max_size[1]:
-        print(f"🎯 Otimizando para análise de IA: {current_width}x{current_height}px → {final_max_size[0]}x{final_max_size[1]}px")
-        image.thumbnail(final_max_size, Image.Resampling.LANCZOS)
-        current_width, current_height = image.size
-        was_resized = True
-
-    # Informações da imagem processada
-    processed_info = {
-        "dimensions": (current_width, current_height),
-        "format": image.format,
-        "mode": image.mode,
-        # Aqui, 2048x2048 é o limite ideal para IA (não 1024)
-        "is_optimized": current_width <= final_max_size[0] and current_height <= final_max_size[1],
-        "was_resized": was_resized,
-        "original_dimensions": (original_width, original_height)
-    }
-    
-    if was_resized:
-        print(f"✅ Imagem processada: {original_width}x{original_height}px → {current_width}x{current_height}px")
-    
-    return processed_info
+        return ingest_service.validate_image(file_path, filename)
+    except ingest_service.InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 if __name__ == "__main__":
     print("🚀 Iniciando aplicação FastAPI...")
@@ -0,0 +1,908 @@
+#!/usr/bin/env python3
+"""
+Benchmarks de desempenho - Mamografia IA
+Mede latência e throughput dos principais caminhos do backend
+
+Uso:
+    python benchmark.py <comando> [opções]
+    python benchmark.py --help
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from services.synthetic import create_synthetic_dicom, create_synthetic_mammogram
+
+DEFAULT_MODEL_PATH = str(Path(__file__).parent / "best_cbis_ddsm_model.keras")
+
+
+def summarize_ms(samples: List[float]) -> Dict[str, float]:
+    """Resume amostras (em segundos) como p50/p99/média em milissegundos"""
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "n": len(values),
+        "p50": float(np.percentile(values, 50)),
+        "p99": float(np.percentile(values, 99)),
+        "mean": float(values.mean()),
+    }
+
+
+def print_latency_table(title: str, results: Dict[str, List[float]]):
+    """Imprime tabela de latências"""
+    print("\n" + "=" * 70)
+    print(title)
+    print("=" * 70)
+    print(f"{'cenário':<28}{'n':>6}{'p50 (ms)':>12}{'p99 (ms)':>12}{'média (ms)':>12}")
+    for name, samples in results.items():
+        stats = summarize_ms(samples)
+        print(f"{name:<28}{stats['n']:>6}{stats['p50']:>12.1f}{stats['p99']:>12.1f}{stats['mean']:>12.1f}")
+    print("=" * 70)
+
+
+def resolve_image(args, workdir: str) -> str:
+    """Usa a imagem informada ou gera uma sintética"""
+    if getattr(args, "image", None):
+        return args.image
+    return create_synthetic_mammogram(os.path.join(workdir, "synthetic_mammogram.png"))
+
+
+def bench_model_latency(args):
+    """Latência por predição: modelo frio (carrega/descarrega) vs. residente"""
+    from services.model_service import ModelService
+
+    if not os.path.exists(args.model):
+        print(f"❌ Modelo não encontrado: {args.model}")
+        return 1
+
+    with tempfile.TemporaryDirectory() as workdir:
+        image_path = resolve_image(args, workdir)
+        results = {}
+
+        for policy in ("on_demand", "resident"):
+            service = ModelService(args.model, residency=policy, idle_timeout=0)
+            if policy == "resident":
+                service.warmup()
+            samples = []
+            for _ in range(args.iterations):
+                start = time.perf_counter()
+                result = service.predict(image_path, generate_viz=False)
+                samples.append(time.perf_counter() - start)
+                if not result.get("success"):
+                    print(f"❌ Predição falhou: {result.get('error')}")
+                    return 1
+            service.shutdown()
+            label = "frio (on_demand)" if policy == "on_demand" else "quente (resident)"
+            results[label] = samples
+
+        print_latency_table("LATÊNCIA POR PREDIÇÃO - MODELO FRIO vs. QUENTE", results)
+    return 0
+
+
+def bench_batching(args):
+    """Throughput com clientes concorrentes: forward pass individual vs. micro-batching"""
+    from concurrent.futures import ThreadPoolExecutor
+    from services.model_service import ModelService
+    from services.inference_batcher import InferenceBatcher
+
+    if not os.path.exists(args.model):
+        print(f"❌ Modelo não encontrado: {args.model}")
+        return 1
+
+    with tempfile.TemporaryDirectory() as workdir:
+        image_path = resolve_image(args, workdir)
+        service = ModelService(args.model, residency="resident", idle_timeout=0, batching=False)
+        service.warmup()
+        tensor = service.preprocess_image(image_path)
+
+        def run(infer_fn) -> Tuple[float, List[float]]:
+            latencies = []
+
+            def one_request(_):
+                start = time.perf_counter()
+                infer_fn(tensor)
+                latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                list(pool.map(one_request, range(args.requests)))
+            return time.perf_counter() - start, latencies
+
+        single_elapsed, single_latencies = run(lambda t: service.predict_with_heatmap_batch(t)[0])
+
+        batcher = InferenceBatcher(service.predict_with_heatmap_batch, max_batch_size=args.max_batch_size,
+                                   max_wait_ms=args.max_wait_ms)
+        batched_elapsed, batched_latencies = run(batcher.infer)
+        stats = batcher.get_stats()
+        batcher.close()
+        service.shutdown()
+
+    print_latency_table(f"LATÊNCIA COM {args.concurrency} CLIENTES CONCORRENTES", {
+        "batch de 1": single_latencies,
+        f"micro-batching (N={args.max_batch_size})": batched_latencies,
+    })
+    print(f"Throughput batch de 1:     {args.requests / single_elapsed:8.1f} img/s")
+    print(f"Throughput micro-batching: {args.requests / batched_elapsed:8.1f} img/s")
+    print(f"Histograma de tamanho de lote: {stats['batch_size_histogram']}")
+    print(f"Espera na fila (ms): p50={stats['queue_wait_ms']['p50']} p99={stats['queue_wait_ms']['p99']}")
+    return 0
+
+
+def bench_gradcam(args):
+    """Latência do Grad-CAM: sub-modelos reconstruídos a cada chamada vs. grafo em cache"""
+    from predict import get_gradcam_heatmap as legacy_gradcam_heatmap
+    from services.model_service import ModelService
+
+    if not os.path.exists(args.model):
+        print(f"❌ Modelo não encontrado: {args.model}")
+        return 1
+
+    with tempfile.TemporaryDirectory() as workdir:
+        image_path = resolve_image(args, workdir)
+        service = ModelService(args.model, residency="resident", idle_timeout=0, batching=False)
+        service.warmup()
+        tensor = service.preprocess_image(image_path)
+
+        legacy_samples, cached_samples = [], []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            legacy_heatmap = legacy_gradcam_heatmap(service.model, tensor)
+            legacy_samples.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            cached_heatmap = service.get_gradcam_heatmap(tensor)
+            cached_samples.append(time.perf_counter() - start)
+        service.shutdown()
+
+    print_latency_table("LATÊNCIA DO GRAD-CAM", {
+        "reconstrução por chamada": legacy_samples,
+        "grafo em cache": cached_samples,
+    })
+    print(f"Diferença máxima entre heatmaps: {float(np.abs(legacy_heatmap - cached_heatmap).max()):.2e}")
+    return 0
+
+
+def bench_visualization(args):
+    """Renderização da visualização: figura matplotlib 18x6 @300dpi vs. compositor OpenCV"""
+    import cv2
+    from predict import visualize_prediction as legacy_visualize
+    from services.model_service import ModelService
+
+    with tempfile.TemporaryDirectory() as workdir:
+        image_path = resolve_image(args, workdir)
+        target_size = (224, 224)
+        rng = np.random.default_rng(0)
+        heatmap = cv2.GaussianBlur(rng.random(target_size, dtype=np.float32), (0, 0), 12)
+        heatmap = (heatmap - heatmap.min()) / (heatmap.max() - heatmap.min())
+        # O modelo não é carregado: só os métodos de visualização são usados
+        service = ModelService(residency="on_demand", batching=False)
+        bbox = service.find_roi_bbox(heatmap, threshold=0.5) or (56, 56, 112, 112)
+        report = service.generate_diagnostic_report("Malignant", 0.73, 0.73)
+
+        results, sizes = {}, {}
+        legacy_dir = os.path.join(workdir, "legacy")
+        os.makedirs(legacy_dir)
+        legacy_path = os.path.join(legacy_dir, "legacy_diagnosis.jpg")
+        samples = []
+        for _ in range(args.legacy_iterations):
+            start = time.perf_counter()
+            legacy_visualize(image_path, heatmap, bbox, report, output_path=legacy_path, target_size=target_size)
+            samples.append(time.perf_counter() - start)
+        results["matplotlib 300dpi (jpg)"] = samples
+        sizes["matplotlib 300dpi (jpg)"] = (os.path.getsize(legacy_path), cv2.imread(legacy_path).shape)
+
+        for fmt in args.formats:
+            output_dir = os.path.join(workdir, fmt)
+            os.makedirs(output_dir)
+            samples = []
+            for _ in range(args.iterations):
+                start = time.perf_counter()
+                output_path = service.generate_visualization(image_path, heatmap, bbox, report, output_dir=output_dir,
+                                                             target_size=target_size, panel_size=args.panel_size,
+                                                             fmt=fmt)
+                samples.append(time.perf_counter() - start)
+            label = f"opencv {args.panel_size}px ({fmt})"
+            results[label] = samples
+            sizes[label] = (os.path.getsize(output_path), cv2.imread(output_path).shape)
+
+    print_latency_table("RENDERIZAÇÃO DA VISUALIZAÇÃO", results)
+    for label, (size, shape) in sizes.items():
+        print(f"{label:<28}{shape[1]:>6}x{shape[0]:<6}{size / 1024:>10.0f} KB")
+    return 0
+
+
+def bench_preprocessing(args):
+    """Throughput do pré-processamento: pipeline original sequencial vs. preprocess_batch"""
+    import contextlib
+    import io
+    from predict import preprocess_image as legacy_preprocess_image
+    from services.preprocessing import preprocess_batch
+
+    cores = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as workdir:
+        height, width = args.size
+        paths = [
+            create_synthetic_mammogram(os.path.join(workdir, f"{i}.png"), size=(height, width), seed=i)
+            for i in range(args.images)
+        ]
+
+        # O pipeline original imprime uma linha por imagem
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            expected = np.concatenate([legacy_preprocess_image(path, segmentation="full") for path in paths])
+            legacy_elapsed = time.perf_counter() - start
+
+        rows = [("original (sequencial)", 1, legacy_elapsed)]
+        for workers in args.workers:
+            preprocess_batch(paths[:workers], workers=workers, segmentation="full")  # aquecimento
+            start = time.perf_counter()
+            batch = preprocess_batch(paths, workers=workers, segmentation="full")
+            rows.append(("preprocess_batch", workers, time.perf_counter() - start))
+            if not np.array_equal(batch, expected):
+                print(f"❌ Saída diferente do pipeline original com {workers} workers")
+                return 1
+
+    print("\n" + "=" * 70)
+    print(f"PRÉ-PROCESSAMENTO - {args.images} imagens {width}x{height}, {cores} núcleo(s)")
+    print("=" * 70)
+    print(f"{'cenário':<28}{'workers':>8}{'img/s':>10}{'img/s/núcleo':>14}{'ms/img':>10}")
+    for name, workers, elapsed in rows:
+        throughput = args.images / elapsed
+        per_core = throughput / min(workers, cores)
+        print(f"{name:<28}{workers:>8}{throughput:>10.1f}{per_core:>14.1f}{elapsed / args.images * 1000:>10.1f}")
+    print("=" * 70)
+    print(f"Tensor: {batch.shape} {batch.dtype} (idêntico ao pipeline original)")
+    return 0
+
+
+def bench_segmentation(args):
+    """Pré-processamento de imagens grandes: segmentação na resolução original vs. reduzida"""
+    import contextlib
+    import io
+    import tracemalloc
+    import cv2
+    from predict import preprocess_image as legacy_preprocess_image
+    from services.preprocessing import bbox_iou, find_tissue_bbox, preprocess_image
+
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for height, width in args.sizes or [(3000, 2400), (8000, 6000)]:
+            path = create_synthetic_mammogram(os.path.join(workdir, f"{height}x{width}.png"), size=(height, width))
+            boxes = {}
+            runners = {
+                "original (RGB)": lambda: legacy_preprocess_image(path, segmentation="full"),
+                "full": lambda: preprocess_image(path, segmentation="full"),
+                "downscale": lambda: preprocess_image(path, segmentation="downscale"),
+            }
+            for mode, run in runners.items():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    samples = []
+                    for _ in range(args.iterations):
+                        start = time.perf_counter()
+                        run()
+                        samples.append(time.perf_counter() - start)
+
+                    # Pico de memória das alocações NumPy/OpenCV durante uma chamada
+                    tracemalloc.start()
+                    run()
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                rows.append((f"{width}x{height}", mode, summarize_ms(samples)["p50"], peak / 2 ** 20))
+
+            gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            start = time.perf_counter()
+            boxes["full"] = find_tissue_bbox(gray, "full")
+            rows.append((f"{width}x{height}", "só caixa: full", (time.perf_counter() - start) * 1000, None))
+            start = time.perf_counter()
+            boxes["downscale"] = find_tissue_bbox(gray, "downscale")
+            rows.append((f"{width}x{height}", "só caixa: down", (time.perf_counter() - start) * 1000, None))
+            rows.append((f"{width}x{height}", "IoU da caixa", bbox_iou(boxes["full"], boxes["downscale"]), None))
+
+    print("\n" + "=" * 70)
+    print("PRÉ-PROCESSAMENTO DE IMAGENS GRANDES - SEGMENTAÇÃO")
+    print("=" * 70)
+    print(f"{'imagem':<14}{'modo':<18}{'p50 (ms)':>12}{'pico (MB)':>12}")
+    for size, mode, value, peak in rows:
+        if mode == "IoU da caixa":
+            print(f"{size:<14}{mode:<18}{value:>12.4f}")
+        elif peak is None:
+            print(f"{size:<14}{mode:<18}{value:>12.1f}")
+        else:
+            print(f"{size:<14}{mode:<18}{value:>12.1f}{peak:>12.1f}")
+    print("=" * 70)
+    return 0
+
+
+def _backend_worker(backend: str, model_path: str, image_path: str, iterations: int, queue):
+    """Executado em um processo novo: carga, memória e latência de um backend"""
+    import contextlib
+    import io
+    from services.model_service import ModelService, get_process_rss_mb
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        baseline_mb = get_process_rss_mb()
+        service = ModelService(model_path, residency="resident", idle_timeout=0, batching=False, backend=backend)
+        img = service.preprocess_image(image_path)
+        start = time.perf_counter()
+        with service._use_model():
+            load_s = time.perf_counter() - start
+            service.predict_with_heatmap_batch(img)  # aquecimento
+            samples = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                service.predict_with_heatmap_batch(img)
+                samples.append(time.perf_counter() - start)
+            rss_mb = get_process_rss_mb()
+        service.shutdown()
+    queue.put({"load_s": load_s, "rss_mb": rss_mb, "model_mb": rss_mb - baseline_mb, "samples": samples})
+
+
+def bench_backends(args):
+    """Backend Keras vs. TFLite: tempo de carga, memória residente e latência (probabilidade + Grad-CAM)"""
+    import multiprocessing
+
+    if not os.path.exists(args.model):
+        print(f"❌ Modelo não encontrado: {args.model}")
+        return 1
+
+    with tempfile.TemporaryDirectory() as workdir:
+        image_path = resolve_image(args, workdir)
+        backends = [("keras", "keras", args.model)]
+        for path in args.tflite:
+            backends.append((f"tflite {Path(path).name}", "tflite", path))
+        if not args.tflite:
+            from convert_model import convert_to_tflite
+            for quantization in ("dynamic", "float16"):
+                path = os.path.join(workdir, f"model.{quantization}.tflite")
+                print(f"🔄 Convertendo para TFLite ({quantization})...")
+                convert_to_tflite(args.model, path, quantization)
+                backends.append((f"tflite {quantization}", "tflite", path))
+
+        # Um processo por backend: o RSS medido não mistura os dois runtimes
+        context = multiprocessing.get_context("spawn")
+        rows = []
+        for label, backend, path in backends:
+            queue = context.Queue()
+            process = context.Process(target=_backend_worker,
+                                      args=(backend, path, image_path, args.iterations, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            rows.append((label, os.path.getsize(path) / 2 ** 20, result))
+
+    print("\n" + "=" * 70)
+    print("BACKENDS DE INFERÊNCIA - KERAS vs. TFLITE")
+    print("=" * 70)
+    print(f"{'backend':<24}{'arquivo':>9}{'carga':>8}{'RSS':>8}{'modelo':>8}{'p50':>7}{'p99':>7}")
+    print(f"{'':<24}{'(MB)':>9}{'(s)':>8}{'(MB)':>8}{'(MB)':>8}{'(ms)':>7}{'(ms)':>7}")
+    for label, file_mb, result in rows:
+        stats = summarize_ms(result["samples"])
+        print(f"{label:<24}{file_mb:>9.1f}{result['load_s']:>8.2f}{result['rss_mb']:>8.0f}"
+              f"{result['model_mb']:>8.0f}{stats['p50']:>7.1f}{stats['p99']:>7.1f}")
+    print("=" * 70)
+    print("Desvio de precisão: python convert_model.py --images <diretório>")
+    return 0
+
+
+def _threads_worker(model_path: str, intra: int, inter: int, image_path: str, iterations: int,
+                    batch_size: int, queue):
+    """Executado em um processo novo: o TensorFlow só aceita threads antes da primeira operação"""
+    import contextlib
+    import io
+    os.environ["TF_INTRA_OP_THREADS"] = str(intra)
+    os.environ["TF_INTER_OP_THREADS"] = str(inter)
+    from services.model_service import ModelService
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        service = ModelService(model_path, residency="resident", idle_timeout=0, batching=False, backend="keras")
+        img = service.preprocess_image(image_path)
+        batch = np.repeat(img, batch_size, axis=0)
+        with service._use_model():
+            # Aquecimento dos dois formatos de entrada
+            service.predict_with_heatmap_batch(img)
+            service.predict_with_heatmap_batch(batch)
+            samples = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                service.predict_with_heatmap_batch(img)
+                samples.append(time.perf_counter() - start)
+            rounds = max(1, iterations // 4)
+            start = time.perf_counter()
+            for _ in range(rounds):
+                service.predict_with_heatmap_batch(batch)
+            throughput = rounds * batch_size / (time.perf_counter() - start)
+        service.shutdown()
+    queue.put({"p50_ms": summarize_ms(samples)["p50"], "throughput": throughput})
+
+
+def recommend_profile(results: Dict[Tuple[int, int], Dict[str, float]], cores: int) -> str:
+    """
+    Perfil recomendado a partir da varredura: "shared-host" se mais threads
+    não compensam, senão o perfil com melhor throughput ou latência
+    """
+    from services.execution_profile import profile_settings
+
+    def measured(profile: str) -> Dict[str, float]:
+        settings = profile_settings(profile, cores)
+        return results[(settings["TF_INTRA_OP_THREADS"], settings["TF_INTER_OP_THREADS"])]
+
+    best_latency = min(r["p50_ms"] for r in results.values())
+    best_throughput = max(r["throughput"] for r in results.values())
+    shared = measured("shared-host")
+    if shared["p50_ms"] <= 1.15 * best_latency and shared["throughput"] >= 0.87 * best_throughput:
+        return "shared-host"
+    if measured("throughput")["throughput"] > 1.1 * measured("latency")["throughput"]:
+        return "throughput"
+    return "latency"
+
+
+def bench_threads(args):
+    """Varredura de threads intra/inter-op do TensorFlow e recomendação de perfil"""
+    import multiprocessing
+    from services.execution_profile import EXECUTION_PROFILES, available_cores, profile_settings
+
+    if not os.path.exists(args.model):
+        print(f"❌ Modelo não encontrado: {args.model}")
+        return 1
+
+    cores = available_cores()
+    intra_values = set(args.intra or [])
+    if not intra_values:
+        intra_values = {n for n in (1, 2, 4, 8, 16, 32) if n <= cores} | {cores}
+    configs = {(intra, inter) for intra in intra_values for inter in args.inter}
+    # Sempre medir as configurações dos perfis, para poder recomendar um deles
+    for profile in EXECUTION_PROFILES:
+        settings = profile_settings(profile, cores)
+        configs.add((settings["TF_INTRA_OP_THREADS"], settings["TF_INTER_OP_THREADS"]))
+
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as workdir:
+        image_path = resolve_image(args, workdir)
+        for intra, inter in sorted(configs):
+            print(f"⏱️ intra={intra} inter={inter}...")
+            queue = context.Queue()
+            process = context.Process(target=_threads_worker, args=(
+                args.model, intra, inter, image_path, args.iterations, args.batch_size, queue
+            ))
+            process.start()
+            results[(intra, inter)] = queue.get()
+            process.join()
+
+    profiles_by_config = {}
+    for profile in EXECUTION_PROFILES:
+        settings = profile_settings(profile, cores)
+        profiles_by_config.setdefault((settings["TF_INTRA_OP_THREADS"], settings["TF_INTER_OP_THREADS"]),
+                                      []).append(profile)
+
+    print("\n" + "=" * 70)
+    print(f"THREADS DO TENSORFLOW - {cores} NÚCLEO(S) DISPONÍVEL(IS)")
+    print("=" * 70)
+    print(f"{'intra':>6}{'inter':>6}{'p50 lote=1 (ms)':>18}{f'img/s lote={args.batch_size}':>16}  perfil")
+    for (intra, inter), result in sorted(results.items()):
+        profiles = ", ".join(profiles_by_config.get((intra, inter), []))
+        print(f"{intra:>6}{inter:>6}{result['p50_ms']:>18.1f}{result['throughput']:>16.1f}  {profiles}")
+    print("=" * 70)
+    print(f"Perfil recomendado para esta máquina: EXECUTION_PROFILE={recommend_profile(results, cores)}")
+    return 0
+
+
+def bench_inference_call(args):
+    """Sobrecarga por chamada: model.predict vs. forward pass compilado (tf.function, opcionalmente XLA)"""
+    import tensorflow as tf
+    from services.model_service import ModelService
+
+    if not os.path.exists(args.model):
+        print(f"❌ Modelo não encontrado: {args.model}")
+        return 1
+
+    with tempfile.TemporaryDirectory() as workdir:
+        image_path = resolve_image(args, workdir)
+        services = {
+            "tf.function": ModelService(args.model, residency="resident", idle_timeout=0, batching=False,
+                                        jit_compile=False),
+            "tf.function + XLA": ModelService(args.model, residency="resident", idle_timeout=0, batching=False,
+                                              jit_compile=True),
+        }
+        tensor = services["tf.function"].preprocess_image(image_path)
+        batch = np.repeat(tensor, args.batch_size, axis=0)
+        for service in services.values():
+            service.warmup()
+            service.predict_proba_batch(batch)
+
+        model = services["tf.function"].model
+        model.predict(batch, verbose=0)
+        calls = {
+            "model.predict": lambda: model.predict(batch, verbose=0)[:, 0],
+            "model(x) eager": lambda: model(tf.convert_to_tensor(batch), training=False).numpy()[:, 0],
+            **{name: (lambda s=service: s.predict_proba_batch(batch)) for name, service in services.items()},
+        }
+        results = {name: [] for name in calls}
+        outputs = {}
+        for _ in range(args.iterations):
+            for name, call in calls.items():
+                start = time.perf_counter()
+                outputs[name] = call()
+                results[name].append(time.perf_counter() - start)
+        for service in services.values():
+            service.shutdown()
+
+    print_latency_table(f"SOBRECARGA POR CHAMADA DE INFERÊNCIA (lote de {args.batch_size})", results)
+    baseline = summarize_ms(results["model.predict"])["p50"]
+    for name in calls:
+        p50 = summarize_ms(results[name])["p50"]
+        diff = float(np.abs(outputs[name] - outputs["model.predict"]).max())
+        print(f"{name:<20} p50 {p50 - baseline:+8.1f} ms vs. model.predict   desvio máx. {diff:.1e}")
+    return 0
+
+
+def _legacy_validate_and_process_image(path: str) -> dict:
+    """Validação do upload antes da leitura só do cabeçalho: realce e redimensionamento descartados"""
+    from PIL import Image, ImageEnhance, ImageOps
+
+    image = Image.open(path)
+    original_width, original_height = image.size
+    if original_width > 8000 or original_height > 8000:
+        ratio = min(8000 / original_width, 8000 / original_height)
+        image = image.resize((int(original_width * ratio), int(original_height * ratio)), Image.Resampling.LANCZOS)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image = ImageOps.autocontrast(image)
+    image = ImageEnhance.Contrast(image).enhance(1.2)
+    image = ImageEnhance.Brightness(image).enhance(1.1)
+    image.thumbnail((2048, 2048), Image.Resampling.LANCZOS)
+    return {"dimensions": image.size, "original_dimensions": (original_width, original_height)}
+
+
+def bench_upload(args):
+    """Latência do upload (cópia em blocos + hash + validação) e custo da imagem otimizada"""
+    import asyncio
+    import contextlib
+    import io
+    import cv2
+    from fastapi import UploadFile
+    from services.derivatives import render_derivative
+    from services.ingest_service import spool_upload, validate_image
+
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for label, (height, width) in (("4k", (4096, 3328)), ("8k", (8192, 6656))):
+            source = create_synthetic_mammogram(os.path.join(workdir, f"{label}.png"), size=(height, width))
+            for fmt in args.formats:
+                path = source
+                if fmt == "jpg":
+                    path = os.path.join(workdir, f"{label}.jpg")
+                    cv2.imwrite(path, cv2.imread(source, cv2.IMREAD_GRAYSCALE), [cv2.IMWRITE_JPEG_QUALITY, 95])
+                with open(path, "rb") as f:
+                    data = f.read()
+                filename = os.path.basename(path)
+
+                def upload_with(validate):
+                    async def run():
+                        upload = await spool_upload(UploadFile(io.BytesIO(data), filename=filename), workdir, len(data))
+                        with upload:
+                            return validate(upload.path)
+                    return asyncio.run(run())
+
+                runners = {
+                    "original (realce descartado)": lambda: upload_with(_legacy_validate_and_process_image),
+                    "header": lambda: upload_with(lambda p: validate_image(p, filename, "header")),
+                    "decode": lambda: upload_with(lambda p: validate_image(p, filename, "decode")),
+                    "imagem otimizada (2º plano)": lambda: render_derivative(path),
+                }
+                for mode, run in runners.items():
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        samples = []
+                        for _ in range(args.iterations):
+                            start = time.perf_counter()
+                            run()
+                            samples.append(time.perf_counter() - start)
+                    rows.append((f"{label} {fmt} {width}x{height}", mode, summarize_ms(samples)["p50"], len(data)))
+
+    print("\n" + "=" * 78)
+    print("LATÊNCIA DO UPLOAD - VALIDAÇÃO POR CABEÇALHO VS. PIPELINE ORIGINAL")
+    print("=" * 78)
+    print(f"{'imagem':<24}{'arquivo (MB)':>13}  {'etapa':<30}{'p50 (ms)':>10}")
+    for image, mode, p50, size in rows:
+        print(f"{image:<24}{size / 2 ** 20:>13.1f}  {mode:<30}{p50:>10.1f}")
+    print("=" * 78)
+    return 0
+
+
+def bench_ingest(args):
+    """Throughput da ingestão: uploads individuais vs. /api/v1/upload/batch (arquivos e ZIP)"""
+    import contextlib
+    import io
+    import zipfile
+    import cv2
+
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        # Conjunto no formato do MIAS: PGM 1024x1024 em tons de cinza
+        images = []
+        for i in range(args.files):
+            path = create_synthetic_mammogram(os.path.join(workdir, f"mdb{i:03d}.png"), size=(1024, 1024), seed=i)
+            pgm_path = path[:-4] + ".pgm"
+            cv2.imwrite(pgm_path, cv2.imread(path, cv2.IMREAD_GRAYSCALE))
+            with open(pgm_path, "rb") as f:
+                images.append((os.path.basename(pgm_path), f.read()))
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as z:
+            for name, data in images:
+                z.writestr(f"mias/{name}", data)
+
+        # Banco e uploads/ temporários (app.py usa o banco do diretório atual)
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        os.environ["DERIVATIVE_PREFETCH"] = "false"
+        os.environ.setdefault("MODEL_WARMUP", "false")
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                import app as backend
+                from fastapi.testclient import TestClient
+            upload_dir = os.path.join(workdir, "uploads")
+            os.makedirs(upload_dir)
+            backend.UPLOAD_DIR = upload_dir
+
+            def reset():
+                # Conteúdo novo a cada rodada: sem deduplicação contra a rodada anterior
+                with backend.SessionLocal() as db:
+                    db.query(backend.Analysis).delete()
+                    db.commit()
+                for name in os.listdir(upload_dir):
+                    os.remove(os.path.join(upload_dir, name))
+
+            runners = {
+                "individual (1 por requisição)": lambda client: [
+                    client.post("/api/v1/upload", files={"file": (name, data, "image/x-portable-graymap")})
+                    for name, data in images
+                ],
+                "lote (arquivos)": lambda client: client.post(
+                    "/api/v1/upload/batch",
+                    files=[("files", (name, data, "image/x-portable-graymap")) for name, data in images]
+                ),
+                "lote (ZIP)": lambda client: client.post(
+                    "/api/v1/upload/batch", files=[("files", ("mias.zip", archive.getvalue(), "application/zip"))]
+                ),
+            }
+            with TestClient(backend.app) as client, contextlib.redirect_stdout(io.StringIO()):
+                for mode, run in runners.items():
+                    samples = []
+                    for _ in range(args.iterations):
+                        reset()
+                        start = time.perf_counter()
+                        run(client)
+                        samples.append(time.perf_counter() - start)
+                    with backend.SessionLocal() as db:
+                        assert db.query(backend.Analysis).count() == args.files
+                    p50 = summarize_ms(samples)["p50"]
+                    rows.append((mode, p50, args.files / (p50 / 1000)))
+                reset()
+        finally:
+            os.chdir(cwd)
+
+    print("\n" + "=" * 70)
+    print(f"INGESTÃO DE {args.files} IMAGENS PGM 1024x1024 (formato MIAS)")
+    print("=" * 70)
+    print(f"{'modo':<32}{'p50 (ms)':>12}{'arquivos/s':>14}")
+    for mode, p50, throughput in rows:
+        print(f"{mode:<32}{p50:>12.1f}{throughput:>14.1f}")
+    print("=" * 70)
+    return 0
+
+
+def _legacy_decode_dicom(path: str) -> np.ndarray:
+    """Conversão DICOM original: pixel_array + windowing e normalização em float64 no quadro inteiro"""
+    import pydicom
+
+    dicom_file = pydicom.dcmread(path, force=True)
+    pixel_array = dicom_file.pixel_array
+    window_center, window_width = float(dicom_file.WindowCenter), float(dicom_file.WindowWidth)
+    pixel_array = np.clip(pixel_array, window_center - window_width / 2, window_center + window_width / 2)
+    pixel_min = pixel_array.min()
+    pixel_max = pixel_array.max()
+    return ((pixel_array - pixel_min) / (pixel_max - pixel_min) * 255).astype(np.uint8)
+
+
+def bench_dicom(args):
+    """Tempo e pico de memória da decodificação DICOM: float64 vs. tabela uint16 -> uint8"""
+    import tracemalloc
+    from services.dicom_processing import decode_dicom
+
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for height, width in args.sizes or [(3328, 2560), (5000, 4000)]:
+            path = create_synthetic_dicom(os.path.join(workdir, f"{height}x{width}.dcm"), size=(height, width))
+            outputs = {}
+            runners = {
+                "original (float64)": lambda: _legacy_decode_dicom(path),
+                "tabela (LUT)": lambda: decode_dicom(path)[0],
+            }
+            for mode, run in runners.items():
+                samples = []
+                for _ in range(args.iterations):
+                    start = time.perf_counter()
+                    outputs[mode] = run()
+                    samples.append(time.perf_counter() - start)
+
+                # Pico das alocações (bytes do arquivo, array decodificado e temporários)
+                tracemalloc.start()
+                run()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                rows.append((f"{width}x{height}", mode, summarize_ms(samples)["p50"], peak / 2 ** 20))
+            identical = np.array_equal(outputs["original (float64)"], outputs["tabela (LUT)"])
+            rows.append((f"{width}x{height}", "saída idêntica", identical, None))
+
+    print("\n" + "=" * 70)
+    print("DECODIFICAÇÃO DICOM 16 BITS -> 8 BITS")
+    print("=" * 70)
+    print(f"{'imagem':<14}{'modo':<22}{'p50 (ms)':>12}{'pico (MB)':>12}")
+    for size, mode, value, peak in rows:
+        if peak is None:
+            print(f"{size:<14}{mode:<22}{'sim' if value else 'NÃO':>12}")
+        else:
+            print(f"{size:<14}{mode:<22}{value:>12.1f}{peak:>12.1f}")
+    print("=" * 70)
+    return 0
+
+
+def bench_dicom_storage(args):
+    """Pixels originais do DICOM: .npy vs. PNG 16 bits vs. .npz (escrita, tamanho e nova janela)"""
+    import cv2
+    from services.dicom_processing import read_pixels, render_window, window_from_center
+
+    window = window_from_center(1800.0, 1200.0)
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for height, width in args.sizes or [(3328, 2560), (5000, 4000)]:
+            # Mamografia sintética em 12 bits: tecido sobre fundo zero, como um detector real
+            gray = cv2.imread(create_synthetic_mammogram(os.path.join(workdir, "m.png"), size=(height, width)),
+                              cv2.IMREAD_GRAYSCALE)
+            rng = np.random.default_rng(0)
+            pixels = gray.astype(np.uint16) * 16 + rng.integers(0, 16, gray.shape, dtype=np.uint16) * (gray > 0)
+            dicom_path = create_synthetic_dicom(os.path.join(workdir, "m.dcm"), pixels=pixels)
+
+            formats = {
+                "DICOM (reler)": (None, lambda path: read_pixels(path)[0]),
+                "npy": (lambda path: np.save(path, pixels),
+                        lambda path: np.load(path, mmap_mode="r")),
+                "png 16 bits": (lambda path: cv2.imwrite(path, pixels, [cv2.IMWRITE_PNG_COMPRESSION, 1]),
+                                lambda path: cv2.imread(path, cv2.IMREAD_UNCHANGED)),
+                "npz": (lambda path: np.savez_compressed(path, pixels=pixels),
+                        lambda path: np.load(path)["pixels"]),
+            }
+            for name, (save, load) in formats.items():
+                path = dicom_path if save is None else os.path.join(workdir, f"pixels.{name.split()[0]}")
+                write_samples = []
+                if save is not None:
+                    for _ in range(args.iterations):
+                        start = time.perf_counter()
+                        save(path)
+                        write_samples.append(time.perf_counter() - start)
+                window_samples = []
+                for _ in range(args.iterations):
+                    start = time.perf_counter()
+                    loaded = load(path)
+                    render_window(loaded, window)
+                    window_samples.append(time.perf_counter() - start)
+                assert np.array_equal(np.asarray(loaded), pixels)
+                rows.append((f"{width}x{height}", name,
+                             summarize_ms(write_samples)["p50"] if write_samples else None,
+                             os.path.getsize(path) / 2 ** 20, summarize_ms(window_samples)["p50"]))
+
+    print("\n" + "=" * 78)
+    print("PIXELS ORIGINAIS DO DICOM - FORMATO DE ARMAZENAMENTO")
+    print("=" * 78)
+    print(f"{'imagem':<14}{'formato':<16}{'escrita (ms)':>14}{'arquivo (MB)':>14}{'nova janela (ms)':>18}")
+    for size, name, write_ms, size_mb, window_ms in rows:
+        write = f"{write_ms:.1f}" if write_ms is not None else "-"
+        print(f"{size:<14}{name:<16}{write:>14}{size_mb:>14.1f}{window_ms:>18.1f}")
+    print("=" * 78)
+    print("nova janela: leitura dos pixels + windowing + JPEG; DICOM (reler) exige guardar o arquivo original")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmarks de desempenho do backend")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("model-latency", help="latência fria vs. quente do modelo treinado")
+    p.add_argument("--model", default=DEFAULT_MODEL_PATH, help="caminho do arquivo .keras")
+    p.add_argument("--image", help="imagem de teste (padrão: mamografia sintética)")
+    p.add_argument("--iterations", type=int, default=10)
+    p.set_defaults(func=bench_model_latency)
+
+    p = subparsers.add_parser("batching", help="throughput com e sem micro-batching")
+    p.add_argument("--model", default=DEFAULT_MODEL_PATH, help="caminho do arquivo .keras")
+    p.add_argument("--image", help="imagem de teste (padrão: mamografia sintética)")
+    p.add_argument("--requests", type=int, default=64)
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--max-batch-size", type=int, default=8)
+    p.add_argument("--max-wait-ms", type=float, default=10.0)
+    p.set_defaults(func=bench_batching)
+
+    p = subparsers.add_parser("gradcam", help="latência do Grad-CAM antes/depois do cache do grafo")
+    p.add_argument("--model", default=DEFAULT_MODEL_PATH, help="caminho do arquivo .keras")
+    p.add_argument("--image", help="imagem de teste (padrão: mamografia sintética)")
+    p.add_argument("--iterations", type=int, default=10)
+    p.set_defaults(func=bench_gradcam)
+
+    p = subparsers.add_parser("visualization", help="renderização matplotlib vs. OpenCV da visualização")
+    p.add_argument("--image", help="imagem de teste (padrão: mamografia sintética)")
+    p.add_argument("--iterations", type=int, default=20)
+    p.add_argument("--legacy-iterations", type=int, default=3)
+    p.add_argument("--panel-size", type=int, default=512)
+    p.add_argument("--formats", nargs="+", default=["jpg", "png", "webp"], choices=["jpg", "png", "webp"])
+    p.set_defaults(func=bench_visualization)
+
+    p = subparsers.add_parser("preprocessing", help="throughput do pré-processamento em lote")
+    p.add_argument("--images", type=int, default=32)
+    p.add_argument("--size", type=int, nargs=2, default=[3000, 2400], metavar=("ALTURA", "LARGURA"))
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.set_defaults(func=bench_preprocessing)
+
+    p = subparsers.add_parser("segmentation", help="tempo e memória da segmentação original vs. reduzida")
+    p.add_argument("--sizes", type=int, nargs=2, action="append", metavar=("ALTURA", "LARGURA"),
+                   help="tamanho da imagem (repetível; padrão: 3000x2400 e 8000x6000)")
+    p.add_argument("--iterations", type=int, default=3)
+    p.set_defaults(func=bench_segmentation)
+
+    p = subparsers.add_parser("backends", help="carga, memória e latência dos backends Keras e TFLite")
+    p.add_argument("--model", default=DEFAULT_MODEL_PATH, help="caminho do arquivo .keras")
+    p.add_argument("--tflite", nargs="+", default=[],
+                   help="artefatos .tflite (padrão: converte para dynamic e float16)")
+    p.add_argument("--image", help="imagem de teste (padrão: mamografia sintética)")
+    p.add_argument("--iterations", type=int, default=20)
+    p.set_defaults(func=bench_backends)
+
+    p = subparsers.add_parser("threads", help="varredura de threads do TensorFlow e recomendação de perfil")
+    p.add_argument("--model", default=DEFAULT_MODEL_PATH, help="caminho do arquivo .keras")
+    p.add_argument("--image", help="imagem de teste (padrão: mamografia sintética)")
+    p.add_argument("--intra", type=int, nargs="+", help="threads intra-op (padrão: potências de 2 até o nº de núcleos)")
+    p.add_argument("--inter", type=int, nargs="+", default=[1, 2], help="threads inter-op")
+    p.add_argument("--batch-size", type=int, default=8, help="tamanho do lote na medida de throughput")
+    p.add_argument("--iterations", type=int, default=20)
+    p.set_defaults(func=bench_threads)
+
+    p = subparsers.add_parser("inference-call", help="sobrecarga de model.predict vs. forward pass compilado")
+    p.add_argument("--model", default=DEFAULT_MODEL_PATH, help="caminho do arquivo .keras")
+    p.add_argument("--image", help="imagem de teste (padrão: mamografia sintética)")
+    p.add_argument("--batch-size", type=int, default=1)
+    p.add_argument("--iterations", type=int, default=30)
+    p.set_defaults(func=bench_inference_call)
+
+    p = subparsers.add_parser("upload", help="latência do upload: validação por cabeçalho vs. realce descartado")
+    p.add_argument("--formats", nargs="+", default=["png", "jpg"], choices=["png", "jpg"])
+    p.add_argument("--iterations", type=int, default=3)
+    p.set_defaults(func=bench_upload)
+
+    p = subparsers.add_parser("dicom", help="tempo e memória da conversão DICOM: float64 vs. tabela")
+    p.add_argument("--sizes", type=int, nargs=2, action="append", metavar=("ALTURA", "LARGURA"),
+                   help="tamanho da imagem (repetível; padrão: 3328x2560 e 5000x4000)")
+    p.add_argument("--iterations", type=int, default=5)
+    p.set_defaults(func=bench_dicom)
+
+    p = subparsers.add_parser("dicom-storage", help="formato dos pixels originais do DICOM: npy vs. PNG 16 bits")
+    p.add_argument("--sizes", type=int, nargs=2, action="append", metavar=("ALTURA", "LARGURA"),
+                   help="tamanho da imagem (repetível; padrão: 3328x2560 e 5000x4000)")
+    p.add_argument("--iterations", type=int, default=3)
+    p.set_defaults(func=bench_dicom_storage)
+
+    p = subparsers.add_parser("ingest", help="throughput da ingestão: uploads individuais vs. lote/ZIP")
+    p.add_argument("--files", type=int, default=64)
+    p.add_argument("--iterations", type=int, default=3)
+    p.set_defaults(func=bench_ingest)
+
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    sys.exit(args.func(args))
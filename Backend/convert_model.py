@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Conversão do modelo treinado para TFLite - Mamografia IA
+Gera o artefato usado por MODEL_BACKEND=tflite e um relatório de desvio
+(probabilidade, predição, heatmap e região suspeita) contra o modelo Keras
+
+Uso:
+    python convert_model.py [--quantization dynamic|float16|none] [--images DIR]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+from services.synthetic import create_synthetic_mammogram
+
+DEFAULT_MODEL_PATH = str(Path(__file__).parent / "best_cbis_ddsm_model.keras")
+DEFAULT_TFLITE_PATH = str(Path(__file__).parent / "best_cbis_ddsm_model.tflite")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def convert_to_tflite(keras_path: str, output_path: str, quantization: str = "dynamic") -> int:
+    """
+    Convert the fused probability + Grad-CAM graph of the Keras model to TFLite
+
+    Args:
+        keras_path: Trained .keras file
+        output_path: Destination .tflite file
+        quantization: "dynamic" (int8 weights), "float16" (float16 weights) or "none"
+
+    Returns:
+        Size of the written artifact in bytes
+    """
+    import tensorflow as tf
+    from tensorflow import keras
+    from services.model_service import ModelService
+    from services.tflite_backend import TFLITE_QUANTIZATIONS
+
+    if quantization not in TFLITE_QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization '{quantization}', expected one of {TFLITE_QUANTIZATIONS}")
+
+    service = ModelService(keras_path, residency="resident", idle_timeout=0, batching=False, backend="keras")
+    with service._use_model() as model, tempfile.TemporaryDirectory() as export_dir:
+        gradcam = service._get_gradcam_fn("top_activation")
+        if gradcam is None:
+            raise RuntimeError("Could not build the Grad-CAM graph for this model")
+
+        # ExportArchive rastreia as variáveis do Keras 3 para que os pesos entrem no artefato
+        archive = keras.export.ExportArchive()
+        archive.track(model)
+        archive.add_endpoint(name="serving_default", fn=gradcam)
+        archive.write_out(export_dir, verbose=False)
+
+        converter = tf.lite.TFLiteConverter.from_saved_model(export_dir)
+        if quantization != "none":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantization == "float16":
+            converter.target_spec.supported_types = [tf.float16]
+        data = converter.convert()
+    service.shutdown()
+
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, output_path)
+    return len(data)
+
+
+def fixture_images(images_dir: str, workdir: str, count: int) -> List[str]:
+    """Imagens do diretório informado ou mamografias sintéticas"""
+    if images_dir:
+        paths = sorted(
+            os.path.join(images_dir, name) for name in os.listdir(images_dir)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        return paths[:count] if count else paths
+    return [create_synthetic_mammogram(os.path.join(workdir, f"fixture_{seed}.png"), seed=seed)
+            for seed in range(count or 8)]
+
+
+def drift_report(keras_path: str, tflite_path: str, image_paths: List[str],
+                 threshold: float = 0.5) -> Dict[str, Any]:
+    """Compare the TFLite artifact against the Keras model on the same preprocessed images"""
+    import cv2
+    from services.model_service import ModelService
+    from services.preprocessing import bbox_iou
+
+    services = {
+        "keras": ModelService(keras_path, residency="resident", idle_timeout=0, batching=False, backend="keras"),
+        "tflite": ModelService(tflite_path, residency="resident", idle_timeout=0, batching=False, backend="tflite"),
+    }
+    rows = []
+    for path in image_paths:
+        img = services["keras"].preprocess_image(path)
+        outputs = {}
+        for name, service in services.items():
+            probability, heatmap = service.predict_with_heatmap_batch(img)[0]
+            bbox = None
+            if heatmap is not None:
+                bbox = service.find_roi_bbox(cv2.resize(heatmap, (224, 224), interpolation=cv2.INTER_LINEAR))
+            outputs[name] = (float(probability), heatmap, bbox)
+
+        (p_ref, h_ref, b_ref), (p_lite, h_lite, b_lite) = outputs["keras"], outputs["tflite"]
+        rows.append({
+            "image": os.path.basename(path),
+            "probability_keras": p_ref,
+            "probability_tflite": p_lite,
+            "probability_abs_diff": abs(p_ref - p_lite),
+            "prediction_match": (p_ref > threshold) == (p_lite > threshold),
+            "heatmap_max_abs_diff": float(np.abs(h_ref - h_lite).max()) if h_ref is not None else None,
+            "bbox_iou": bbox_iou(b_ref, b_lite) if b_ref and b_lite else float(b_ref == b_lite),
+        })
+    for service in services.values():
+        service.shutdown()
+
+    diffs = np.array([row["probability_abs_diff"] for row in rows])
+    heatmap_diffs = [row["heatmap_max_abs_diff"] for row in rows if row["heatmap_max_abs_diff"] is not None]
+    return {
+        "keras_model": keras_path,
+        "tflite_model": tflite_path,
+        "images": len(rows),
+        "threshold": threshold,
+        "probability_max_abs_diff": float(diffs.max()),
+        "probability_mean_abs_diff": float(diffs.mean()),
+        "prediction_agreement": float(np.mean([row["prediction_match"] for row in rows])),
+        "heatmap_max_abs_diff": max(heatmap_diffs) if heatmap_diffs else None,
+        "bbox_min_iou": float(min(row["bbox_iou"] for row in rows)),
+        "per_image": rows,
+    }
+
+
+def print_drift_report(report: Dict[str, Any]):
+    print("\n" + "=" * 70)
+    print("DESVIO TFLITE vs. KERAS")
+    print("=" * 70)
+    print(f"{'imagem':<24}{'keras':>10}{'tflite':>10}{'|Δp|':>10}{'Δheatmap':>10}{'IoU':>6}")
+    for row in report["per_image"]:
+        heatmap_diff = row["heatmap_max_abs_diff"]
+        print(f"{row['image'][:23]:<24}{row['probability_keras']:>10.4f}{row['probability_tflite']:>10.4f}"
+              f"{row['probability_abs_diff']:>10.5f}{heatmap_diff if heatmap_diff is not None else float('nan'):>10.4f}"
+              f"{row['bbox_iou']:>6.2f}")
+    print("-" * 70)
+    print(f"|Δp| máximo: {report['probability_max_abs_diff']:.5f}   médio: {report['probability_mean_abs_diff']:.5f}")
+    print(f"Concordância da predição (limiar {report['threshold']}): {report['prediction_agreement']:.1%}")
+    print(f"IoU mínimo da região suspeita: {report['bbox_min_iou']:.2f}")
+    print("=" * 70)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Converte o modelo treinado para TFLite e mede o desvio")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH, help="caminho do arquivo .keras")
+    parser.add_argument("--output", default=DEFAULT_TFLITE_PATH, help="caminho do artefato .tflite")
+    parser.add_argument("--quantization", default="dynamic", choices=["dynamic", "float16", "none"])
+    parser.add_argument("--images", help="diretório com imagens de referência (padrão: mamografias sintéticas)")
+    parser.add_argument("--count", type=int, default=0, help="número máximo de imagens de referência")
+    parser.add_argument("--report", help="arquivo JSON do relatório (padrão: <output>.drift.json)")
+    parser.add_argument("--skip-report", action="store_true", help="apenas converter")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"❌ Modelo não encontrado: {args.model}")
+        return 1
+
+    print(f"🔄 Convertendo {args.model} (quantização: {args.quantization})...")
+    start = time.perf_counter()
+    size = convert_to_tflite(args.model, args.output, args.quantization)
+    print(f"✅ {args.output}: {size / 2 ** 20:.1f}MB "
+          f"(original {os.path.getsize(args.model) / 2 ** 20:.1f}MB) em {time.perf_counter() - start:.0f}s")
+
+    if args.skip_report:
+        return 0
+
+    with tempfile.TemporaryDirectory() as workdir:
+        report = drift_report(args.model, args.output, fixture_images(args.images, workdir, args.count))
+    report["quantization"] = args.quantization
+    print_drift_report(report)
+
+    report_path = args.report or f"{args.output}.drift.json"
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"📄 Relatório salvo em {report_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Ingestão em massa de um diretório local - Mamografia IA
+Cadastra todas as imagens (PGM/JPEG/PNG/DICOM) de um dataset no banco sem
+passar pela API: hash em paralelo, conteúdo já cadastrado ignorado, arquivos
+vinculados (hardlink) ou copiados para uploads/ sem recodificação (DICOM é
+convertido para JPEG, como no upload) e linhas inseridas em lotes.
+
+Pode ser interrompido e executado de novo: cada lote é gravado em uma
+transação e o que já está no banco (mesmo image_hash) é pulado.
+
+Uso:
+    python ingest_directory.py /dados/mias
+    python ingest_directory.py /dados/cbis-ddsm --workers 8 --batch-size 500 --copy
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from services import dicom_processing, ingest_service
+
+BASE_DIR = Path(__file__).parent
+DEFAULT_DB_PATH = BASE_DIR / "mamografia_analysis.db"
+DEFAULT_UPLOAD_DIR = BASE_DIR / "uploads"
+
+
+def scan_directory(source: str) -> List[str]:
+    """Imagens suportadas em ``source`` (recursivo, em ordem estável)"""
+    paths = []
+    for root, dirs, files in os.walk(source):
+        # Diretórios ocultos e metadados do macOS
+        dirs[:] = sorted(d for d in dirs if not d.startswith(".") and d != "__MACOSX")
+        for name in sorted(files):
+            if not name.startswith(".") and name.lower().endswith(ingest_service.IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    return paths
+
+
+def link_or_copy(source: str, destination: str, copy: bool = False) -> str:
+    """
+    Hardlink (ou cópia, entre sistemas de arquivos ou com copy=True) com
+    rename atômico: ``destination`` nunca fica parcial
+    """
+    if copy:
+        return ingest_service.copy_atomic(source, destination)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(destination), prefix=".upload-", suffix=".part")
+    os.close(fd)
+    os.unlink(tmp_path)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        return ingest_service.copy_atomic(source, destination)
+    os.replace(tmp_path, destination)
+    return destination
+
+
+def ingest_file(path: str, relative_name: str, image_hash: str, upload_dir: str, copy: bool,
+                pixel_store: Optional[dicom_processing.DicomPixelStore]) -> Dict:
+    """
+    Valida a imagem e a grava em uploads/ com o nome ``ingest-{hash}``: uma
+    execução retomada sobrescreve o arquivo de um lote não gravado no banco
+
+    Returns:
+        dict: valores da linha de ``analyses``
+    """
+    extension = Path(path).suffix.lower()
+    if extension == ".dcm":
+        # uploads/ guarda a imagem exibível: o DICOM é convertido como na API
+        original_pixels, metadata, window = dicom_processing.read_pixels(path)
+        content = dicom_processing.to_jpeg(dicom_processing.to_uint8(original_pixels, window))
+        if pixel_store is not None:
+            pixel_store.save(image_hash, original_pixels)
+        info = dicom_processing.image_info(metadata, window)
+        filename = f"ingest-{image_hash}.jpg"
+        file_path = os.path.join(upload_dir, filename)
+        ingest_service.write_atomic(file_path, content)
+    else:
+        info = ingest_service.validate_image(path, relative_name)
+        filename = f"ingest-{image_hash}{extension}"
+        file_path = os.path.join(upload_dir, filename)
+        link_or_copy(path, file_path, copy)
+    return {
+        "filename": filename,
+        "original_filename": relative_name,
+        "file_path": file_path,
+        "file_size": os.path.getsize(file_path),
+        "info": json.dumps(info),
+        "image_hash": image_hash,
+    }
+
+
+def insert_rows(conn: sqlite3.Connection, rows: List[Dict]):
+    """Insere um lote de análises em uma transação"""
+    with conn:
+        conn.executemany(
+            "INSERT INTO analyses (filename, original_filename, file_path, file_size, upload_date, "
+            "processing_status, info, image_hash, is_processed) "
+            "VALUES (:filename, :original_filename, :file_path, :file_size, CURRENT_TIMESTAMP, "
+            "'uploaded', :info, :image_hash, 0)",
+            rows,
+        )
+
+
+class Progress:
+    """Progresso e throughput no terminal, no máximo uma linha por intervalo"""
+
+    def __init__(self, label: str, total: int, interval: float = 2.0, log: Callable[[str], None] = print):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.log = log
+        self.done = 0
+        self.start = time.perf_counter()
+        self._last = self.start
+
+    def update(self, count: int = 1, force: bool = False):
+        self.done += count
+        now = time.perf_counter()
+        if not force and now - self._last < self.interval and self.done < self.total:
+            return
+        self._last = now
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else 0.0
+        percent = 100 * self.done / self.total if self.total else 100.0
+        self.log(f"   {self.label}: {self.done}/{self.total} ({percent:.1f}%) - "
+                 f"{rate:.1f} arquivos/s - restante ~{eta:.0f}s")
+
+
+def ingest_directory(source: str, db_path: str = str(DEFAULT_DB_PATH), upload_dir: str = str(DEFAULT_UPLOAD_DIR),
+                     workers: int = None, batch_size: int = 500, copy: bool = False,
+                     store_dicom_pixels: bool = None, log: Callable[[str], None] = print) -> Dict:
+    """
+    Cadastra as imagens de ``source`` na tabela ``analyses``
+
+    Returns:
+        dict: contagens (encontrados, já cadastrados, duplicados, inseridos, falhas) e throughput
+    """
+    workers = workers or os.cpu_count() or 1
+    store_dicom_pixels = dicom_processing.DICOM_STORE_PIXELS if store_dicom_pixels is None else store_dicom_pixels
+    pixel_store = dicom_processing.DicomPixelStore() if store_dicom_pixels else None
+    os.makedirs(upload_dir, exist_ok=True)
+    start = time.perf_counter()
+
+    paths = scan_directory(source)
+    log(f"🔍 {len(paths)} imagens encontradas em {source}")
+    stats = {"found": len(paths), "already_ingested": 0, "duplicates": 0, "inserted": 0, "failed": 0}
+
+    conn = sqlite3.connect(db_path)
+    try:
+        existing = {row[0] for row in conn.execute("SELECT image_hash FROM analyses WHERE image_hash IS NOT NULL")}
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            # 1. Hash em paralelo (leitura em blocos; hashlib libera o GIL), o mesmo
+            # image_hash calculado no upload pela API
+            progress = Progress("hash", len(paths), log=log)
+
+            def hash_file(path):
+                try:
+                    return ingest_service.md5_file(path), None
+                except OSError as e:
+                    # Link quebrado, sem permissão ou removido durante a varredura
+                    return None, f"{os.path.relpath(path, source)}: {e}"
+
+            pending, seen = [], set()
+            for path, (image_hash, error) in zip(paths, executor.map(hash_file, paths)):
+                progress.update()
+                if error is not None:
+                    stats["failed"] += 1
+                    log(f"⚠️  {error}")
+                elif image_hash in existing:
+                    stats["already_ingested"] += 1
+                elif image_hash in seen:
+                    stats["duplicates"] += 1
+                else:
+                    seen.add(image_hash)
+                    pending.append((path, image_hash))
+            log(f"📋 {len(pending)} novas, {stats['already_ingested']} já cadastradas, "
+                f"{stats['duplicates']} duplicadas no diretório")
+
+            # 2. Validação + hardlink/cópia em paralelo; 3. um INSERT em lote por transação
+            progress = Progress("ingestão", len(pending), log=log)
+
+            def ingest(item):
+                path, image_hash = item
+                relative_name = os.path.relpath(path, source)
+                try:
+                    return ingest_file(path, relative_name, image_hash, upload_dir, copy, pixel_store)
+                except Exception as e:
+                    return f"{relative_name}: {e}"
+
+            for offset in range(0, len(pending), batch_size):
+                rows = []
+                for result in executor.map(ingest, pending[offset:offset + batch_size]):
+                    if isinstance(result, str):
+                        stats["failed"] += 1
+                        log(f"⚠️  {result}")
+                    else:
+                        rows.append(result)
+                insert_rows(conn, rows)
+                stats["inserted"] += len(rows)
+                progress.update(len(pending[offset:offset + batch_size]), force=True)
+        finally:
+            # Ctrl+C: descarta o que ainda não começou em vez de esperar o restante
+            executor.shutdown(wait=True, cancel_futures=True)
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - start
+    stats["elapsed_s"] = round(elapsed, 2)
+    stats["files_per_second"] = round(len(paths) / elapsed, 1) if elapsed > 0 else None
+    return stats
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Cadastra as imagens de um diretório local no banco (sem a API)")
+    parser.add_argument("source", help="diretório com imagens PGM/JPEG/PNG/DICOM (recursivo)")
+    parser.add_argument("--db", default=str(DEFAULT_DB_PATH), help="banco SQLite (padrão: mamografia_analysis.db)")
+    parser.add_argument("--upload-dir", default=str(DEFAULT_UPLOAD_DIR), help="destino dos arquivos (padrão: uploads/)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="threads de hash e validação")
+    parser.add_argument("--batch-size", type=int, default=500, help="linhas por transação")
+    parser.add_argument("--copy", action="store_true", help="copiar em vez de criar hardlinks")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.source):
+        print(f"❌ Diretório não encontrado: {args.source}")
+        return 1
+    if not os.path.exists(args.db):
+        print("📁 Banco de dados não encontrado. Inicie a aplicação uma vez para criá-lo.")
+        return 1
+    from migrate_database import migrate_database
+    if Path(args.db).resolve() == DEFAULT_DB_PATH.resolve() and not migrate_database():
+        return 1
+
+    print(f"🔄 Ingestão de {args.source} ({args.workers} threads, lotes de {args.batch_size})")
+    try:
+        stats = ingest_directory(args.source, args.db, args.upload_dir, args.workers, args.batch_size, args.copy)
+    except KeyboardInterrupt:
+        print("\n🛑 Interrompido. Os lotes já gravados foram mantidos; execute de novo para continuar.")
+        return 130
+
+    print(f"✅ {stats['inserted']} inseridas, {stats['already_ingested']} já cadastradas, "
+          f"{stats['duplicates']} duplicadas, {stats['failed']} com erro")
+    print(f"⏱️  {stats['elapsed_s']}s - {stats['files_per_second']} arquivos/s")
+    return 0 if stats["failed"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Script de Migração do Banco de Dados - Mamografia IA
-Adiciona colunas 'info' e 'image_hash' se não existirem
+Adiciona colunas 'info', 'image_hash', 'model_result' e 'model_version' se não existirem
 """
 
 import sqlite3
@@ -39,6 +39,14 @@ def migrate_database():
         if 'image_hash' not in columns:
             migrations_needed.append('image_hash')
         
+        # Verificar e adicionar coluna 'model_result'
+        if 'model_result' not in columns:
+            migrations_needed.append('model_result')
+        
+        # Verificar e adicionar coluna 'model_version'
+        if 'model_version' not in columns:
+            migrations_needed.append('model_version')
+        
         if not migrations_needed:
             print("✅ Todas as colunas já existem. Migração não necessária.")
             return True
@@ -60,6 +68,16 @@ def migrate_database():
             except Exception as e:
                 print(f"⚠️  Coluna 'image_hash' adicionada, mas índice não criado: {str(e)}")
         
+        # Adicionar coluna model_result se necessário
+        if 'model_result' in migrations_needed:
+            cursor.execute("ALTER TABLE analyses ADD COLUMN model_result TEXT")
+            print("✅ Coluna 'model_result' adicionada.")
+        
+        # Adicionar coluna model_version se necessário
+        if 'model_version' in migrations_needed:
+            cursor.execute("ALTER TABLE analyses ADD COLUMN model_version VARCHAR(64)")
+            print("✅ Coluna 'model_version' adicionada.")
+        
         conn.commit()
         
         print("✅ Migração concluída!")
@@ -68,7 +86,7 @@ def migrate_database():
         cursor.execute("PRAGMA table_info(analyses)")
         columns = [column[1] for column in cursor.fetchall()]
         
-        if 'info' in columns and 'image_hash' in columns:
+        if all(column in columns for column in ('info', 'image_hash', 'model_result', 'model_version')):
             print("✅ Verificação: Todas as colunas criadas com sucesso!")
             return True
         else:
@@ -111,6 +129,10 @@ def check_database_status():
             missing_columns.append('info')
         if 'image_hash' not in column_names:
             missing_columns.append('image_hash')
+        if 'model_result' not in column_names:
+            missing_columns.append('model_result')
+        if 'model_version' not in column_names:
+            missing_columns.append('model_version')
         
         if not missing_columns:
             print("✅ Status: Migração OK - Todas as colunas presentes")
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Servidor de modelo - Mamografia IA
+Processo único que carrega o TensorFlow e o modelo treinado para vários
+workers do uvicorn; os workers (com MODEL_SERVER_SOCKET definido) enviam
+os tensores pré-processados por memória compartilhada e socket Unix
+
+Uso:
+    MODEL_SERVER_SOCKET=/tmp/mamografia-model.sock python model_server.py
+    MODEL_SERVER_SOCKET=/tmp/mamografia-model.sock uvicorn app:app --workers 4
+"""
+
+import argparse
+import os
+import signal
+import sys
+import threading
+
+# Este processo executa a inferência: o ModelService daqui não deve delegá-la
+os.environ["MODEL_SERVER_ROLE"] = "server"
+
+from services import execution_profile  # noqa: E402  (afinidade de CPU antes do TensorFlow)
+from services.model_server import MODEL_SERVER_SOCKET, ModelServer  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Servidor de inferência compartilhado pelos workers da API")
+    parser.add_argument("--socket", default=MODEL_SERVER_SOCKET or "/tmp/mamografia-model.sock",
+                        help="caminho do socket Unix (padrão: MODEL_SERVER_SOCKET)")
+    parser.add_argument("--no-warmup", action="store_true", help="não carregar a versão ativa ao iniciar")
+    args = parser.parse_args()
+
+    from services.model_registry import get_model_registry
+    from services.model_service import MODEL_WARMUP
+
+    server = ModelServer(args.socket)
+    print(f"⚙️ Perfil de execução: {execution_profile.EXECUTION_PROFILE}")
+
+    if MODEL_WARMUP and not args.no_warmup:
+        # Carrega a versão ativa antes de aceitar conexões dos workers
+        registry = get_model_registry()
+        entry = registry.discover()[registry.active_version]
+        server.service_for(entry["path"], entry["backend"]).warmup()
+
+    def stop(signum, frame):
+        print("🛑 Encerrando servidor de modelo...")
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
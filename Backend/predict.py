@@ -10,6 +10,7 @@ import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 import sys
 import os
+from services.preprocessing import find_tissue_bbox
 
 def load_model(model_path):
     """Load the trained model"""
@@ -18,8 +19,14 @@ def load_model(model_path):
     print("Model loaded successfully!")
     return model
 
-def preprocess_image(image_path, img_size=(224, 224)):
-    """Load and preprocess an image for prediction (matches training preprocessing)"""
+def preprocess_image(image_path, img_size=(224, 224), segmentation=None):
+    """
+    Load and preprocess an image for prediction
+    
+    segmentation: "full" finds the breast on the full resolution mask and
+    matches training preprocessing; "downscale" finds it on a reduced copy,
+    so the crop may differ slightly (default: PREPROCESS_SEGMENTATION)
+    """
     print(f"Loading image: {image_path}")
     
     # Read image
@@ -31,34 +38,12 @@ def preprocess_image(image_path, img_size=(224, 224)):
     # Convert BGR to RGB
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     
-    # Create a mask to find the breast tissue (non-black regions)
+    # Find the bounding box of the breast tissue (Otsu + morphology, padded 10%)
     gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    x, y, w, h = find_tissue_bbox(gray, segmentation)
     
-    # Threshold to find non-black regions (breast tissue)
-    # Use Otsu's method for automatic thresholding
-    _, tissue_mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    
-    # Apply morphological operations to clean up the mask
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (15, 15))
-    tissue_mask = cv2.morphologyEx(tissue_mask, cv2.MORPH_CLOSE, kernel)
-    tissue_mask = cv2.morphologyEx(tissue_mask, cv2.MORPH_OPEN, kernel)
-    
-    # Find the bounding box of the breast tissue
-    contours, _ = cv2.findContours(tissue_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    if contours:
-        # Get the largest contour (main breast tissue)
-        largest_contour = max(contours, key=cv2.contourArea)
-        x, y, w, h = cv2.boundingRect(largest_contour)
-        
-        # Add some padding (10%)
-        pad_w, pad_h = int(w * 0.1), int(h * 0.1)
-        x = max(0, x - pad_w)
-        y = max(0, y - pad_h)
-        w = min(img.shape[1] - x, w + 2 * pad_w)
-        h = min(img.shape[0] - y, h + 2 * pad_h)
-        
-        # Crop to breast tissue region
-        img = img[y:y+h, x:x+w]
+    # Crop to breast tissue region
+    img = img[y:y+h, x:x+w]
     
     # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization) to enhance tissue
     gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
@@ -0,0 +1,303 @@
+"""
+On-disk caches for the trained model, keyed by image content hash
+"""
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CACHE_DIR = Path(__file__).parent.parent / "cache"
+
+# Cache dos tensores pré-processados (imagem 224x224 uint8 por hash + versão do pré-processamento)
+TENSOR_CACHE_ENABLED = os.getenv("TENSOR_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+TENSOR_CACHE_DIR = os.getenv("TENSOR_CACHE_DIR", str(CACHE_DIR / "tensors"))
+# Tamanho total máximo; acima disso os arquivos menos usados recentemente são removidos
+TENSOR_CACHE_MAX_MB = float(os.getenv("TENSOR_CACHE_MAX_MB", "512"))
+
+# Cache de resultados (probabilidade, heatmap, bbox) por hash da imagem + checksum do modelo + limiar
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", str(CACHE_DIR / "results"))
+# Tamanho total máximo dos resultados (todas as versões do modelo), com remoção LRU
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "128"))
+
+# Arquivos .tmp mais antigos que isso são sobras de escritas interrompidas
+STALE_TMP_SECONDS = 3600
+# Intervalo máximo entre varreduras de um diretório de cache (escritas de outros workers)
+CACHE_SCAN_SECONDS = 10.0
+# Ao passar do limite, remover até esta fração dele: folga antes da próxima varredura
+CACHE_LOW_WATER = 0.9
+
+
+def file_checksum(path: str) -> str:
+    """MD5 of a file, read in 1MB chunks"""
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _touch(path: str):
+    """Mark a file as just used (ns resolution: the coarse kernel clock would tie entries)"""
+    now = time.time_ns()
+    try:
+        os.utime(path, ns=(now, now))
+    except OSError:
+        # Removido por outro processo logo após a leitura
+        pass
+
+
+def _remove_stale_tmp(directory: str):
+    """Drop writes interrupted by a crash (recent ones may belong to another worker)"""
+    cutoff = time.time() - STALE_TMP_SECONDS
+    for tmp_path in glob.glob(os.path.join(directory, "**", "*.tmp"), recursive=True):
+        try:
+            if os.path.getmtime(tmp_path) < cutoff:
+                os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _scan_files(directory: str, suffix: str) -> List[Tuple[int, int, str]]:
+    """(mtime_ns, size, path) of every file ending in ``suffix`` under ``directory``"""
+    files = []
+    pending = [directory]
+    while pending:
+        try:
+            entries = list(os.scandir(pending.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.name.endswith(suffix):
+                    stat = entry.stat(follow_symlinks=False)
+                    files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            except OSError:
+                # Removido por outro processo durante a varredura
+                continue
+    return files
+
+
+def _evict_lru(files: List[Tuple[int, int, str]], max_bytes: int,
+               target_bytes: int = None) -> Tuple[int, int, int]:
+    """
+    If the files exceed max_bytes, remove the least recently used ones until
+    they fit target_bytes (default: max_bytes)
+
+    Returns:
+        tuple: (entries left, bytes left, files removed)
+    """
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    if total <= max_bytes:
+        return len(files), total, removed
+    target_bytes = max_bytes if target_bytes is None else target_bytes
+    files = sorted(files)
+    while total > target_bytes and removed < len(files):
+        _, size, path = files[removed]
+        try:
+            os.remove(path)
+        except OSError:
+            # Já removido por outro processo
+            pass
+        total -= size
+        removed += 1
+    return len(files) - removed, total, removed
+
+
+class _BoundedDirectory:
+    """
+    Size limit of a cache directory, enforced on the directory itself so it
+    holds across restarts, model versions and uvicorn workers sharing it.
+    Recency is kept in file modification times.
+
+    Scanning the directory costs a stat per entry, so it happens when this
+    process's estimate (last scanned size plus its own writes) passes the
+    limit or every scan_interval seconds; eviction then goes down to
+    low_water of the limit to leave room for writes until the next scan.
+    """
+
+    suffix = ""
+
+    def __init__(self, cache_dir: str, max_bytes: int, low_water: float = CACHE_LOW_WATER,
+                 scan_interval: float = CACHE_SCAN_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.scan_interval = scan_interval
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._estimated_bytes = 0
+        self._last_scan = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _remove_stale_tmp(self.cache_dir)
+        self.enforce_limit()
+
+    def _record_write(self, path: str):
+        _touch(path)
+        with self._lock:
+            self._estimated_bytes += os.path.getsize(path)
+            due = (self._estimated_bytes > self.max_bytes
+                   or time.monotonic() - self._last_scan > self.scan_interval)
+        if due:
+            self.enforce_limit()
+
+    def enforce_limit(self) -> int:
+        """
+        Sum the sizes of every entry in the directory, whoever wrote them,
+        and remove the least recently used ones if they exceed max_bytes
+        """
+        with self._lock:
+            files = _scan_files(self.cache_dir, self.suffix)
+            _, total, removed = _evict_lru(files, self.max_bytes, int(self.max_bytes * self.low_water))
+            self._estimated_bytes = total
+            self._last_scan = time.monotonic()
+            self.evictions += removed
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        files = _scan_files(self.cache_dir, self.suffix)
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(files),
+                "size_mb": round(sum(size for _, size, _ in files) / 2 ** 20, 2),
+                "max_size_mb": round(self.max_bytes / 2 ** 20, 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+            }
+
+
+class TensorCache(_BoundedDirectory):
+    """
+    LRU cache of preprocessed images stored as uint8 ``.npy`` files.
+
+    Entries are read memory-mapped, so a hit costs a page-cache lookup
+    instead of decoding and segmenting the original image.
+    """
+
+    suffix = ".npy"
+
+    def __init__(self, cache_dir: str = TENSOR_CACHE_DIR, max_bytes: int = None, **limits):
+        super().__init__(cache_dir, int(TENSOR_CACHE_MAX_MB * 2 ** 20) if max_bytes is None else max_bytes,
+                         **limits)
+
+    @staticmethod
+    def _filename(image_hash: str, version: str) -> str:
+        return f"{image_hash}-{version}.npy"
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def get(self, image_hash: str, version: str) -> Optional[np.ndarray]:
+        """Memory-mapped cached array, or None on a miss"""
+        path = self._path(self._filename(image_hash, version))
+        try:
+            array = np.load(path, mmap_mode="r")
+            _touch(path)
+        except (OSError, ValueError):
+            # Ausente, removido por outro processo ou corrompido: tratar como miss
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return array
+
+    def put(self, image_hash: str, version: str, array: np.ndarray):
+        path = self._path(self._filename(image_hash, version))
+
+        # Escrita atômica: leitores concorrentes nunca veem um .npy pela metade
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._record_write(path)
+
+
+class ResultCache(_BoundedDirectory):
+    """
+    Trained-model results stored as small JSON files under one directory per
+    model checksum, so a new .keras file never sees results of the old one.
+    The total size is bounded by RESULT_CACHE_MAX_MB, least recently used first.
+    """
+
+    suffix = ".json"
+
+    def __init__(self, cache_dir: str = RESULT_CACHE_DIR, max_bytes: int = None, **limits):
+        super().__init__(cache_dir, int(RESULT_CACHE_MAX_MB * 2 ** 20) if max_bytes is None else max_bytes,
+                         **limits)
+
+    def _path(self, model_checksum: str, image_hash: str, threshold: float, variant: str = "") -> str:
+        suffix = f"-{variant}" if variant else ""
+        return os.path.join(self.cache_dir, model_checksum, f"{image_hash}-t{threshold:.4f}{suffix}.json")
+
+    def contains(self, model_checksum: str, image_hash: str, threshold: float, variant: str = "") -> bool:
+        """Whether an entry exists, without touching the hit/miss counters"""
+        return os.path.exists(self._path(model_checksum, image_hash, threshold, variant))
+
+    def get(self, model_checksum: str, image_hash: str, threshold: float,
+            variant: str = "") -> Optional[Dict[str, Any]]:
+        path = self._path(model_checksum, image_hash, threshold, variant)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            _touch(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def put(self, model_checksum: str, image_hash: str, threshold: float, entry: Dict[str, Any],
+            variant: str = ""):
+        """Store an entry; ``variant`` separates results of other inference settings (e.g. TTA)"""
+        path = self._path(model_checksum, image_hash, threshold, variant)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._record_write(path)
+
+    def purge_stale(self, keep: Union[str, Iterable[str]]) -> int:
+        """Remove the results of every model file whose checksum is not in keep"""
+        keep = {keep} if isinstance(keep, str) else set(keep)
+        removed = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_dir() and entry.name not in keep:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        return removed
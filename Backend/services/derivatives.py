@@ -0,0 +1,170 @@
+"""
+Optimized image derivative (contrast/brightness enhanced, at most 2048 px),
+rendered lazily and stored on disk by image content hash
+"""
+
+import glob
+import io
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+from dotenv import load_dotenv
+from PIL import Image, ImageEnhance, ImageOps
+
+load_dotenv()
+
+# Lado máximo da imagem otimizada em pixels
+DERIVATIVE_MAX_SIZE = int(os.getenv("DERIVATIVE_MAX_SIZE", "2048"))
+# Qualidade do JPEG gerado (1-100)
+DERIVATIVE_QUALITY = int(os.getenv("DERIVATIVE_QUALITY", "90"))
+# Gera a imagem otimizada em segundo plano logo após o upload (senão, só na primeira requisição)
+DERIVATIVE_PREFETCH = os.getenv("DERIVATIVE_PREFETCH", "true").lower() in ("1", "true", "yes")
+DERIVATIVE_DIR = os.getenv("DERIVATIVE_DIR", str(Path(__file__).parent.parent / "results" / "derivatives"))
+
+# Incrementar quando o processamento mudar, para invalidar arquivos e ETags antigos
+DERIVATIVE_VERSION = 1
+# Lado máximo aceito antes da redução (imagens maiores são reduzidas na validação)
+MAX_IMAGE_SIDE = 8000
+
+
+def derivative_size(width: int, height: int, max_size: int = DERIVATIVE_MAX_SIZE) -> Tuple[int, int]:
+    """Size of the optimized derivative of a width x height image, computed from the header alone"""
+    if width > MAX_IMAGE_SIDE or height > MAX_IMAGE_SIDE:
+        ratio = min(MAX_IMAGE_SIDE / width, MAX_IMAGE_SIDE / height)
+        width, height = int(width * ratio), int(height * ratio)
+    if width > max_size or height > max_size:
+        ratio = min(max_size / width, max_size / height)
+        width, height = max(1, round(width * ratio)), max(1, round(height * ratio))
+    return width, height
+
+
+def render_derivative(image_path: str, max_size: int = DERIVATIVE_MAX_SIZE,
+                      quality: int = DERIVATIVE_QUALITY) -> bytes:
+    """
+    Autocontrast, +20% contrast and +10% brightness on an RGB copy resized
+    to derivative_size, encoded as JPEG.
+
+    The resize runs first, so the enhancement touches at most
+    max_size x max_size pixels; JPEG sources are decoded at reduced scale.
+    """
+    with Image.open(image_path) as image:
+        size = derivative_size(image.width, image.height, max_size)
+        if image.format == "JPEG":
+            # Decodificação reduzida pelo próprio DCT (potências de 2 acima do tamanho final)
+            image.draft("RGB", size)
+        image = image.convert("RGB")
+        if image.size != size:
+            image = image.resize(size, Image.Resampling.LANCZOS)
+    image = ImageOps.autocontrast(image)
+    image = ImageEnhance.Contrast(image).enhance(1.2)
+    image = ImageEnhance.Brightness(image).enhance(1.1)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+class DerivativeCache:
+    """
+    On-disk store of optimized derivatives named ``{image_hash}-{max_size}-v{version}.jpg``.
+
+    Uploads of the same content share one file. A background prefetch and
+    a request for the same image never render it twice.
+    """
+
+    def __init__(self, cache_dir: str = DERIVATIVE_DIR, max_size: int = DERIVATIVE_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._rendering: Dict[str, threading.Lock] = {}
+        self._renders = 0
+        self._hits = 0
+        self._prefetches = 0
+        self._prefetch_skipped = 0
+
+    def etag(self, image_hash: str) -> str:
+        return f"{image_hash}-{self.max_size}-v{DERIVATIVE_VERSION}"
+
+    def path(self, image_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"{self.etag(image_hash)}.jpg")
+
+    def get_or_render(self, image_hash: str, image_path: str) -> str:
+        """Path of the derivative, rendering it only if it is not stored yet"""
+        path = self.path(image_hash)
+        if os.path.exists(path):
+            with self._lock:
+                self._hits += 1
+            return path
+
+        with self._lock:
+            key_lock = self._rendering.setdefault(image_hash, threading.Lock())
+        with key_lock:
+            # Outra thread pode ter gerado enquanto esta esperava
+            if not os.path.exists(path):
+                data = render_derivative(image_path, self.max_size)
+                # Escrita atômica: requisições concorrentes nunca leem um arquivo pela metade
+                fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+                with self._lock:
+                    self._renders += 1
+        with self._lock:
+            self._rendering.pop(image_hash, None)
+        return path
+
+    def prefetch(self, executor, image_hash: str, image_path: str) -> bool:
+        """
+        Render the derivative in ``executor`` without waiting for it
+
+        Returns:
+            False if it already exists or the executor is saturated
+            (it is then rendered on the first request)
+        """
+        if os.path.exists(self.path(image_hash)):
+            return False
+        try:
+            future = executor.submit(self.get_or_render, image_hash, image_path)
+        except RuntimeError:
+            # ExecutorSaturated: uploads e análises têm prioridade
+            with self._lock:
+                self._prefetch_skipped += 1
+            return False
+        future.add_done_callback(self._log_prefetch_error)
+        with self._lock:
+            self._prefetches += 1
+        return True
+
+    @staticmethod
+    def _log_prefetch_error(future):
+        if future.exception() is not None:
+            print(f"⚠️ Falha ao gerar imagem otimizada: {future.exception()}")
+
+    def invalidate(self, image_hash: str) -> int:
+        """Remove every stored derivative of an image"""
+        removed = 0
+        for path in glob.glob(os.path.join(self.cache_dir, f"{image_hash}-*")):
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "renders": self._renders,
+                "hits": self._hits,
+                "prefetches": self._prefetches,
+                "prefetch_skipped": self._prefetch_skipped,
+            }
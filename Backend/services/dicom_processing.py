@@ -0,0 +1,286 @@
+"""
+DICOM decoding and windowing to 8-bit: one pixel decode per file and a
+lookup table instead of full-frame float64 temporaries.
+
+The original high-bit-depth pixels of each upload are kept as a
+memory-mappable .npy (DicomPixelStore), so other windows can be rendered
+later without the DICOM file.
+"""
+
+import io
+import math
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+import pydicom
+from dotenv import load_dotenv
+from pydicom.dataset import FileMetaDataset
+from pydicom.multival import MultiValue
+from PIL import Image
+from pydicom.uid import ExplicitVRLittleEndian, ImplicitVRLittleEndian
+
+load_dotenv()
+
+# Guarda os pixels originais (16 bits) dos uploads DICOM para re-windowing
+DICOM_STORE_PIXELS = os.getenv("DICOM_STORE_PIXELS", "true").lower() in ("1", "true", "yes")
+DICOM_PIXELS_DIR = os.getenv("DICOM_PIXELS_DIR", str(Path(__file__).parent.parent / "results" / "dicom_pixels"))
+# Qualidade do JPEG das janelas geradas sob demanda (igual à conversão do upload)
+WINDOW_JPEG_QUALITY = 95
+
+# Um caminho de arquivo ou o conteúdo do arquivo DICOM
+DicomSource = Union[str, bytes]
+
+
+def read_dicom(source: DicomSource, stop_before_pixels: bool = False) -> pydicom.Dataset:
+    """
+    Read a DICOM file (force=True accepts files without preamble or meta header)
+
+    Files without a Transfer Syntax UID get the little-endian encoding the
+    parser detected (and grayscale files without Samples per Pixel get 1),
+    so their pixels can still be decoded.
+    """
+    dataset = pydicom.dcmread(source if isinstance(source, str) else io.BytesIO(source),
+                              stop_before_pixels=stop_before_pixels, force=True)
+    if getattr(dataset, "file_meta", None) is None:
+        dataset.file_meta = FileMetaDataset()
+    if "TransferSyntaxUID" not in dataset.file_meta:
+        is_implicit_vr, is_little_endian = dataset.original_encoding
+        if is_little_endian:
+            dataset.file_meta.TransferSyntaxUID = ImplicitVRLittleEndian if is_implicit_vr else ExplicitVRLittleEndian
+    # Arquivos exportados sem SamplesPerPixel: tons de cinza têm uma amostra por pixel
+    if "SamplesPerPixel" not in dataset and str(dataset.get("PhotometricInterpretation", "")).startswith("MONOCHROME"):
+        dataset.SamplesPerPixel = 1
+    return dataset
+
+
+def dicom_metadata(dataset: pydicom.Dataset) -> Dict[str, Any]:
+    """Metadata stored with the analysis (dicom_metadata in the image info)"""
+    return {
+        "patient_id": str(dataset.get("PatientID", "N/A")),
+        "study_date": str(dataset.get("StudyDate", "N/A")),
+        "study_time": str(dataset.get("StudyTime", "N/A")),
+        "modality": str(dataset.get("Modality", "N/A")),
+        "body_part": str(dataset.get("BodyPartExamined", "N/A")),
+        "study_description": str(dataset.get("StudyDescription", "N/A")),
+        "series_description": str(dataset.get("SeriesDescription", "N/A")),
+        "manufacturer": str(dataset.get("Manufacturer", "N/A")),
+        "manufacturer_model": str(dataset.get("ManufacturerModelName", "N/A")),
+        "rows": int(dataset.get("Rows", 0)),
+        "columns": int(dataset.get("Columns", 0)),
+        "bits_allocated": int(dataset.get("BitsAllocated", 16)),
+        "photometric_interpretation": str(dataset.get("PhotometricInterpretation", "N/A")),
+        "window_center": str(dataset.get("WindowCenter", "N/A")),
+        "window_width": str(dataset.get("WindowWidth", "N/A"))
+    }
+
+
+def window_bounds(dataset: pydicom.Dataset) -> Optional[Tuple[float, float]]:
+    """(min, max) of the first WindowCenter/WindowWidth pair, or None if absent or invalid"""
+    if not (hasattr(dataset, "WindowCenter") and hasattr(dataset, "WindowWidth")):
+        return None
+    try:
+        # Valores multivalorados: usar o primeiro par
+        window_center = dataset.WindowCenter
+        window_width = dataset.WindowWidth
+        if isinstance(window_center, (list, tuple, MultiValue)):
+            window_center = window_center[0]
+        if isinstance(window_width, (list, tuple, MultiValue)):
+            window_width = window_width[0]
+        window_center, window_width = float(window_center), float(window_width)
+    except Exception as e:
+        print(f"⚠️  Erro no windowing DICOM, usando normalização padrão: {str(e)}")
+        return None
+    return window_from_center(window_center, window_width)
+
+
+def window_lut(dtype: np.dtype, pixel_min: int, pixel_max: int,
+               window: Optional[Tuple[float, float]] = None) -> np.ndarray:
+    """
+    uint8 lookup table over every bit pattern of an integer dtype of up to 16 bits
+
+    Entry i is the 8-bit value of the pixel whose bits are i, so signed
+    arrays are looked up through their unsigned view. The mapping is the
+    same float64 clip-and-stretch as applying it to the whole frame:
+    clip to the window, then stretch the clipped [min, max] to [0, 255].
+    """
+    dtype = np.dtype(dtype)
+    codes = np.arange(2 ** (8 * dtype.itemsize), dtype=np.dtype(f"u{dtype.itemsize}"))
+    values = codes.view(dtype).astype(np.float64)
+    low, high = float(pixel_min), float(pixel_max)
+    if window is not None:
+        values = np.clip(values, *window)
+        # O windowing é monótono: mínimo e máximo após o corte são os originais cortados
+        low, high = (float(v) for v in np.clip([low, high], *window))
+    if high <= low:
+        return np.zeros(len(codes), dtype=np.uint8)
+    # Pixels fora de [min, max] não existem na imagem; o valor na tabela é irrelevante
+    return np.clip((values - low) / (high - low) * 255, 0, 255).astype(np.uint8)
+
+
+def to_uint8(pixel_array: np.ndarray, window: Optional[Tuple[float, float]] = None) -> np.ndarray:
+    """
+    Window ``pixel_array`` and stretch it to 0-255
+
+    Integer arrays of up to 16 bits (all mammography detectors) go through
+    window_lut: two reductions and one uint8 gather, no full-frame temporary.
+    """
+    if pixel_array.dtype.kind in "iu" and pixel_array.dtype.itemsize <= 2:
+        lut = window_lut(pixel_array.dtype, pixel_array.min(), pixel_array.max(), window)
+        return lut[pixel_array.view(np.dtype(f"u{pixel_array.dtype.itemsize}"))]
+
+    # Outros tipos (float, 32 bits): normalização direta
+    if window is not None:
+        pixel_array = np.clip(pixel_array, *window)
+    pixel_min = pixel_array.min()
+    pixel_max = pixel_array.max()
+    if pixel_max <= pixel_min:
+        return np.zeros(pixel_array.shape, dtype=np.uint8)
+    return ((pixel_array - pixel_min) / (pixel_max - pixel_min) * 255).astype(np.uint8)
+
+
+def read_pixels(source: DicomSource) -> Tuple[np.ndarray, Dict[str, Any], Optional[Tuple[float, float]]]:
+    """
+    Decode the pixel data of a DICOM file once
+
+    Returns:
+        tuple: (original pixel array, metadata, window bounds or None)
+    """
+    dataset = read_dicom(source)
+    metadata = dicom_metadata(dataset)
+    window = window_bounds(dataset)
+    pixel_array = dataset.pixel_array
+    # Libera os bytes brutos antes do windowing: restam só o array decodificado e a saída
+    del dataset.PixelData
+    return pixel_array, metadata, window
+
+
+def decode_dicom(source: DicomSource) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    Decode a DICOM file once and window it to 8-bit
+
+    Returns:
+        tuple: (uint8 pixel array, metadata)
+    """
+    pixel_array, metadata, window = read_pixels(source)
+    return to_uint8(pixel_array, window), metadata
+
+
+def to_jpeg(pixel_array: np.ndarray) -> bytes:
+    """RGB JPEG (quality 95) of a windowed 8-bit frame, as stored in uploads/"""
+    if len(pixel_array.shape) == 3:
+        # Imagem colorida
+        image = Image.fromarray(pixel_array)
+    else:
+        # Imagem em escala de cinza
+        image = Image.fromarray(pixel_array, mode='L')
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    # Qualidade fixa e optimize=False para consistência
+    image.save(buffer, format='JPEG', quality=95, optimize=False)
+    return buffer.getvalue()
+
+
+def image_info(metadata: Dict[str, Any], window: Optional[Tuple[float, float]]) -> Dict[str, Any]:
+    """Image info stored with the analysis of a converted DICOM upload"""
+    return {
+        "dimensions": (metadata["rows"], metadata["columns"]),
+        "format": "DICOM",
+        "mode": "RGB",
+        "is_optimized": True,
+        "was_resized": False,
+        "original_dimensions": None,
+        "dicom_metadata": metadata,
+        # Janela aplicada na conversão (padrão de /window)
+        "window": list(window) if window else None
+    }
+
+
+def window_from_center(center: float, width: float) -> Tuple[float, float]:
+    """Window bounds from a DICOM WindowCenter/WindowWidth pair"""
+    return center - width / 2, center + width / 2
+
+
+def render_window(pixels: np.ndarray, window: Optional[Tuple[float, float]] = None,
+                  max_size: Optional[int] = None) -> bytes:
+    """
+    8-bit JPEG of ``pixels`` under ``window``, at most ``max_size`` px per side
+
+    With the default window this is the image stored at upload time.
+    """
+    image = to_uint8(pixels, window)
+    if max_size and max(image.shape[:2]) > max_size:
+        scale = max_size / max(image.shape[:2])
+        size = (max(1, math.floor(image.shape[1] * scale)), max(1, math.floor(image.shape[0] * scale)))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, WINDOW_JPEG_QUALITY])
+    if not ok:
+        raise ValueError("Falha ao codificar a janela em JPEG")
+    return encoded.tobytes()
+
+
+class DicomPixelStore:
+    """
+    Original pixels of DICOM uploads, one ``{image_hash}.npy`` per content.
+
+    .npy keeps any bit depth and sign, is written without re-encoding and
+    opens memory-mapped: a new window reads the pixels straight from the
+    page cache instead of parsing and decoding the DICOM again.
+    """
+
+    def __init__(self, store_dir: str = DICOM_PIXELS_DIR):
+        self.store_dir = store_dir
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._saves = 0
+        self._loads = 0
+
+    def path(self, image_hash: str) -> str:
+        return os.path.join(self.store_dir, f"{image_hash}.npy")
+
+    def exists(self, image_hash: str) -> bool:
+        return os.path.exists(self.path(image_hash))
+
+    def save(self, image_hash: str, pixels: np.ndarray) -> str:
+        """Write ``pixels`` atomically (concurrent readers never see a partial file)"""
+        path = self.path(image_hash)
+        fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.ascontiguousarray(pixels), allow_pickle=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            self._saves += 1
+        return path
+
+    def load(self, image_hash: str) -> Optional[np.ndarray]:
+        """Read-only memory map of the stored pixels, or None if not stored"""
+        try:
+            pixels = np.load(self.path(image_hash), mmap_mode="r", allow_pickle=False)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._loads += 1
+        return pixels
+
+    def invalidate(self, image_hash: str) -> bool:
+        try:
+            os.remove(self.path(image_hash))
+            return True
+        except OSError:
+            return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"enabled": DICOM_STORE_PIXELS, "saves": self._saves, "loads": self._loads}
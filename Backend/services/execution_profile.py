@@ -0,0 +1,126 @@
+"""
+Execution profiles: TensorFlow threading, worker counts and CPU affinity
+"""
+
+import os
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Perfil de execução:
+#   "latency"     - uma predição usa todos os núcleos (menor latência por requisição)
+#   "throughput"  - lotes maiores, núcleos divididos entre operações (mais imagens por segundo)
+#   "shared-host" - poucos threads, para dividir a máquina com outros serviços (padrão)
+EXECUTION_PROFILE = os.getenv("EXECUTION_PROFILE", "shared-host").lower()
+# Núcleos aos quais o processo é fixado, ex.: "0-3" ou "0,2,4,6" (vazio = todos)
+CPU_AFFINITY = os.getenv("CPU_AFFINITY", "")
+
+EXECUTION_PROFILES = ("latency", "throughput", "shared-host")
+# Variáveis de ambiente que, quando definidas, têm prioridade sobre o perfil
+PROFILE_SETTINGS = (
+    "TF_INTRA_OP_THREADS", "TF_INTER_OP_THREADS", "TFLITE_NUM_THREADS",
+    "PREPROCESS_WORKERS", "CPU_POOL_WORKERS", "INFERENCE_POOL_WORKERS", "MODEL_BATCH_MAX_SIZE",
+)
+
+
+def parse_cpu_list(spec: str) -> List[int]:
+    """Parse a Linux CPU list such as "0-3,6" into [0, 1, 2, 3, 6]"""
+    cores = set()
+    for part in spec.replace(" ", "").split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cores.update(range(int(start), int(end) + 1))
+        else:
+            cores.add(int(part))
+    return sorted(cores)
+
+
+def apply_cpu_affinity(spec: str = None) -> Optional[List[int]]:
+    """
+    Pin the process to the cores in ``spec`` (default: CPU_AFFINITY).
+
+    Threads inherit the mask of the thread that creates them, so this must
+    run before TensorFlow, OpenCV and the executors start their pools.
+    """
+    spec = CPU_AFFINITY if spec is None else spec
+    if not spec or not hasattr(os, "sched_setaffinity"):
+        return None
+    try:
+        cores = parse_cpu_list(spec)
+        os.sched_setaffinity(0, cores)
+    except (ValueError, OSError) as e:
+        print(f"⚠️ CPU_AFFINITY inválido '{spec}': {e}")
+        return None
+    return cores
+
+
+def available_cores() -> int:
+    """Cores this process may run on (respects affinity and cgroup pinning)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def profile_settings(profile: str, cores: int) -> Dict[str, int]:
+    """Thread and worker counts of a profile for a machine with ``cores`` cores"""
+    if profile == "latency":
+        return {
+            "TF_INTRA_OP_THREADS": cores,
+            "TF_INTER_OP_THREADS": 1,
+            "TFLITE_NUM_THREADS": cores,
+            "PREPROCESS_WORKERS": cores,
+            "CPU_POOL_WORKERS": min(4, cores),
+            "INFERENCE_POOL_WORKERS": 8,
+            "MODEL_BATCH_MAX_SIZE": 4,
+        }
+    if profile == "throughput":
+        # Lotes maiores; cada operação usa metade dos núcleos para que forward
+        # passes concorrentes (ou operações independentes do grafo) se sobreponham
+        half = max(1, cores // 2)
+        return {
+            "TF_INTRA_OP_THREADS": half,
+            "TF_INTER_OP_THREADS": 2,
+            "TFLITE_NUM_THREADS": half,
+            "PREPROCESS_WORKERS": cores,
+            "CPU_POOL_WORKERS": cores,
+            "INFERENCE_POOL_WORKERS": 32,
+            "MODEL_BATCH_MAX_SIZE": 16,
+        }
+    # shared-host: limites fixos e pequenos, independentes do tamanho da máquina
+    return {
+        "TF_INTRA_OP_THREADS": min(2, cores),
+        "TF_INTER_OP_THREADS": min(2, cores),
+        "TFLITE_NUM_THREADS": min(2, cores),
+        "PREPROCESS_WORKERS": min(4, cores),
+        "CPU_POOL_WORKERS": min(4, cores),
+        "INFERENCE_POOL_WORKERS": 8,
+        "MODEL_BATCH_MAX_SIZE": 8,
+    }
+
+
+if EXECUTION_PROFILE not in EXECUTION_PROFILES:
+    print(f"⚠️ Perfil de execução desconhecido '{EXECUTION_PROFILE}', usando 'shared-host'")
+    EXECUTION_PROFILE = "shared-host"
+
+PINNED_CORES = apply_cpu_affinity()
+_settings = profile_settings(EXECUTION_PROFILE, available_cores())
+
+
+def setting(name: str) -> int:
+    """Explicit environment variable if set, otherwise the active profile's value"""
+    value = os.getenv(name)
+    return int(value) if value else _settings[name]
+
+
+def describe() -> Dict[str, object]:
+    """Active profile and effective values, for the stats endpoint"""
+    return {
+        "profile": EXECUTION_PROFILE,
+        "cores": available_cores(),
+        "pinned_cores": PINNED_CORES,
+        "settings": {name: setting(name) for name in PROFILE_SETTINGS},
+    }
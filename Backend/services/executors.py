@@ -0,0 +1,119 @@
+"""
+Bounded executors that keep blocking work off the asyncio event loop
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from dotenv import load_dotenv
+
+from services import execution_profile
+
+load_dotenv()
+
+# Processamento de imagem (OpenCV / Pillow / NumPy liberam o GIL nos kernels);
+# o número de workers padrão vem do perfil de execução (EXECUTION_PROFILE)
+CPU_POOL_WORKERS = execution_profile.setting("CPU_POOL_WORKERS")
+CPU_POOL_QUEUE = int(os.getenv("CPU_POOL_QUEUE", "16"))
+# Inferência do modelo treinado; precisa de pelo menos MODEL_BATCH_MAX_SIZE
+# threads para que o micro-batching consiga formar lotes completos
+INFERENCE_POOL_WORKERS = execution_profile.setting("INFERENCE_POOL_WORKERS")
+INFERENCE_POOL_QUEUE = int(os.getenv("INFERENCE_POOL_QUEUE", "32"))
+# Chamadas HTTP às APIs externas (Gemini / Hugging Face)
+HTTP_POOL_WORKERS = int(os.getenv("HTTP_POOL_WORKERS", "8"))
+HTTP_POOL_QUEUE = int(os.getenv("HTTP_POOL_QUEUE", "32"))
+
+
+class ExecutorSaturated(RuntimeError):
+    """Raised when an executor already has max_workers + max_queue tasks in flight"""
+
+    def __init__(self, name: str):
+        super().__init__(f"Executor '{name}' saturado, tente novamente em instantes")
+        self.name = name
+
+
+class BoundedExecutor:
+    """
+    Wraps an Executor with admission control.
+
+    At most ``max_workers`` tasks run at once and at most ``max_queue`` more
+    wait for a worker; anything beyond that is rejected immediately with
+    ExecutorSaturated instead of piling up unbounded work.
+    """
+
+    def __init__(self, name: str, executor: Executor, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = executor
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def _on_done(self, _future):
+        with self._stats_lock:
+            self._in_flight -= 1
+            self._completed += 1
+        self._slots.release()
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        """Submit fn or raise ExecutorSaturated when the queue is full"""
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self._rejected += 1
+            raise ExecutorSaturated(self.name)
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._stats_lock:
+            self._in_flight += 1
+        future.add_done_callback(self._on_done)
+        return future
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn in the executor and await its result from the event loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def _thread_pool(name: str, workers: int, queue: int) -> BoundedExecutor:
+    return BoundedExecutor(
+        name,
+        ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-pool"),
+        max_workers=workers,
+        max_queue=queue,
+    )
+
+
+cpu_executor = _thread_pool("cpu", CPU_POOL_WORKERS, CPU_POOL_QUEUE)
+inference_executor = _thread_pool("inference", INFERENCE_POOL_WORKERS, INFERENCE_POOL_QUEUE)
+http_executor = _thread_pool("http", HTTP_POOL_WORKERS, HTTP_POOL_QUEUE)
+
+
+def get_executor_stats() -> Dict[str, Dict[str, int]]:
+    """Occupancy of every executor, for health checks"""
+    return {executor.name: executor.get_stats() for executor in (cpu_executor, inference_executor, http_executor)}
+
+
+def shutdown_executors(wait: bool = False):
+    for executor in (cpu_executor, inference_executor, http_executor):
+        executor.shutdown(wait=wait)
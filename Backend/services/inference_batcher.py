@@ -0,0 +1,166 @@
+"""
+Dynamic micro-batching queue for model inference
+"""
+
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+
+class _PendingRequest:
+    __slots__ = ("tensor", "future", "enqueued_at")
+
+    def __init__(self, tensor: np.ndarray):
+        self.tensor = tensor
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class InferenceBatcher:
+    """
+    Gathers concurrent single-image requests into one batched forward pass.
+
+    A worker thread waits for the first request, then keeps collecting until
+    either ``max_batch_size`` images are queued or ``max_wait_ms`` has passed
+    since that first request. ``batch_fn`` receives the stacked ``(N, H, W, C)``
+    batch and must return a sequence with one result per row; each caller gets
+    back the row that corresponds to its own image.
+    """
+
+    def __init__(self, batch_fn: Callable[[np.ndarray], Any], max_batch_size: int = 8,
+                 max_wait_ms: float = 5.0, name: str = "inference-batcher"):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+
+        self._queue: "queue.Queue[Optional[_PendingRequest]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self._closed = False
+
+        # Estatísticas
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._wait_times = deque(maxlen=1000)
+        self._batch_times = deque(maxlen=1000)
+        self._total_requests = 0
+        self._total_batches = 0
+
+    def _enqueue(self, request: _PendingRequest):
+        """Queue a request, starting the worker if needed"""
+        with self._thread_lock:
+            # Verificação repetida sob o lock: close() pode ter rodado depois da de submit();
+            # enfileirar aqui garante que o pedido entra antes do sinal de encerramento
+            if self._closed:
+                raise RuntimeError("InferenceBatcher foi encerrado")
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._queue.put(request)
+
+    def submit(self, tensor: np.ndarray) -> Future:
+        """
+        Queue one preprocessed image for inference
+
+        Args:
+            tensor: Image array shaped (H, W, C) or (1, H, W, C)
+
+        Returns:
+            Future resolved with this image's row of the batch output
+        """
+        if self._closed:
+            raise RuntimeError("InferenceBatcher foi encerrado")
+        if tensor.ndim == 4:
+            if tensor.shape[0] != 1:
+                raise ValueError("submit() aceita uma única imagem por chamada")
+            tensor = tensor[0]
+        request = _PendingRequest(tensor)
+        self._enqueue(request)
+        return request.future
+
+    def infer(self, tensor: np.ndarray, timeout: Optional[float] = None) -> Any:
+        """Submit one image and block until its result is available"""
+        return self.submit(tensor).result(timeout=timeout)
+
+    def _collect_batch(self, first: _PendingRequest) -> List[_PendingRequest]:
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # Sinal de encerramento: processa o lote atual e repassa o sinal
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect_batch(first)
+            started = time.monotonic()
+
+            try:
+                inputs = np.stack([request.tensor for request in batch])
+                outputs = self.batch_fn(inputs)
+                if len(outputs) != len(batch):
+                    raise RuntimeError(f"batch_fn retornou {len(outputs)} resultados para {len(batch)} imagens")
+                for request, output in zip(batch, outputs):
+                    request.future.set_result(output)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+            finished = time.monotonic()
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+                self._total_batches += 1
+                self._total_requests += len(batch)
+                self._batch_times.append(finished - started)
+                self._wait_times.extend(started - request.enqueued_at for request in batch)
+
+    def close(self):
+        """Stop the worker after the queued requests are served"""
+        with self._thread_lock:
+            self._closed = True
+            if self._thread is not None and self._thread.is_alive():
+                self._queue.put(None)
+                self._thread.join(timeout=5)
+            self._thread = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Batch-size histogram and queue wait times"""
+        with self._stats_lock:
+            wait_ms = np.asarray(self._wait_times, dtype=np.float64) * 1000
+            batch_ms = np.asarray(self._batch_times, dtype=np.float64) * 1000
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_s * 1000,
+                "total_requests": self._total_requests,
+                "total_batches": self._total_batches,
+                "mean_batch_size": round(self._total_requests / self._total_batches, 2) if self._total_batches else 0.0,
+                "batch_size_histogram": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                "queue_wait_ms": {
+                    "p50": round(float(np.percentile(wait_ms, 50)), 2) if wait_ms.size else 0.0,
+                    "p99": round(float(np.percentile(wait_ms, 99)), 2) if wait_ms.size else 0.0,
+                    "max": round(float(wait_ms.max()), 2) if wait_ms.size else 0.0,
+                },
+                "batch_latency_ms": {
+                    "p50": round(float(np.percentile(batch_ms, 50)), 2) if batch_ms.size else 0.0,
+                    "p99": round(float(np.percentile(batch_ms, 99)), 2) if batch_ms.size else 0.0,
+                },
+                "queue_depth": self._queue.qsize(),
+            }
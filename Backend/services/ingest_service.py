@@ -0,0 +1,386 @@
+"""
+Streaming ingestion of uploaded files: bounded memory, early size limits
+and incremental hashing
+"""
+
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import zipfile
+from collections import deque
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from dotenv import load_dotenv
+from fastapi import UploadFile
+from PIL import Image
+
+from services import dicom_processing
+from services.derivatives import MAX_IMAGE_SIDE, derivative_size
+
+load_dotenv()
+
+# Tamanho máximo por upload (MB): DICOM e demais formatos
+UPLOAD_MAX_SIZE_MB = float(os.getenv("UPLOAD_MAX_SIZE_MB", "10"))
+UPLOAD_MAX_DICOM_SIZE_MB = float(os.getenv("UPLOAD_MAX_DICOM_SIZE_MB", "50"))
+# Tamanho de cada bloco lido do upload (KB); limita a memória por upload
+UPLOAD_CHUNK_SIZE_KB = int(os.getenv("UPLOAD_CHUNK_SIZE_KB", "1024"))
+# Upload em lote (/api/v1/upload/batch): tamanho total da requisição (MB, arquivos
+# e ZIP/TAR, e também do conteúdo extraído) e número máximo de imagens
+UPLOAD_BATCH_MAX_SIZE_MB = float(os.getenv("UPLOAD_BATCH_MAX_SIZE_MB", "1024"))
+UPLOAD_BATCH_MAX_FILES = int(os.getenv("UPLOAD_BATCH_MAX_FILES", "1000"))
+
+# Validação da imagem no upload:
+#   "header" - só o cabeçalho (dimensões, modo e formato), sem decodificar pixels (padrão)
+#   "decode" - decodifica os pixels para detectar arquivos truncados ou corrompidos
+UPLOAD_VALIDATION = os.getenv("UPLOAD_VALIDATION", "header").lower()
+# Dimensões mínimas aceitas
+MIN_IMAGE_SIDE = 100
+
+# Amostras de latência guardadas por resultado da ingestão
+INGEST_LATENCY_SAMPLES = 1000
+
+# Folga para os cabeçalhos do multipart ao comparar com o Content-Length
+MULTIPART_OVERHEAD = 64 * 1024
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".dcm", ".pgm")
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+
+
+class UploadTooLarge(Exception):
+    """The upload exceeded the size limit of its file type"""
+
+    def __init__(self, max_size: int):
+        super().__init__(f"Arquivo maior que {max_size / 2 ** 20:.0f}MB")
+        self.max_size = max_size
+
+
+def max_upload_size(extension: str) -> int:
+    """Size limit in bytes for a file extension such as ".dcm" """
+    limit_mb = UPLOAD_MAX_DICOM_SIZE_MB if extension.lower() == ".dcm" else UPLOAD_MAX_SIZE_MB
+    return int(limit_mb * 1024 * 1024)
+
+
+def max_request_size(batch: bool = False) -> int:
+    """Largest request body any upload may have (checked before parsing the form)"""
+    if batch:
+        return max_batch_size() + MULTIPART_OVERHEAD
+    return int(max(UPLOAD_MAX_SIZE_MB, UPLOAD_MAX_DICOM_SIZE_MB) * 1024 * 1024) + MULTIPART_OVERHEAD
+
+
+def max_batch_size() -> int:
+    """Size limit in bytes of a batch upload, and of what its archives extract to"""
+    return int(UPLOAD_BATCH_MAX_SIZE_MB * 1024 * 1024)
+
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+class BatchLimitExceeded(Exception):
+    """A batch upload has more files, or extracts to more bytes, than allowed"""
+
+
+class InvalidImage(ValueError):
+    """The uploaded file is not an acceptable image"""
+
+
+def validate_image(path: str, filename: str, validation: str = None) -> Dict[str, Any]:
+    """
+    Validate an uploaded image and describe it without producing any pixels
+
+    The returned ``dimensions`` are those of the optimized derivative
+    (services/derivatives.py), which is rendered later, on demand.
+
+    Raises:
+        InvalidImage: if the file cannot be read or is too small
+    """
+    validation = (validation or UPLOAD_VALIDATION).lower()
+    try:
+        if filename.lower().endswith(".dcm"):
+            # Só o cabeçalho: os pixels são decodificados uma única vez, na conversão
+            # (dicom_processing.decode_dicom), que já falha para arquivos corrompidos
+            dataset = dicom_processing.read_dicom(path, stop_before_pixels=True)
+            width, height = int(dataset.get("Columns", 0)), int(dataset.get("Rows", 0))
+            image_format, mode = "DICOM", str(dataset.get("PhotometricInterpretation", ""))
+        else:
+            # Image.open lê apenas o cabeçalho; os pixels só são decodificados em load()
+            with Image.open(path) as image:
+                if validation != "header":
+                    image.load()
+                width, height = image.size
+                image_format, mode = image.format, image.mode
+    except Exception as e:
+        raise InvalidImage(f"Erro ao processar imagem: {str(e)}")
+
+    if width < MIN_IMAGE_SIDE or height < MIN_IMAGE_SIDE:
+        raise InvalidImage(f"Imagem muito pequena. Mínimo de {MIN_IMAGE_SIDE}x{MIN_IMAGE_SIDE}px")
+    if width > MAX_IMAGE_SIDE or height > MAX_IMAGE_SIDE:
+        print(f"📏 Imagem grande detectada: {width}x{height}px (a imagem otimizada é reduzida)")
+
+    optimized_width, optimized_height = derivative_size(width, height)
+    return {
+        "dimensions": (optimized_width, optimized_height),
+        "format": image_format,
+        "mode": "RGB",
+        "original_mode": mode,
+        "is_optimized": True,
+        "was_resized": (optimized_width, optimized_height) != (width, height),
+        "original_dimensions": (width, height)
+    }
+
+
+class SpooledUpload:
+    """
+    An upload written to a temporary file next to its final location.
+
+    ``commit`` renames it into place atomically, so readers never see a
+    partial file; an upload that is not committed is removed on ``discard``.
+    """
+
+    def __init__(self, path: str, size: int, md5: str):
+        self.path = path
+        self.size = size
+        self.md5 = md5
+        self.committed = False
+
+    def commit(self, destination: str) -> str:
+        os.replace(self.path, destination)
+        self.path = destination
+        self.committed = True
+        return destination
+
+    def discard(self):
+        if not self.committed and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.discard()
+
+
+def hash_stream(stream: BinaryIO, chunk_size: Optional[int] = None) -> str:
+    """
+    image_hash of a file object read in upload-sized chunks: the MD5 that
+    spool_upload and spool_stream compute while writing
+    """
+    chunk_size = chunk_size or UPLOAD_CHUNK_SIZE_KB * 1024
+    digest = hashlib.md5()
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def md5_file(path: str) -> str:
+    """image_hash of a file already on disk (bulk ingest)"""
+    with open(path, "rb") as f:
+        return hash_stream(f)
+
+
+class _SpoolWriter:
+    """
+    Temporary file in ``directory`` fed one chunk at a time: enforces the
+    size limit, hashes the content and removes the file if anything fails
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.digest = hashlib.md5()
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise UploadTooLarge(self.max_size)
+        self.digest.update(chunk)
+        self._file.write(chunk)
+
+    def result(self) -> SpooledUpload:
+        return SpooledUpload(self.path, self.size, self.digest.hexdigest())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        failed = exc_type is not None
+        try:
+            self._file.close()
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            if failed:
+                os.unlink(self.path)
+
+
+async def spool_upload(upload: UploadFile, directory: str, max_size: int,
+                       chunk_size: Optional[int] = None) -> SpooledUpload:
+    """
+    Copy an upload to a temporary file in ``directory`` in fixed-size chunks,
+    hashing as it goes
+
+    Raises:
+        UploadTooLarge: as soon as more than ``max_size`` bytes were read
+    """
+    # Tamanho já conhecido pelo parser do multipart: rejeita sem ler nada
+    if upload.size is not None and upload.size > max_size:
+        raise UploadTooLarge(max_size)
+
+    chunk_size = chunk_size or UPLOAD_CHUNK_SIZE_KB * 1024
+    with _SpoolWriter(directory, max_size) as spool:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            spool.write(chunk)
+    return spool.result()
+
+
+def spool_stream(stream: BinaryIO, directory: str, max_size: int,
+                 chunk_size: Optional[int] = None) -> SpooledUpload:
+    """spool_upload for a blocking file object (an archive member)"""
+    chunk_size = chunk_size or UPLOAD_CHUNK_SIZE_KB * 1024
+    with _SpoolWriter(directory, max_size) as spool:
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            spool.write(chunk)
+    return spool.result()
+
+
+def _archive_members(path: str, filename: str):
+    """(name, size, open) of each regular file in a ZIP or TAR archive, in archive order"""
+    if filename.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield info.filename, info.file_size, lambda info=info: archive.open(info)
+    else:
+        # Modo "r|*": leitura sequencial (também para .tar.gz), sem índice em memória
+        with tarfile.open(path, "r|*") as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, member.size, lambda member=member: archive.extractfile(member)
+
+
+def expand_archive(path: str, filename: str, directory: str, max_files: int = None,
+                   max_total: int = None) -> List[Tuple[str, Union[SpooledUpload, str]]]:
+    """
+    Extract the images of a ZIP/TAR archive into spooled uploads in ``directory``
+
+    Members are streamed one at a time with the per-type size limit; other
+    files (metadata, .txt, .csv) are left out.
+
+    Returns:
+        list of (member name, SpooledUpload or error message)
+
+    Raises:
+        BatchLimitExceeded: more than ``max_files`` images or ``max_total`` bytes
+    """
+    max_files = UPLOAD_BATCH_MAX_FILES if max_files is None else max_files
+    max_total = max_batch_size() if max_total is None else max_total
+    entries = []
+    total = 0
+    try:
+        for name, size, open_member in _archive_members(path, filename):
+            base = os.path.basename(name)
+            extension = os.path.splitext(base)[1].lower()
+            # Metadados de sistemas operacionais (__MACOSX/, ._arquivo) e não imagens
+            if base.startswith(".") or "__MACOSX" in name or extension not in IMAGE_EXTENSIONS:
+                continue
+            if len(entries) >= max_files:
+                raise BatchLimitExceeded(f"Lote com mais de {max_files} imagens")
+            limit = max_upload_size(extension)
+            if size > limit:
+                entries.append((name, f"Arquivo muito grande. Tamanho máximo: {limit / 2 ** 20:.0f}MB"))
+                continue
+            if total + size > max_total:
+                raise BatchLimitExceeded(f"Conteúdo extraído maior que {max_total / 2 ** 20:.0f}MB")
+            with open_member() as stream:
+                try:
+                    upload = spool_stream(stream, directory, limit)
+                except UploadTooLarge as e:
+                    entries.append((name, str(e)))
+                    continue
+            total += upload.size
+            entries.append((name, upload))
+    except BaseException as e:
+        for _, entry in entries:
+            if isinstance(entry, SpooledUpload):
+                entry.discard()
+        if isinstance(e, (zipfile.BadZipFile, tarfile.TarError)):
+            raise ValueError(f"Arquivo compactado inválido: {e}") from e
+        raise
+    return entries
+
+
+def write_atomic(destination: str, data: bytes) -> str:
+    """Write ``data`` to a temporary file and rename it to ``destination``"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(destination), prefix=".upload-", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return destination
+
+
+def copy_atomic(source: str, destination: str) -> str:
+    """Copy ``source`` to a temporary file and rename it to ``destination``"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(destination), prefix=".upload-", suffix=".part")
+    os.close(fd)
+    try:
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return destination
+
+
+class IngestStats:
+    """
+    Upload counts and latencies by outcome:
+        "dedup_hit"   - content already analyzed, stored result returned
+        "info_reused" - content already known, stored image info reused (no decoding)
+        "decoded"     - new content, image decoded and validated
+    """
+
+    OUTCOMES = ("dedup_hit", "info_reused", "decoded")
+
+    def __init__(self, max_samples: int = INGEST_LATENCY_SAMPLES):
+        self._lock = threading.Lock()
+        self._counts = {outcome: 0 for outcome in self.OUTCOMES}
+        self._latencies = {outcome: deque(maxlen=max_samples) for outcome in self.OUTCOMES}
+
+    def record(self, outcome: str, elapsed_s: float):
+        with self._lock:
+            self._counts[outcome] += 1
+            self._latencies[outcome].append(elapsed_s * 1000)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {}
+            for outcome in self.OUTCOMES:
+                samples = np.asarray(self._latencies[outcome])
+                stats[outcome] = {
+                    "count": self._counts[outcome],
+                    "p50_ms": round(float(np.percentile(samples, 50)), 2) if samples.size else None,
+                    "p99_ms": round(float(np.percentile(samples, 99)), 2) if samples.size else None,
+                }
+        total = sum(entry["count"] for entry in stats.values())
+        stats["dedup_hit_rate"] = round(stats["dedup_hit"]["count"] / total, 3) if total else 0.0
+        return stats
+
+
+# Global instance
+ingest_stats = IngestStats()
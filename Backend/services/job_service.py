@@ -0,0 +1,223 @@
+"""
+In-process job queue for long-running analyses, with status polling and
+event subscriptions for server-sent events
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Número de análises processadas simultaneamente pelos workers de jobs
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Máximo de jobs aguardando na fila antes de recusar novos (503)
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+# Tempo que jobs finalizados permanecem consultáveis
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+
+TERMINAL_STATUSES = ("completed", "error")
+
+
+class JobQueueFull(RuntimeError):
+    """Raised when JOB_QUEUE_SIZE jobs are already waiting"""
+
+
+class Job:
+    """A single analysis job and its status history"""
+
+    def __init__(self, kind: str, analysis_id: int, handler: Callable[["Job"], Awaitable[Dict[str, Any]]],
+                 options: Optional[Dict[str, Any]] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.analysis_id = analysis_id
+        # Parâmetros que mudam o resultado (ex.: tta): fazem parte da deduplicação
+        self.options = dict(options or {})
+        self.handler = handler
+        self.status = "queued"
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.events: List[Dict[str, Any]] = []
+        self._subscribers: List[asyncio.Queue] = []
+        self._finished_monotonic: Optional[float] = None
+        self.publish("queued", "Job enfileirado")
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def publish(self, status: str, message: Optional[str] = None, **data):
+        """Record a status transition and push it to every subscriber"""
+        self.status = status
+        event = {
+            "job_id": self.id,
+            "analysis_id": self.analysis_id,
+            "status": status,
+            "message": message,
+            "at": datetime.utcnow().isoformat(),
+            **data
+        }
+        self.events.append(event)
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    async def subscribe(self, keepalive_seconds: float = 15.0) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Yield past events, then live ones until the job finishes.
+        Yields None every keepalive_seconds without news so callers can
+        keep idle connections open.
+        """
+        # Histórico e inscrição no mesmo passo síncrono: cada evento chega uma única vez
+        history = list(self.events)
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.append(queue)
+        try:
+            for event in history:
+                yield event
+            if history and history[-1]["status"] in TERMINAL_STATUSES:
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield event
+                if event["status"] in TERMINAL_STATUSES:
+                    return
+        finally:
+            self._subscribers.remove(queue)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "analysis_id": self.analysis_id,
+            "options": self.options,
+            "status": self.status,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "events": self.events,
+            "result": self.result,
+            "error": self.error
+        }
+
+
+class JobManager:
+    """
+    Runs submitted jobs on a fixed number of asyncio worker tasks.
+
+    Handlers are coroutines; any blocking work inside them is expected to
+    be delegated to the bounded executors so workers never block the loop.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_queued: int = JOB_QUEUE_SIZE,
+                 retention_seconds: float = JOB_RETENTION_SECONDS):
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.retention_seconds = retention_seconds
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"job-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, kind: str, analysis_id: int,
+               handler: Callable[[Job], Awaitable[Dict[str, Any]]],
+               options: Optional[Dict[str, Any]] = None) -> Job:
+        """
+        Queue a job, or return the unfinished job already queued for the same
+        analysis, kind and options.
+
+        Raises:
+            JobQueueFull: if max_queued jobs are already waiting
+        """
+        if self._queue is None:
+            raise RuntimeError("JobManager não foi iniciado")
+        self._purge_expired()
+
+        options = dict(options or {})
+        for job in self._jobs.values():
+            if (job.kind == kind and job.analysis_id == analysis_id and job.options == options
+                    and not job.is_finished):
+                return job
+
+        job = Job(kind, analysis_id, handler, options)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull("Fila de jobs cheia, tente novamente em instantes")
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def get_stats(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "max_queued": self.max_queued,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "by_status": counts
+        }
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job._finished_monotonic is not None and now - job._finished_monotonic > self.retention_seconds
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _finish(job: Job, status: str, message: str):
+        job.finished_at = datetime.utcnow()
+        job._finished_monotonic = time.monotonic()
+        job.publish(status, message)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job.started_at = datetime.utcnow()
+            try:
+                job.result = await job.handler(job)
+                self._finish(job, "completed", "Análise concluída")
+            except asyncio.CancelledError:
+                job.error = "Job cancelado"
+                self._finish(job, "error", job.error)
+                raise
+            except Exception as e:
+                # HTTPException carrega a mensagem em 'detail'
+                job.error = str(getattr(e, "detail", None) or e)
+                self._finish(job, "error", job.error)
+            finally:
+                self._queue.task_done()
+
+
+job_manager = JobManager()
@@ -0,0 +1,205 @@
+"""
+Registry of trained-model versions with background loading and hot swap
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from services.cache_service import file_checksum
+from services.model_service import DEFAULT_MODEL_PATH, MODEL_BACKEND, TFLITE_MODEL_PATH, ModelService
+
+load_dotenv()
+
+# Diretório com versões adicionais do modelo: <versão>.keras ou <versão>.tflite
+MODELS_DIR = os.getenv("MODELS_DIR", str(Path(__file__).parent.parent / "models"))
+# Versão ativa ao iniciar; "default" é o modelo em best_cbis_ddsm_model.keras
+# (ou TFLITE_MODEL_PATH com MODEL_BACKEND=tflite)
+ACTIVE_MODEL_VERSION = os.getenv("ACTIVE_MODEL_VERSION", "default")
+
+DEFAULT_VERSION = "default"
+MODEL_EXTENSIONS = {".keras": "keras", ".tflite": "tflite"}
+
+
+class ModelRegistry:
+    """
+    Holds the ModelService of the active version and swaps it atomically.
+
+    A new version is loaded and warmed up in a background thread while the
+    current one keeps serving; only then does the active reference change.
+    Requests take a lease on the service they started with, so an analysis
+    never mixes two versions, and a replaced service is unloaded once its
+    last lease is released.
+    """
+
+    def __init__(self, models_dir: str = MODELS_DIR, initial_version: str = ACTIVE_MODEL_VERSION):
+        self.models_dir = models_dir
+        self.initial_version = initial_version
+        self._lock = threading.Condition()
+        self._active: Optional[ModelService] = None
+        self._leases: Dict[int, int] = {}
+        # versão -> {"status": "loading" | "failed", "error": ..., "started_at": ...}
+        self._loading: Dict[str, Dict[str, Any]] = {}
+        self.swap_count = 0
+
+    def discover(self) -> Dict[str, Dict[str, str]]:
+        """Available versions: the default model plus every model file in models_dir"""
+        default_path = TFLITE_MODEL_PATH if MODEL_BACKEND == "tflite" else DEFAULT_MODEL_PATH
+        versions = {DEFAULT_VERSION: {"path": default_path, "backend": MODEL_BACKEND}}
+        if os.path.isdir(self.models_dir):
+            for name in sorted(os.listdir(self.models_dir)):
+                stem, ext = os.path.splitext(name)
+                backend = MODEL_EXTENSIONS.get(ext.lower())
+                if backend is None or stem == DEFAULT_VERSION:
+                    continue
+                # Com .keras e .tflite da mesma versão, prefere o backend configurado
+                if stem in versions and versions[stem]["backend"] == MODEL_BACKEND:
+                    continue
+                versions[stem] = {"path": os.path.join(self.models_dir, name), "backend": backend}
+        return versions
+
+    def _create_service(self, version: str) -> ModelService:
+        versions = self.discover()
+        if version not in versions:
+            raise KeyError(version)
+        entry = versions[version]
+        return ModelService(entry["path"], backend=entry["backend"], version=version, purge_stale_results=False)
+
+    def active(self) -> ModelService:
+        """The service currently receiving traffic (created on first use)"""
+        with self._lock:
+            if self._active is None:
+                version = self.initial_version
+                if version not in self.discover():
+                    print(f"⚠️ Versão do modelo '{version}' não encontrada, usando '{DEFAULT_VERSION}'")
+                    version = DEFAULT_VERSION
+                self._active = self._create_service(version)
+            return self._active
+
+    @property
+    def active_version(self) -> str:
+        return self.active().version
+
+    @contextmanager
+    def lease(self):
+        """Pin the active service for the duration of one analysis"""
+        with self._lock:
+            service = self.active()
+            self._leases[id(service)] = self._leases.get(id(service), 0) + 1
+        try:
+            yield service
+        finally:
+            with self._lock:
+                self._leases[id(service)] -= 1
+                if self._leases[id(service)] == 0:
+                    del self._leases[id(service)]
+                    self._lock.notify_all()
+
+    def activate(self, version: str) -> Dict[str, Any]:
+        """
+        Start loading ``version`` in the background and switch to it when warm
+
+        Raises:
+            KeyError: if the version does not exist
+        """
+        if version not in self.discover():
+            raise KeyError(version)
+        with self._lock:
+            if self.active().version == version:
+                return {"version": version, "status": "active"}
+            if self._loading.get(version, {}).get("status") != "loading":
+                self._loading[version] = {"status": "loading", "started_at": time.time()}
+                threading.Thread(
+                    target=self._load_and_swap, args=(version,), name=f"model-load-{version}", daemon=True
+                ).start()
+            return {"version": version, **self._loading[version]}
+
+    def _load_and_swap(self, version: str):
+        start = time.perf_counter()
+        try:
+            print(f"🔄 Carregando versão '{version}' do modelo em segundo plano...")
+            service = self._create_service(version)
+            if not service.is_available():
+                raise RuntimeError(f"Arquivo do modelo não encontrado: {service.model_path}")
+            # O aquecimento carrega o modelo e compila o grafo antes de receber tráfego
+            if not service.warmup():
+                raise RuntimeError("Aquecimento do modelo falhou")
+            service.model_checksum()
+        except Exception as e:
+            print(f"❌ Falha ao carregar a versão '{version}': {e}")
+            with self._lock:
+                self._loading[version] = {"status": "failed", "error": str(e)}
+            return
+
+        with self._lock:
+            previous = self._active
+            self._active = service
+            self.swap_count += 1
+            self._loading.pop(version, None)
+        print(f"✅ Versão '{version}' ativa ({time.perf_counter() - start:.1f}s para carregar e aquecer)")
+
+        if previous is not None:
+            self._retire(previous)
+        self.purge_stale_results()
+
+    def _retire(self, service: ModelService):
+        """Unload a replaced service after the analyses that leased it finish"""
+        with self._lock:
+            while self._leases.get(id(service), 0) > 0:
+                self._lock.wait()
+        service.shutdown()
+        print(f"🧹 Versão '{service.version}' do modelo descarregada")
+
+    def purge_stale_results(self):
+        """Drop cached results of model files that no longer belong to any version"""
+        service = self.active()
+        if service.result_cache is None:
+            return
+        keep = {file_checksum(entry["path"]) for entry in self.discover().values()
+                if os.path.exists(entry["path"])}
+        removed = service.result_cache.purge_stale(keep)
+        if removed:
+            print(f"♻️ Cache de resultados de {removed} modelo(s) removido(s)")
+
+    def list_versions(self) -> List[Dict[str, Any]]:
+        active = self.active()
+        with self._lock:
+            loading = dict(self._loading)
+        versions = []
+        for version, entry in self.discover().items():
+            item = {"version": version, "backend": entry["backend"], "path": entry["path"]}
+            if version == active.version:
+                item.update(status="active", loaded=active.is_loaded())
+            elif version in loading:
+                item.update(loading[version])
+            else:
+                item["status"] = "available"
+            versions.append(item)
+        return versions
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"active_version": self.active_version, "swap_count": self.swap_count,
+                "versions": self.list_versions()}
+
+    def shutdown(self):
+        with self._lock:
+            service, self._active = self._active, None
+        if service is not None:
+            service.shutdown()
+
+
+# Global instance
+_model_registry_instance = None
+
+
+def get_model_registry() -> ModelRegistry:
+    """Get or create the global model registry"""
+    global _model_registry_instance
+    if _model_registry_instance is None:
+        _model_registry_instance = ModelRegistry()
+    return _model_registry_instance
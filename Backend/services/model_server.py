@@ -0,0 +1,278 @@
+"""
+Out-of-process model server for multi-worker deployments
+
+One process (model_server.py) owns the TensorFlow runtime and the model;
+API workers send preprocessed tensors to it over a Unix socket. The input
+batch is written to a shared-memory segment owned by the client and read
+in place by the server, so only a small JSON header crosses the socket.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Socket Unix do servidor de modelo; vazio = inferência no próprio processo
+MODEL_SERVER_SOCKET = os.getenv("MODEL_SERVER_SOCKET", "")
+# Tempo máximo de espera por uma resposta do servidor (segundos)
+MODEL_SERVER_TIMEOUT = float(os.getenv("MODEL_SERVER_TIMEOUT", "120"))
+
+# Camada do Grad-CAM usada pelo micro-batching de ModelService
+DEFAULT_GRADCAM_LAYER = "top_activation"
+
+# Cabeçalho de cada mensagem: tamanho do JSON e tamanho do payload binário
+_FRAME = struct.Struct("!II")
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytearray:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise ConnectionError("Conexão com o servidor de modelo encerrada")
+        received += n
+    return buffer
+
+
+def send_message(sock: socket.socket, header: Dict[str, Any], payload: bytes = b""):
+    data = json.dumps(header).encode("utf-8")
+    sock.sendall(_FRAME.pack(len(data), len(payload)) + data + payload)
+
+
+def recv_message(sock: socket.socket) -> Tuple[Dict[str, Any], bytearray]:
+    header_size, payload_size = _FRAME.unpack(_recv_exact(sock, _FRAME.size))
+    header = json.loads(_recv_exact(sock, header_size).decode("utf-8"))
+    payload = _recv_exact(sock, payload_size) if payload_size else bytearray()
+    return header, payload
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Open a segment created by another process without taking ownership of it"""
+    segment = shared_memory.SharedMemory(name=name)
+    # Antes do Python 3.13 o resource_tracker também registra segmentos abertos
+    # (não criados) e os removeria ao encerrar o servidor
+    resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+class ModelServerClient:
+    """
+    Inference proxy used by ModelService in API workers.
+
+    Each thread keeps its own connection and shared-memory segment, so
+    concurrent callers never wait on each other inside the client; the
+    server batches requests from all workers together.
+    """
+
+    def __init__(self, socket_path: str, model_path: str, backend: str, timeout: float = None):
+        self.socket_path = socket_path
+        self.model_path = model_path
+        self.backend = backend
+        self.timeout = MODEL_SERVER_TIMEOUT if timeout is None else timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._channels = []
+        self._closed = False
+        # Falha aqui (servidor fora do ar) equivale a uma falha ao carregar o modelo
+        self.info = self._request({"op": "load"})[0]
+
+    def _channel(self) -> Dict[str, Any]:
+        channel = getattr(self._local, "channel", None)
+        if channel is None:
+            if self._closed:
+                raise RuntimeError("Cliente do servidor de modelo encerrado")
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            channel = {"socket": sock, "segment": None}
+            self._local.channel = channel
+            with self._lock:
+                self._channels.append(channel)
+        return channel
+
+    def _input_segment(self, channel: Dict[str, Any], size: int) -> shared_memory.SharedMemory:
+        segment = channel["segment"]
+        if segment is None or segment.size < size:
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+            segment = shared_memory.SharedMemory(create=True, size=size)
+            channel["segment"] = segment
+        return segment
+
+    def _request(self, header: Dict[str, Any], batch: np.ndarray = None) -> Tuple[Dict[str, Any], bytearray]:
+        channel = self._channel()
+        header = dict(header, model_path=self.model_path, backend=self.backend)
+        if batch is not None:
+            batch = np.ascontiguousarray(batch, dtype=np.float32)
+            segment = self._input_segment(channel, batch.nbytes)
+            np.ndarray(batch.shape, dtype=np.float32, buffer=segment.buf)[...] = batch
+            header.update(segment=segment.name, shape=list(batch.shape))
+        try:
+            send_message(channel["socket"], header)
+            response, payload = recv_message(channel["socket"])
+        except OSError:
+            # Conexão quebrada (servidor reiniciado): a próxima chamada reconecta
+            self._drop_channel(channel)
+            raise
+        if "error" in response:
+            raise RuntimeError(f"Servidor de modelo: {response['error']}")
+        return response, payload
+
+    def predict_proba(self, batch: np.ndarray) -> np.ndarray:
+        response, payload = self._request({"op": "predict_proba"}, batch)
+        return np.frombuffer(payload, dtype=np.float32, count=response["count"]).copy()
+
+    def predict_with_heatmap(self, batch: np.ndarray,
+                             last_conv_layer_name: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        response, payload = self._request(
+            {"op": "predict_with_heatmap", "layer": last_conv_layer_name}, batch
+        )
+        count = response["count"]
+        probabilities = np.frombuffer(payload, dtype=np.float32, count=count).copy()
+        if response.get("heatmap_shape") is None:
+            return probabilities, None
+        heatmaps = np.frombuffer(payload, dtype=np.float32, offset=count * 4).reshape(response["heatmap_shape"])
+        return probabilities, heatmaps.copy()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._request({"op": "stats"})[0]["stats"]
+
+    def _drop_channel(self, channel: Dict[str, Any]):
+        channel["socket"].close()
+        if channel["segment"] is not None:
+            channel["segment"].close()
+            channel["segment"].unlink()
+            channel["segment"] = None
+        with self._lock:
+            if channel in self._channels:
+                self._channels.remove(channel)
+        if getattr(self._local, "channel", None) is channel:
+            self._local.channel = None
+
+    def close(self):
+        """Close every connection and free the shared-memory segments"""
+        self._closed = True
+        with self._lock:
+            channels = list(self._channels)
+        for channel in channels:
+            self._drop_channel(channel)
+
+
+class _ModelRequestHandler(socketserver.BaseRequestHandler):
+    """One API-worker thread: a loop of requests over a single connection"""
+
+    def handle(self):
+        segment = None
+        try:
+            while True:
+                try:
+                    header, _ = recv_message(self.request)
+                except (ConnectionError, OSError):
+                    break
+                if header.get("segment") and (segment is None or segment.name != header["segment"].lstrip("/")):
+                    if segment is not None:
+                        segment.close()
+                    segment = attach_shared_memory(header["segment"])
+                try:
+                    response, payload = self.server.model_server.handle_request(header, segment)
+                except Exception as e:
+                    response, payload = {"error": str(e)}, b""
+                send_message(self.request, response, payload)
+        finally:
+            if segment is not None:
+                segment.close()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ModelServer:
+    """
+    Serves one ModelService per model file, created on first request.
+
+    Single-image requests from all workers go through each service's
+    InferenceBatcher, so concurrent workers share forward passes.
+    """
+
+    def __init__(self, socket_path: str = None):
+        self.socket_path = socket_path or MODEL_SERVER_SOCKET
+        if not self.socket_path:
+            raise ValueError("MODEL_SERVER_SOCKET não definido")
+        self._services: Dict[Tuple[str, str], Any] = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def service_for(self, model_path: str, backend: str):
+        from services.model_service import ModelService
+
+        key = (model_path, backend)
+        with self._lock:
+            if key not in self._services:
+                self._services[key] = ModelService(
+                    model_path, backend=backend, purge_stale_results=False, server_socket=""
+                )
+            return self._services[key]
+
+    def handle_request(self, header: Dict[str, Any], segment: Optional[shared_memory.SharedMemory]):
+        service = self.service_for(header["model_path"], header["backend"])
+        op = header["op"]
+        if op == "load":
+            if not service.is_available():
+                raise FileNotFoundError(f"Arquivo do modelo não encontrado: {service.model_path}")
+            return {"pid": os.getpid(), "status": service.get_status()}, b""
+        if op == "stats":
+            return {"stats": {"pid": os.getpid(), "models": [s.get_stats() for s in self._services.values()]}}, b""
+
+        # Visão direta do segmento do cliente, sem cópia
+        batch = np.ndarray(tuple(header["shape"]), dtype=np.float32, buffer=segment.buf)
+        if op == "predict_proba":
+            probabilities = np.asarray(service.predict_proba_batch(batch), dtype=np.float32)
+            return {"count": len(probabilities)}, probabilities.tobytes()
+        if op == "predict_with_heatmap":
+            if len(batch) == 1 and header["layer"] == DEFAULT_GRADCAM_LAYER:
+                # Passa pelo micro-batching: imagens de vários workers no mesmo forward pass
+                results = [service._predict_with_heatmap(batch)]
+            else:
+                results = service.predict_with_heatmap_batch(batch, header["layer"])
+            probabilities = np.asarray([p for p, _ in results], dtype=np.float32)
+            if any(h is None for _, h in results):
+                return {"count": len(results), "heatmap_shape": None}, probabilities.tobytes()
+            heatmaps = np.stack([h for _, h in results]).astype(np.float32)
+            return ({"count": len(results), "heatmap_shape": list(heatmaps.shape)},
+                    probabilities.tobytes() + heatmaps.tobytes())
+        raise ValueError(f"Operação desconhecida: {op}")
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = _UnixServer(self.socket_path, _ModelRequestHandler)
+        self._server.model_server = self
+        print(f"🛰️ Servidor de modelo ouvindo em {self.socket_path} (PID {os.getpid()})")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            with self._lock:
+                services = list(self._services.values())
+            for service in services:
+                service.shutdown()
+
+    def shutdown(self):
+        """Stop serve_forever (call from another thread)"""
+        if self._server is not None:
+            self._server.shutdown()
@@ -3,155 +3,613 @@ Service for trained breast cancer detection model predictions
 """
 
 import os
+from services import execution_profile
 import numpy as np
 import cv2
-from tensorflow import keras
-import tensorflow as tf
 from pathlib import Path
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 import json
 import gc
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-
-# Configurar TensorFlow para uso eficiente de memória
-os.environ['TF_FORCE_GPU_ALLOW_GROWTH'] = 'true'
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'  # Reduzir logs
-
-# Configurar GPU para crescimento dinâmico de memória
-gpus = tf.config.list_physical_devices('GPU')
-if gpus:
+import threading
+import time
+from contextlib import contextmanager, ExitStack
+from dotenv import load_dotenv
+from services.inference_batcher import InferenceBatcher
+from services import preprocessing, visualization
+from services.model_server import MODEL_SERVER_SOCKET, ModelServerClient
+from services.cache_service import (
+    ResultCache, TensorCache, RESULT_CACHE_ENABLED, TENSOR_CACHE_ENABLED, file_checksum
+)
+
+# Com MODEL_SERVER_SOCKET, os workers da API delegam a inferência ao processo
+# de model_server.py e não importam o TensorFlow (centenas de MB de RSS por worker).
+# O próprio servidor define MODEL_SERVER_ROLE=server antes de importar este módulo.
+USE_MODEL_SERVER = bool(MODEL_SERVER_SOCKET) and os.getenv("MODEL_SERVER_ROLE") != "server"
+
+if USE_MODEL_SERVER:
+    tf = keras = TFLiteModel = None
+else:
+    from tensorflow import keras
+    import tensorflow as tf
+    from services.tflite_backend import TFLiteModel
+
+    # Configurar TensorFlow para uso eficiente de memória
+    os.environ['TF_FORCE_GPU_ALLOW_GROWTH'] = 'true'
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'  # Reduzir logs
+
+    # Configurar GPU para crescimento dinâmico de memória
+    gpus = tf.config.list_physical_devices('GPU')
+    if gpus:
+        try:
+            for gpu in gpus:
+                tf.config.experimental.set_memory_growth(gpu, True)
+            print(f"✅ GPU configurada para crescimento dinâmico de memória: {len(gpus)} GPU(s)")
+        except RuntimeError as e:
+            print(f"⚠️ Erro ao configurar GPU: {e}")
+
+    # Threads do TensorFlow conforme o perfil de execução (EXECUTION_PROFILE);
+    # só podem ser definidos antes da primeira operação
+    TF_INTRA_OP_THREADS = execution_profile.setting("TF_INTRA_OP_THREADS")
+    TF_INTER_OP_THREADS = execution_profile.setting("TF_INTER_OP_THREADS")
+    tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+    tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+
+load_dotenv()
+
+# Política de residência do modelo:
+#   "resident"  - mantém o modelo carregado entre predições (padrão)
+#   "on_demand" - carrega e descarrega o modelo a cada predição
+MODEL_RESIDENCY = os.getenv("MODEL_RESIDENCY", "resident").lower()
+# Descarrega o modelo após N segundos sem uso (0 = nunca)
+MODEL_IDLE_TIMEOUT = float(os.getenv("MODEL_IDLE_TIMEOUT", "900"))
+# Descarrega o modelo se o RSS do processo ultrapassar este limite em MB (0 = sem limite)
+MODEL_MEMORY_LIMIT_MB = float(os.getenv("MODEL_MEMORY_LIMIT_MB", "0"))
+# Executa uma inferência de aquecimento ao iniciar a aplicação
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() in ("1", "true", "yes")
+
+# Micro-batching: agrupa requisições concorrentes em um único forward pass
+MODEL_BATCHING = os.getenv("MODEL_BATCHING", "true").lower() in ("1", "true", "yes")
+MODEL_BATCH_MAX_SIZE = execution_profile.setting("MODEL_BATCH_MAX_SIZE")
+MODEL_BATCH_MAX_WAIT_MS = float(os.getenv("MODEL_BATCH_MAX_WAIT_MS", "10"))
+# Compila as funções de inferência com XLA (recompila a cada novo tamanho de lote)
+MODEL_JIT_COMPILE = os.getenv("MODEL_JIT_COMPILE", "false").lower() in ("1", "true", "yes")
+
+# Test-time augmentation (média da imagem original com variantes espelhada e em escala):
+#   "off"    - desligado (pode ser pedido por requisição)
+#   "auto"   - só quando a primeira probabilidade cai na faixa de incerteza
+#   "always" - em toda predição
+TTA_MODE = os.getenv("TTA_MODE", "off").lower()
+TTA_BAND_LOW = float(os.getenv("TTA_BAND_LOW", "0.4"))
+TTA_BAND_HIGH = float(os.getenv("TTA_BAND_HIGH", "0.6"))
+TTA_FLIP = os.getenv("TTA_FLIP", "true").lower() in ("1", "true", "yes")
+TTA_SCALES = tuple(float(v) for v in os.getenv("TTA_SCALES", "0.9,1.1").split(",") if v.strip())
+
+TTA_MODES = ("off", "auto", "always")
+
+RESIDENCY_POLICIES = ("resident", "on_demand")
+
+# Backend de inferência: "keras" (modelo .keras em precisão total) ou "tflite"
+# (artefato gerado offline por convert_model.py, opcionalmente quantizado)
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "keras").lower()
+DEFAULT_MODEL_PATH = str(Path(__file__).parent.parent / "best_cbis_ddsm_model.keras")
+TFLITE_MODEL_PATH = os.getenv("TFLITE_MODEL_PATH", str(Path(__file__).parent.parent / "best_cbis_ddsm_model.tflite"))
+
+MODEL_BACKENDS = ("keras", "tflite")
+
+
+# Modelos carregados neste processo (Keras ou TFLite). clear_session() zera o estado
+# global do Keras, então só é chamado quando o último deles é descarregado: o registro
+# de versões e o servidor de modelo mantêm vários ModelService no mesmo processo
+_in_process_models = 0
+_in_process_models_lock = threading.Lock()
+
+
+def get_process_rss_mb() -> float:
+    """Return the current resident set size of this process in MB (0 if unknown)"""
     try:
-        for gpu in gpus:
-            tf.config.experimental.set_memory_growth(gpu, True)
-        print(f"✅ GPU configurada para crescimento dinâmico de memória: {len(gpus)} GPU(s)")
-    except RuntimeError as e:
-        print(f"⚠️ Erro ao configurar GPU: {e}")
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def _track_in_process_model(delta: int) -> int:
+    """Update the count of models loaded in this process and return it"""
+    global _in_process_models
+    with _in_process_models_lock:
+        _in_process_models = max(0, _in_process_models + delta)
+        return _in_process_models
 
-# Limitar uso de threads para reduzir overhead de CPU
-tf.config.threading.set_intra_op_parallelism_threads(2)
-tf.config.threading.set_inter_op_parallelism_threads(2)
 
 class ModelService:
-    def __init__(self, model_path: str = None):
+    def __init__(self, model_path: str = None, residency: str = None,
+                 idle_timeout: float = None, memory_limit_mb: float = None,
+                 batching: bool = None, backend: str = None, version: str = None,
+                 purge_stale_results: bool = True, jit_compile: bool = None,
+                 server_socket: str = None):
         """
         Initialize the model service with lazy loading
         
         Args:
             model_path: Path to the trained model file. If None, uses default path.
+            residency: Residency policy ("resident" or "on_demand"). If None, uses MODEL_RESIDENCY.
+            idle_timeout: Seconds without use before a resident model is unloaded (0 = never).
+            memory_limit_mb: Process RSS ceiling in MB; above it the model is unloaded after use (0 = no limit).
+            batching: Whether concurrent predictions share batched forward passes. If None, uses MODEL_BATCHING.
+            backend: "keras" or "tflite". If None, uses MODEL_BACKEND; model_path then defaults to TFLITE_MODEL_PATH.
+            version: Name recorded with each analysis (see services/model_registry.py).
+            purge_stale_results: Drop cached results of other model files when the checksum changes.
+                The registry disables it because several versions can be valid at once.
+            jit_compile: Compile the Keras inference functions with XLA. If None, uses MODEL_JIT_COMPILE.
+            server_socket: Unix socket of a model server that runs inference for this service
+                ("" = in process). If None, uses MODEL_SERVER_SOCKET unless this is the server itself.
         """
         self.model = None
-        self.model_path = model_path or os.path.join(
-            Path(__file__).parent.parent, 
-            "best_cbis_ddsm_model.keras"
-        )
+        self.version = version or "default"
+        self.purge_stale_results = purge_stale_results
+        self.backend = (backend or MODEL_BACKEND).lower()
+        if self.backend not in MODEL_BACKENDS:
+            print(f"⚠️ Backend de inferência desconhecido '{self.backend}', usando 'keras'")
+            self.backend = "keras"
+        if self.backend == "tflite":
+            self.model_path = model_path or TFLITE_MODEL_PATH
+        else:
+            self.model_path = model_path or DEFAULT_MODEL_PATH
+        self.jit_compile = MODEL_JIT_COMPILE if jit_compile is None else jit_compile
+        if server_socket is None:
+            server_socket = MODEL_SERVER_SOCKET if USE_MODEL_SERVER else ""
+        self.server_socket = server_socket
+        self.residency = (residency or MODEL_RESIDENCY).lower()
+        if self.residency not in RESIDENCY_POLICIES:
+            print(f"⚠️ Política de residência desconhecida '{self.residency}', usando 'resident'")
+            self.residency = "resident"
+        self.idle_timeout = MODEL_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.memory_limit_mb = MODEL_MEMORY_LIMIT_MB if memory_limit_mb is None else memory_limit_mb
+        
+        # Carga e descarga do modelo são serializadas por este lock; predições em
+        # andamento são contadas para que o modelo não seja descarregado durante o uso
+        self._lock = threading.RLock()
+        self._active_requests = 0
+        # A construção dos sub-modelos do Grad-CAM e das funções compiladas não é thread-safe no Keras
+        self._gradcam_lock = threading.Lock()
+        # Funções Grad-CAM compiladas por camada, válidas enquanto o modelo estiver carregado
+        self._gradcam_cache: Dict[str, Any] = {}
+        # Forward pass compilado (sem a maquinaria de model.predict), idem
+        self._predict_fn = None
+        self._last_used = 0.0
+        self._idle_monitor = None
+        self._stop_event = threading.Event()
+        self.load_count = 0
+        
+        # Tensores pré-processados em disco, indexados pelo hash da imagem
+        self.tensor_cache = TensorCache() if TENSOR_CACHE_ENABLED else None
+        # Resultados por (hash da imagem, checksum do arquivo do modelo, limiar)
+        self.result_cache = ResultCache() if RESULT_CACHE_ENABLED else None
+        self._checksum_lock = threading.Lock()
+        self._checksum_signature = None
+        self._model_checksum: Optional[str] = None
+        
+        self.tta_mode = TTA_MODE if TTA_MODE in TTA_MODES else "off"
+        self._tta_lock = threading.Lock()
+        self._tta_runs = 0
+        self._tta_auto_runs = 0
+        self._tta_total_ms = 0.0
+        
+        use_batching = MODEL_BATCHING if batching is None else batching
+        self.batcher = InferenceBatcher(
+            self.predict_with_heatmap_batch,
+            max_batch_size=MODEL_BATCH_MAX_SIZE,
+            max_wait_ms=MODEL_BATCH_MAX_WAIT_MS,
+            name="model-batcher"
+        ) if use_batching else None
+        
         # NÃO carregar o modelo no __init__ - usar lazy loading
-        print(f"📋 ModelService inicializado. Modelo será carregado sob demanda.")
+        print(f"📋 ModelService inicializado (backend: {self.backend}, residência: {self.residency}). "
+              f"Modelo será carregado sob demanda.")
     
     def _load_model(self):
         """Load the trained model (lazy loading)"""
-        if self.model is not None:
-            return  # Já está carregado
-            
-        try:
-            if os.path.exists(self.model_path):
-                print(f"🤖 Carregando modelo treinado de {self.model_path}...")
-                self.model = keras.models.load_model(self.model_path, compile=False)
-                print("✅ Modelo carregado com sucesso!")
-            else:
-                print(f"⚠️ Arquivo do modelo não encontrado em {self.model_path}")
+        with self._lock:
+            if self.model is not None:
+                return  # Já está carregado
+                
+            try:
+                if os.path.exists(self.model_path):
+                    print(f"🤖 Carregando modelo treinado de {self.model_path}...")
+                    start = time.perf_counter()
+                    if self.server_socket:
+                        # O modelo fica no servidor; aqui só a conexão
+                        self.model = ModelServerClient(self.server_socket, self.model_path, self.backend)
+                    elif self.backend == "tflite":
+                        self.model = TFLiteModel(self.model_path)
+                    else:
+                        self.model = keras.models.load_model(self.model_path, compile=False)
+                    if not self.server_socket:
+                        _track_in_process_model(+1)
+                    self.load_count += 1
+                    self._last_used = time.monotonic()
+                    print(f"✅ Modelo carregado com sucesso! ({time.perf_counter() - start:.1f}s)")
+                    if self.residency == "resident":
+                        self._start_idle_monitor()
+                else:
+                    print(f"⚠️ Arquivo do modelo não encontrado em {self.model_path}")
+                    self.model = None
+            except Exception as e:
+                print(f"❌ Erro ao carregar modelo: {str(e)}")
                 self.model = None
-        except Exception as e:
-            print(f"❌ Erro ao carregar modelo: {str(e)}")
-            self.model = None
     
     def _unload_model(self):
         """Unload the model and free memory"""
-        if self.model is not None:
-            print("🧹 Liberando memória do modelo...")
-            del self.model
-            self.model = None
-            
-            # Limpar cache do TensorFlow/Keras
-            keras.backend.clear_session()
+        with self._lock:
+            if self.model is not None:
+                print("🧹 Liberando memória do modelo...")
+                self._gradcam_cache.clear()
+                self._predict_fn = None
+                if self.server_socket:
+                    self.model.close()
+                del self.model
+                self.model = None
+                
+                # Limpar cache do TensorFlow/Keras, a menos que outro modelo (ex.: a nova
+                # versão no registro) ainda esteja servindo neste processo
+                if not self.server_socket and _track_in_process_model(-1) == 0 and keras is not None:
+                    keras.backend.clear_session()
+                
+                # Forçar garbage collection
+                gc.collect()
+                
+                print("✅ Memória liberada")
+    
+    def _release_after_use(self):
+        """Apply the residency policy after a prediction"""
+        with self._lock:
+            self._last_used = time.monotonic()
+            if self._active_requests > 0:
+                return  # Outras predições ainda estão usando o modelo
+            if self.residency == "on_demand":
+                self._unload_model()
+            elif self.memory_limit_mb > 0:
+                rss_mb = get_process_rss_mb()
+                if rss_mb > self.memory_limit_mb:
+                    print(f"⚠️ RSS de {rss_mb:.0f}MB acima do limite de {self.memory_limit_mb:.0f}MB")
+                    self._unload_model()
+    
+    @contextmanager
+    def _use_model(self):
+        """Load the model if needed and keep it resident while the block runs"""
+        with self._lock:
+            self._load_model()
+            if self.model is None:
+                raise RuntimeError("Falha ao carregar o modelo")
+            self._active_requests += 1
+        try:
+            yield self.model
+        finally:
+            with self._lock:
+                self._active_requests -= 1
+                self._release_after_use()
+    
+    def _start_idle_monitor(self):
+        """Start the background thread that evicts the model after idle_timeout"""
+        if self.idle_timeout <= 0 or self._idle_monitor is not None:
+            return
+        self._idle_monitor = threading.Thread(
+            target=self._idle_monitor_loop, name="model-idle-monitor", daemon=True
+        )
+        self._idle_monitor.start()
+    
+    def _idle_monitor_loop(self):
+        interval = max(1.0, min(self.idle_timeout / 4, 30.0))
+        while not self._stop_event.wait(interval):
+            with self._lock:
+                idle_for = time.monotonic() - self._last_used
+                if self.model is not None and self._active_requests == 0 and idle_for >= self.idle_timeout:
+                    print(f"⏱️ Modelo ocioso há {idle_for:.0f}s, descarregando...")
+                    self._unload_model()
+    
+    def shutdown(self):
+        """Stop background monitoring and unload the model"""
+        self._stop_event.set()
+        if self.batcher is not None:
+            self.batcher.close()
+        self._unload_model()
+    
+    def is_loaded(self) -> bool:
+        """Check if the model is currently resident in memory"""
+        return self.model is not None
+    
+    def warmup(self, img_size=(224, 224)) -> bool:
+        """
+        Load the model and run one inference on a blank image so the first
+        real request does not pay for graph construction.
+        
+        Returns:
+            True if the warm-up inference ran (the model stays loaded only when resident)
+        """
+        if not self.is_available():
+            return False
+        try:
+            with self._use_model():
+                start = time.perf_counter()
+                dummy = np.zeros((1, img_size[0], img_size[1], 3), dtype=np.float32)
+                self.predict_with_heatmap_batch(dummy)
+                variants = preprocessing.tta_variants(dummy, flip=TTA_FLIP, scales=TTA_SCALES)
+                if self.tta_mode == "always":
+                    # Compilar também o lote original + variantes do TTA
+                    self.predict_with_heatmap_batch(np.concatenate([dummy, variants]))
+                elif self.tta_mode == "auto":
+                    # Compilar também o forward pass do lote de variantes do TTA
+                    self.predict_proba_batch(variants)
+                print(f"🔥 Aquecimento do modelo concluído em {time.perf_counter() - start:.1f}s")
+        except RuntimeError as e:
+            print(f"⚠️ Aquecimento do modelo falhou: {e}")
+            return False
+        return True
+    
+    def get_status(self) -> Dict[str, Any]:
+        """Residency information for health checks"""
+        return {
+            "version": self.version,
+            "available": self.is_available(),
+            "loaded": self.is_loaded(),
+            "backend": self.backend,
+            "jit_compile": self.jit_compile if self.backend == "keras" else False,
+            "model_server": self.server_socket or None,
+            "residency": self.residency,
+            "idle_timeout_s": self.idle_timeout,
+            "memory_limit_mb": self.memory_limit_mb,
+            "load_count": self.load_count,
+            "process_rss_mb": round(get_process_rss_mb(), 1),
+            "execution": execution_profile.describe()
+        }
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Residency status plus micro-batching and cache statistics"""
+        stats = self.get_status()
+        stats["batching"] = self.batcher.get_stats() if self.batcher is not None else None
+        stats["tta"] = self.get_tta_stats()
+        stats["tensor_cache"] = self.tensor_cache.get_stats() if self.tensor_cache is not None else None
+        stats["result_cache"] = self.result_cache.get_stats() if self.result_cache is not None else None
+        if stats["result_cache"] is not None:
+            stats["result_cache"]["model_checksum"] = self._model_checksum
+        model = self.model
+        if self.server_socket and model is not None:
+            # Micro-batching e memória do processo que de fato executa o modelo
+            try:
+                stats["model_server_stats"] = model.stats()
+            except (OSError, RuntimeError) as e:
+                stats["model_server_stats"] = {"error": str(e)}
+        return stats
+    
+    def predict_proba_batch(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Run one forward pass over a stacked batch of preprocessed images
+        
+        Args:
+            batch: Array shaped (N, H, W, 3) with values in [0, 1]
             
-            # Forçar garbage collection
-            gc.collect()
+        Returns:
+            Array of N malignancy probabilities
+        """
+        with self._use_model() as model:
+            if self.server_socket:
+                return model.predict_proba(batch)
+            if self.backend == "tflite":
+                return model.predict(batch)[0]
+            predict_fn = self._get_predict_fn()
+            return predict_fn(tf.convert_to_tensor(batch, dtype=tf.float32)).numpy()
+    
+    def predict_with_heatmap_batch(self, batch: np.ndarray,
+                                   last_conv_layer_name: str = 'top_activation') -> List[Tuple[float, Optional[np.ndarray]]]:
+        """
+        Single fused forward/backward pass returning, for each image, the
+        malignancy probability and its Grad-CAM heatmap
+        
+        Args:
+            batch: Array shaped (N, H, W, 3) with values in [0, 1]
+            last_conv_layer_name: Layer used for Grad-CAM
             
-            print("✅ Memória liberada")
+        Returns:
+            List of N (probability, heatmap) tuples; heatmap is None if Grad-CAM is unavailable
+        """
+        with self._use_model() as model:
+            if self.server_socket:
+                probabilities, heatmaps = model.predict_with_heatmap(batch, last_conv_layer_name)
+                if heatmaps is None:
+                    return [(float(p), None) for p in probabilities]
+                return list(zip(probabilities.astype(float), heatmaps))
+            if self.backend == "tflite":
+                # Grad-CAM convertido junto com o modelo (camada fixada na conversão)
+                probabilities, heatmaps = model.predict(batch)
+                return list(zip(probabilities.astype(float), heatmaps))
+            try:
+                gradcam = self._get_gradcam_fn(last_conv_layer_name)
+                if gradcam is not None:
+                    probabilities, heatmaps = gradcam(tf.convert_to_tensor(batch, dtype=tf.float32))
+                    return list(zip(probabilities.numpy().astype(float), heatmaps.numpy()))
+            except Exception as e:
+                print(f"Warning: Could not generate Grad-CAM heatmap: {e}")
+            # Sem Grad-CAM: apenas a probabilidade
+            return [(float(p), None) for p in self.predict_proba_batch(batch)]
+    
+    def _predict_with_heatmap(self, img: np.ndarray) -> Tuple[float, Optional[np.ndarray]]:
+        """Probability and Grad-CAM heatmap for one preprocessed image (batched when enabled)"""
+        if self.batcher is not None:
+            return self.batcher.infer(img)
+        return self.predict_with_heatmap_batch(img)[0]
     
     def is_available(self) -> bool:
         """Check if model file exists and can be loaded"""
         return os.path.exists(self.model_path)
     
-    def preprocess_image(self, image_path: str, img_size=(224, 224)) -> np.ndarray:
+    def model_checksum(self) -> Optional[str]:
+        """
+        MD5 of the model file, recomputed only when its size or mtime changes.
+        A new checksum drops the cached results of every other model file.
+        """
+        try:
+            stat = os.stat(self.model_path)
+        except OSError:
+            return None
+        signature = (stat.st_size, stat.st_mtime_ns)
+        
+        with self._checksum_lock:
+            if signature != self._checksum_signature:
+                self._model_checksum = file_checksum(self.model_path)
+                self._checksum_signature = signature
+                if self.result_cache is not None and self.purge_stale_results:
+                    removed = self.result_cache.purge_stale(self._model_checksum)
+                    if removed:
+                        print(f"♻️ Cache de resultados invalidado ({removed} versão(ões) antiga(s) do modelo)")
+            return self._model_checksum
+    
+    def has_cached_result(self, image_hash: Optional[str], threshold: float = 0.5, tta: bool = None) -> bool:
+        """Whether predict(image_hash=..., tta=...) would be answered from the result cache"""
+        if not image_hash or self.result_cache is None:
+            return False
+        checksum = self.model_checksum()
+        return checksum is not None and self.result_cache.contains(
+            checksum, image_hash, threshold, self._tta_cache_variant(self._resolve_tta(tta))
+        )
+    
+    def _get_cached_result(self, image_hash: str, threshold: float, variant: str):
+        checksum = self.model_checksum()
+        entry = self.result_cache.get(checksum, image_hash, threshold, variant) if checksum else None
+        if entry is None:
+            return None
+        bbox = tuple(entry["bbox"]) if entry["bbox"] is not None else None
+        return entry["probability"], visualization.decode_heatmap(entry["heatmap"]), bbox, entry.get("tta")
+    
+    def _store_result(self, image_hash: str, threshold: float, variant: str, probability: float,
+                      heatmap: Optional[np.ndarray], bbox: Optional[Tuple[int, int, int, int]],
+                      tta: Optional[Dict[str, Any]]):
+        checksum = self.model_checksum()
+        if checksum is None:
+            return
+        self.result_cache.put(checksum, image_hash, threshold, {
+            "probability": probability,
+            "heatmap": visualization.encode_heatmap(heatmap, dtype="float32"),
+            "bbox": [int(v) for v in bbox] if bbox is not None else None,
+            "tta": tta
+        }, variant)
+    
+    def _resolve_tta(self, tta: Optional[bool]) -> str:
+        """Effective TTA mode for one request: True forces it, False disables it, None uses tta_mode"""
+        if tta is None:
+            return self.tta_mode
+        return "always" if tta else "off"
+    
+    @staticmethod
+    def _tta_cache_variant(mode: str) -> str:
+        """Result cache key suffix for every setting that changes a TTA result"""
+        if mode == "off":
+            return ""
+        scales = "_".join(f"{s:.2f}" for s in TTA_SCALES)
+        band = f"-b{TTA_BAND_LOW:.2f}_{TTA_BAND_HIGH:.2f}" if mode == "auto" else ""
+        return f"tta-{mode}{band}-f{int(TTA_FLIP)}-s{scales}"
+    
+    def _predict_with_tta(self, img: np.ndarray, trigger: str) -> Tuple[float, Optional[np.ndarray], Dict[str, Any]]:
+        """
+        Unconditional TTA: the original image and its flip/scale variants go
+        through one fused forward/backward pass; the heatmap is the original's
+
+        extra_latency_ms is the variants' share of that pass, since the
+        original is not timed on its own.
+
+        Returns:
+            tuple: (base probability, base heatmap, TTA info)
+        """
+        start = time.perf_counter()
+        variants = preprocessing.tta_variants(img, flip=TTA_FLIP, scales=TTA_SCALES)
+        results = self.predict_with_heatmap_batch(np.concatenate([img.reshape((1,) + variants.shape[1:]), variants]))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        base_probability, heatmap = results[0]
+        variant_probabilities = [float(p) for p, _ in results[1:]]
+        extra_ms = elapsed_ms * len(variants) / len(results)
+        return float(base_probability), heatmap, self._tta_info(
+            trigger, float(base_probability), variant_probabilities, extra_ms
+        )
+    
+    def _run_tta(self, img: np.ndarray, base_probability: float, trigger: str) -> Dict[str, Any]:
+        """
+        Confidence-triggered TTA ("auto"): the original was already scored, so
+        only its variants need a second, batched forward pass
+        """
+        start = time.perf_counter()
+        variants = preprocessing.tta_variants(img, flip=TTA_FLIP, scales=TTA_SCALES)
+        variant_probabilities = [float(p) for p in self.predict_proba_batch(variants)]
+        extra_ms = (time.perf_counter() - start) * 1000
+        return self._tta_info(trigger, base_probability, variant_probabilities, extra_ms)
+    
+    def _tta_info(self, trigger: str, base_probability: float, variant_probabilities: List[float],
+                  extra_ms: float) -> Dict[str, Any]:
+        """Record a TTA run and average the variants with the original probability"""
+        with self._tta_lock:
+            self._tta_runs += 1
+            self._tta_auto_runs += trigger == "auto"
+            self._tta_total_ms += extra_ms
+        
+        probabilities = [base_probability] + variant_probabilities
+        return {
+            "trigger": trigger,
+            "variants": len(variant_probabilities),
+            "base_probability": base_probability,
+            "variant_probabilities": variant_probabilities,
+            "probability": float(np.mean(probabilities)),
+            "extra_latency_ms": round(extra_ms, 1)
+        }
+    
+    def get_tta_stats(self) -> Dict[str, Any]:
+        with self._tta_lock:
+            return {
+                "mode": self.tta_mode,
+                "band": [TTA_BAND_LOW, TTA_BAND_HIGH],
+                "flip": TTA_FLIP,
+                "scales": list(TTA_SCALES),
+                "runs": self._tta_runs,
+                "auto_runs": self._tta_auto_runs,
+                "mean_extra_latency_ms": round(self._tta_total_ms / self._tta_runs, 1) if self._tta_runs else None
+            }
+    
+    def preprocess_image(self, image_path: str, img_size=(224, 224), image_hash: str = None) -> np.ndarray:
         """
         Load and preprocess an image for prediction
         
         Args:
             image_path: Path to the image file
             img_size: Target size for the image
+            image_hash: Content hash of the image; when given, the result is
+                read from / stored in the tensor cache
             
         Returns:
             Preprocessed image array ready for prediction
         """
-        # Read image
-        img = cv2.imread(image_path)
+        if image_hash is None or self.tensor_cache is None:
+            return preprocessing.preprocess_image(image_path, img_size)
         
-        if img is None:
-            raise ValueError(f"Could not load image from {image_path}")
-        
-        # Convert BGR to RGB
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        
-        # Create a mask to find the breast tissue (non-black regions)
-        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-        
-        # Threshold to find non-black regions (breast tissue)
-        _, tissue_mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        
-        # Apply morphological operations to clean up the mask
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (15, 15))
-        tissue_mask = cv2.morphologyEx(tissue_mask, cv2.MORPH_CLOSE, kernel)
-        tissue_mask = cv2.morphologyEx(tissue_mask, cv2.MORPH_OPEN, kernel)
+        # Cache hit: nada de decodificação nem segmentação
+        version = preprocessing.preprocessing_version(img_size)
+        gray = self.tensor_cache.get(image_hash, version)
+        if gray is None:
+            gray = preprocessing.preprocess_uint8(image_path, img_size)
+            self.tensor_cache.put(image_hash, version, gray)
+        return preprocessing.to_tensor(gray)[np.newaxis]
+    
+    def preprocess_batch(self, sources: List[preprocessing.ImageSource], img_size=(224, 224),
+                         workers: int = None) -> np.ndarray:
+        """
+        Preprocess many images (paths or encoded buffers) in parallel
         
-        # Find the bounding box of the breast tissue
-        contours, _ = cv2.findContours(tissue_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if contours:
-            # Get the largest contour (main breast tissue)
-            largest_contour = max(contours, key=cv2.contourArea)
-            x, y, w, h = cv2.boundingRect(largest_contour)
-            
-            # Add some padding (10%)
-            pad_w, pad_h = int(w * 0.1), int(h * 0.1)
-            x = max(0, x - pad_w)
-            y = max(0, y - pad_h)
-            w = min(img.shape[1] - x, w + 2 * pad_w)
-            h = min(img.shape[0] - y, h + 2 * pad_h)
+        Args:
+            sources: Image paths or encoded image buffers
+            img_size: Target size for the images
+            workers: Number of threads (default: PREPROCESS_WORKERS)
             
-            # Crop to breast tissue region
-            img = img[y:y+h, x:x+w]
-        
-        # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization)
-        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-        enhanced = clahe.apply(gray)
-        
-        # Convert back to RGB
-        img = cv2.cvtColor(enhanced, cv2.COLOR_GRAY2RGB)
-        
-        # Resize to target size
-        img = cv2.resize(img, img_size)
-        
-        # Normalize to [0, 1]
-        img = img.astype(np.float32) / 255.0
-        
-        # Add batch dimension
-        img = np.expand_dims(img, axis=0)
-        
-        return img
+        Returns:
+            (N, H, W, 3) float32 array ready for predict_proba_batch
+        """
+        return preprocessing.preprocess_batch(sources, img_size, workers)
     
     def assess_risk_level(self, probability: float) -> tuple:
         """Assess risk level based on malignancy probability"""
@@ -211,6 +669,111 @@ class ModelService:
         
         return report
     
+    def _build_gradcam_fn(self, last_conv_layer_name: str):
+        """
+        Build the Grad-CAM graph for the loaded model: the base network up to
+        the last conv layer, the classifier head on top of it, and a
+        tf.function that runs the forward/backward pass with a fixed input signature.
+        The function returns (probabilities, heatmaps) for the whole batch.
+        """
+        # Find the base model (EfficientNet or ResNet)
+        base_model = None
+        for layer in self.model.layers:
+            if 'efficientnet' in layer.name.lower() or 'resnet' in layer.name.lower():
+                base_model = layer
+                break
+        
+        if base_model is None:
+            print("Warning: Could not find base model (EfficientNet or ResNet)")
+            return None
+        
+        last_conv_layer = base_model.get_layer(last_conv_layer_name)
+        
+        # Create a model that outputs the last conv layer activations
+        efficientnet_output_model = keras.Model(
+            inputs=base_model.inputs,
+            outputs=last_conv_layer.output
+        )
+        
+        # Create a model from conv outputs to final prediction
+        # We need to manually pass through the remaining layers
+        classifier_input = keras.Input(shape=last_conv_layer.output.shape[1:])
+        x = classifier_input
+        
+        # Apply the layers after the base model
+        for layer in self.model.layers[2:]:  # Skip input and base model layers
+            x = layer(x)
+        
+        classifier_model = keras.Model(classifier_input, x)
+        
+        input_spec = tf.TensorSpec(shape=(None,) + tuple(self.model.input_shape[1:]), dtype=tf.float32)
+        
+        @tf.function(input_signature=[input_spec], jit_compile=self.jit_compile)
+        def gradcam(img_array):
+            with tf.GradientTape() as tape:
+                # Get conv outputs from base model
+                conv_outputs = efficientnet_output_model(img_array, training=False)
+                tape.watch(conv_outputs)
+                
+                # Get predictions from classifier (the same pass yields the probability)
+                predictions = classifier_model(conv_outputs, training=False)
+                # Soma da única saída: mesmo gradiente que predictions[:, 0], sem
+                # StridedSliceGrad (operação não suportada pelo TFLite)
+                loss = tf.reduce_sum(predictions, axis=-1)
+            
+            # Extract the gradients (each image only influences its own prediction)
+            grads = tape.gradient(loss, conv_outputs)
+            if grads is None:
+                raise ValueError("Could not compute gradients")
+            
+            # Compute the guided gradients, per image
+            pooled_grads = tf.reduce_mean(grads, axis=(1, 2))
+            
+            # Weight the channels by the gradients
+            heatmaps = tf.einsum('bhwc,bc->bhw', conv_outputs, pooled_grads)
+            
+            # Normalize each heatmap
+            max_values = tf.math.reduce_max(heatmaps, axis=(1, 2), keepdims=True)
+            heatmaps = tf.maximum(heatmaps, 0) / (max_values + 1e-10)
+            return predictions[:, 0], heatmaps
+        
+        return gradcam
+    
+    def _get_gradcam_fn(self, last_conv_layer_name: str):
+        """Return the cached Grad-CAM function for the loaded model, building it once"""
+        gradcam = self._gradcam_cache.get(last_conv_layer_name)
+        if gradcam is not None:
+            return gradcam
+        with self._gradcam_lock:
+            if last_conv_layer_name not in self._gradcam_cache:
+                self._gradcam_cache[last_conv_layer_name] = self._build_gradcam_fn(last_conv_layer_name)
+            return self._gradcam_cache[last_conv_layer_name]
+    
+    def _build_predict_fn(self):
+        """
+        Compile the forward pass once for the loaded model. Calling the model
+        directly inside a tf.function with a fixed input signature skips the
+        tf.data pipeline and callbacks that model.predict sets up on every call.
+        """
+        model = self.model
+        input_spec = tf.TensorSpec(shape=(None,) + tuple(model.input_shape[1:]), dtype=tf.float32)
+        
+        @tf.function(input_signature=[input_spec], jit_compile=self.jit_compile)
+        def predict_fn(img_array):
+            return model(img_array, training=False)[:, 0]
+        
+        return predict_fn
+    
+    def _get_predict_fn(self):
+        """Return the compiled forward pass for the loaded model, building it once"""
+        predict_fn = self._predict_fn
+        if predict_fn is not None:
+            return predict_fn
+        with self._gradcam_lock:
+            if self._predict_fn is None:
+                self._predict_fn = self._build_predict_fn()
+            return self._predict_fn
+    
     def get_gradcam_heatmap(self, img_array: np.ndarray, last_conv_layer_name: str = None) -> Optional[np.ndarray]:
         """
         Generate Grad-CAM heatmap to show which regions the model focuses on
@@ -223,69 +786,24 @@ class ModelService:
             Heatmap array or None if generation fails
         """
         try:
-            # Find the base model (EfficientNet or ResNet)
-            base_model = None
-            for layer in self.model.layers:
-                if 'efficientnet' in layer.name.lower() or 'resnet' in layer.name.lower():
-                    base_model = layer
-                    break
-            
-            if base_model is None:
-                print("Warning: Could not find base model (EfficientNet or ResNet)")
-                return None
-            
             # Get the last convolutional layer from the base model
             # For EfficientNet, use 'top_activation' which is after top_conv and top_bn
             if last_conv_layer_name is None:
                 last_conv_layer_name = 'top_activation'
             
-            last_conv_layer = base_model.get_layer(last_conv_layer_name)
+            if self.server_socket:
+                return self.predict_with_heatmap_batch(img_array, last_conv_layer_name)[0][1]
             
-            # Create a model that outputs the last conv layer activations
-            efficientnet_output_model = keras.Model(
-                inputs=base_model.inputs,
-                outputs=last_conv_layer.output
-            )
+            if self.backend == "tflite":
+                with self._use_model() as model:
+                    return model.predict(img_array)[1][0]
             
-            # Create a model from conv outputs to final prediction
-            # We need to manually pass through the remaining layers
-            classifier_input = keras.Input(shape=last_conv_layer.output.shape[1:])
-            x = classifier_input
-            
-            # Apply the layers after the base model
-            for layer in self.model.layers[2:]:  # Skip input and base model layers
-                x = layer(x)
-            
-            classifier_model = keras.Model(classifier_input, x)
-            
-            # Now compute gradients
-            with tf.GradientTape() as tape:
-                # Get conv outputs from base model
-                conv_outputs = efficientnet_output_model(img_array)
-                tape.watch(conv_outputs)
-                
-                # Get predictions from classifier
-                predictions = classifier_model(conv_outputs)
-                loss = predictions[:, 0]
-            
-            # Extract the gradients
-            grads = tape.gradient(loss, conv_outputs)
-            
-            if grads is None:
-                print("Warning: Could not compute gradients")
+            gradcam = self._get_gradcam_fn(last_conv_layer_name)
+            if gradcam is None:
                 return None
             
-            # Compute the guided gradients
-            pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
-            
-            # Weight the channels by the gradients
-            conv_outputs = conv_outputs[0]
-            heatmap = conv_outputs @ pooled_grads[..., tf.newaxis]
-            heatmap = tf.squeeze(heatmap)
-            
-            # Normalize the heatmap
-            heatmap = tf.maximum(heatmap, 0) / (tf.math.reduce_max(heatmap) + 1e-10)
-            return heatmap.numpy()
+            _, heatmaps = gradcam(tf.convert_to_tensor(img_array, dtype=tf.float32))
+            return heatmaps.numpy()[0]
         except Exception as e:
             print(f"Warning: Could not generate Grad-CAM heatmap: {e}")
             import traceback
@@ -312,94 +830,43 @@ class ModelService:
     def generate_visualization(self, image_path: str, heatmap: Optional[np.ndarray], 
                               bbox: Optional[Tuple[int, int, int, int]], 
                               diagnostic_report: Dict[str, Any], 
-                              output_dir: str = None, target_size: Tuple[int, int] = (224, 224)) -> Optional[str]:
+                              output_dir: str = None, target_size: Tuple[int, int] = (224, 224),
+                              panel_size: int = None, fmt: str = None) -> Optional[str]:
         """
         Generate visualization image with Grad-CAM heatmap and diagnosis overlay
         
         Args:
             image_path: Path to original image
             heatmap: Grad-CAM heatmap array (already resized to target_size)
-            bbox: Bounding box coordinates (x, y, w, h)
+            bbox: Bounding box coordinates (x, y, w, h) in target_size space
             diagnostic_report: Diagnostic report dictionary
             output_dir: Directory to save the visualization
-            target_size: Size of the displayed images
+            target_size: Size of the space heatmap and bbox were computed in
+            panel_size: Side of each panel in pixels (default: VIZ_PANEL_SIZE)
+            fmt: Output format, jpg, png or webp (default: VIZ_FORMAT)
             
         Returns:
             Path to the generated visualization image, or None if failed
         """
         try:
-            # Read and preprocess original image for display
             img = cv2.imread(image_path)
             if img is None:
                 return None
-                
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            img_resized = cv2.resize(img, target_size)
-            
-            # Create figure with 3 subplots
-            fig, axes = plt.subplots(1, 3, figsize=(18, 6))
-            
-            # Original image
-            axes[0].imshow(img_resized)
-            axes[0].set_title('Original Image', fontsize=14, fontweight='bold')
-            axes[0].axis('off')
-            
-            # Heatmap overlay
-            axes[1].imshow(img_resized)
-            if heatmap is not None:
-                # The 'heatmap' passed in is already resized, so no need to resize again
-                axes[1].imshow(heatmap, cmap='jet', alpha=0.5)
-            axes[1].set_title('Attention Map (Grad-CAM)', fontsize=14, fontweight='bold')
-            axes[1].axis('off')
-            
-            # Image with red square
-            axes[2].imshow(img_resized)
-            if bbox is not None:
-                x, y, w, h = bbox
-                
-                # The bbox coordinates are now correctly scaled to the target_size (e.g., 224x224)
-                # because find_roi_bbox was called on the resized heatmap.
-                
-                # Draw red square around suspicious region
-                rect = patches.Rectangle(
-                    (x, y), w, h,
-                    linewidth=4, edgecolor='red', facecolor='none'
-                )
-                axes[2].add_patch(rect)
-                
-                # Draw crosshair at center
-                center_x = x + w // 2
-                center_y = y + h // 2
-                axes[2].plot(center_x, center_y, 'r+', markersize=20, markeredgewidth=3)
-            axes[2].set_title('Suspicious Region', fontsize=14, fontweight='bold')
-            axes[2].axis('off')
-            
-            # Add diagnostic info as text
-            info_text = f"""DIAGNOSIS: {diagnostic_report['primary_diagnosis']}
-Risk Level: {diagnostic_report['risk_level']}
-Malignancy: {diagnostic_report['malignancy_probability']}
-{diagnostic_report['birads_equivalent']}
-{diagnostic_report['recommendation']}"""
-            
-            plt.suptitle(info_text, fontsize=11, y=0.02, fontfamily='monospace',
-                        bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.5))
-            
-            plt.tight_layout()
+
+            canvas = visualization.render_diagnosis(img, heatmap, bbox, diagnostic_report,
+                                                    bbox_space=target_size, panel_size=panel_size)
+            fmt = (fmt or visualization.VIZ_FORMAT).lower()
+            data = visualization.encode_image(canvas, fmt)
             
             # Determine output path
             if output_dir is None:
                 output_dir = os.path.dirname(image_path)
             
-            base_name = os.path.basename(image_path)
-            output_filename = base_name.replace('.jpg', '_diagnosis.jpg').replace('.png', '_diagnosis.png')
-            if not (output_filename.endswith('.jpg') or output_filename.endswith('.png')):
-                output_filename = output_filename + '_diagnosis.jpg'
+            stem = os.path.splitext(os.path.basename(image_path))[0]
+            output_path = os.path.join(output_dir, f"{stem}_diagnosis.{fmt}")
             
-            output_path = os.path.join(output_dir, output_filename)
-            
-            # Save figure
-            plt.savefig(output_path, dpi=300, bbox_inches='tight')
-            plt.close(fig)
+            with open(output_path, 'wb') as f:
+                f.write(data)
             
             print(f"📊 Visualization saved to: {output_path}")
             return output_path
@@ -410,7 +877,9 @@ Malignancy: {diagnostic_report['malignancy_probability']}
             traceback.print_exc()
             return None
     
-    def predict(self, image_path: str, threshold: float = 0.5, generate_viz: bool = True) -> Dict[str, Any]:
+    def predict(self, image_path: str, threshold: float = 0.5, generate_viz: bool = True,
+                preprocessed: Optional[np.ndarray] = None, image_hash: Optional[str] = None,
+                tta: Optional[bool] = None) -> Dict[str, Any]:
         """
         Make prediction on a single image with detailed diagnosis
         
@@ -418,6 +887,9 @@ Malignancy: {diagnostic_report['malignancy_probability']}
             image_path: Path to the image file
             threshold: Threshold for binary classification (default: 0.5)
             generate_viz: Whether to generate visualization image (default: True)
+            preprocessed: Output of preprocess_image for image_path, if already computed
+            image_hash: Content hash of the image; enables the tensor and result caches
+            tta: Force (True) or disable (False) test-time augmentation; None follows tta_mode
             
         Returns:
             Dictionary containing prediction results and diagnostic report
@@ -425,49 +897,79 @@ Malignancy: {diagnostic_report['malignancy_probability']}
         if not self.is_available():
             raise RuntimeError("Modelo não está disponível")
         
+        img = None
+        model_guard = ExitStack()
+        heatmap_small = None
+        heatmap_resized = None
         try:
-            # Carregar modelo sob demanda (lazy loading)
-            self._load_model()
-            
-            if self.model is None:
-                raise RuntimeError("Falha ao carregar o modelo")
-            
             # Define target size
             img_size = (224, 224)
             
-            # Preprocess image
-            img = self.preprocess_image(image_path, img_size)
+            tta_mode = self._resolve_tta(tta)
+            cache_variant = self._tta_cache_variant(tta_mode)
+            tta_info = None
             
-            # Make prediction
-            print("Fazendo predição...")
-            prediction_proba = float(self.model.predict(img, verbose=0)[0][0])
+            use_result_cache = image_hash is not None and self.result_cache is not None
+            cached = self._get_cached_result(image_hash, threshold, cache_variant) if use_result_cache else None
+            
+            if cached is not None:
+                # Mesma imagem, mesmo modelo e mesmo limiar: sem pré-processamento nem inferência
+                prediction_proba, heatmap_small, bbox, tta_info = cached
+                print("♻️ Resultado do modelo treinado reaproveitado do cache")
+                if heatmap_small is not None:
+                    heatmap_resized = cv2.resize(heatmap_small, img_size, interpolation=cv2.INTER_LINEAR)
+            else:
+                # Carregar modelo sob demanda (lazy loading) e mantê-lo durante a predição
+                model_guard.enter_context(self._use_model())
+                
+                # Preprocess image
+                img = preprocessed if preprocessed is not None else self.preprocess_image(
+                    image_path, img_size, image_hash=image_hash
+                )
+                
+                # Make prediction and Grad-CAM heatmap in a single forward/backward pass
+                print("Fazendo predição e gerando mapa de atenção...")
+                if tta_mode == "always":
+                    # TTA incondicional: original e variantes no mesmo lote; o heatmap é o da original
+                    trigger = "request" if tta else tta_mode
+                    prediction_proba, heatmap_small, tta_info = self._predict_with_tta(img, trigger)
+                else:
+                    prediction_proba, heatmap_small = self._predict_with_heatmap(img)  # heatmap is small (e.g., 7x7)
+                    prediction_proba = float(prediction_proba)
+                    # TTA "auto": só na faixa de incerteza, então as variantes exigem um segundo passo
+                    if tta_mode == "auto" and TTA_BAND_LOW <= prediction_proba <= TTA_BAND_HIGH:
+                        tta_info = self._run_tta(img, prediction_proba, "auto")
+                if tta_info is not None:
+                    prediction_proba = tta_info["probability"]
+                    print(f"🔁 TTA ({tta_info['trigger']}): {tta_info['base_probability']:.1%} → {prediction_proba:.1%} "
+                          f"(+{tta_info['extra_latency_ms']:.0f}ms)")
+                
+                bbox = None
+                heatmap_resized = None  # This will be our full 224x224 heatmap
+                
+                if heatmap_small is not None:
+                    # Resize the small heatmap to match the input image size
+                    heatmap_resized = cv2.resize(heatmap_small, img_size, interpolation=cv2.INTER_LINEAR)
+                    
+                    # Now, find the bounding box on the *full-size* resized heatmap
+                    bbox = self.find_roi_bbox(heatmap_resized, threshold=0.5)
+                
+                # If no bbox detected but malignancy probability is above 20%, mark center region
+                if bbox is None and prediction_proba >= 0.2:
+                    # Create a default bounding box in the center of the image
+                    center_val = img_size[0] // 4
+                    size_val = img_size[0] // 2
+                    bbox = (center_val, center_val, size_val, size_val)  # e.g., (56, 56, 112, 112)
+                    print("Note: Using center region as default suspicious area")
+                
+                if use_result_cache:
+                    self._store_result(image_hash, threshold, cache_variant, prediction_proba,
+                                       heatmap_small, bbox, tta_info)
             
             # Convert to binary prediction
             prediction = "MALIGNANT" if prediction_proba > threshold else "BENIGN"
             confidence = prediction_proba if prediction_proba > threshold else (1 - prediction_proba)
             
-            # Generate Grad-CAM heatmap
-            print("Generating attention map...")
-            heatmap_small = self.get_gradcam_heatmap(img)  # This is the small (e.g., 7x7) heatmap
-            
-            bbox = None
-            heatmap_resized = None  # This will be our full 224x224 heatmap
-            
-            if heatmap_small is not None:
-                # Resize the small heatmap to match the input image size
-                heatmap_resized = cv2.resize(heatmap_small, img_size, interpolation=cv2.INTER_LINEAR)
-                
-                # Now, find the bounding box on the *full-size* resized heatmap
-                bbox = self.find_roi_bbox(heatmap_resized, threshold=0.5)
-            
-            # If no bbox detected but malignancy probability is above 20%, mark center region
-            if bbox is None and prediction_proba >= 0.2:
-                # Create a default bounding box in the center of the image
-                center_val = img_size[0] // 4
-                size_val = img_size[0] // 2
-                bbox = (center_val, center_val, size_val, size_val)  # e.g., (56, 56, 112, 112)
-                print("Note: Using center region as default suspicious area")
-            
             # Generate diagnostic report
             diagnostic_report = self.generate_diagnostic_report(prediction, prediction_proba, confidence)
             
@@ -492,14 +994,16 @@ Malignancy: {diagnostic_report['malignancy_probability']}
                 'diagnostic_report': diagnostic_report,
                 'analysis': self._format_analysis_text(diagnostic_report, prediction_proba),
                 'visualization_path': viz_path,
-                'visualization_filename': viz_filename
+                'visualization_filename': viz_filename,
+                # Heatmap bruto + bbox para renderizar a visualização sob demanda
+                'visualization_state': visualization.build_state(heatmap_small, bbox, img_size,
+                                                                 diagnostic_report),
+                'tta': tta_info,
+                'from_cache': cached is not None
             }
             
             print(f"✅ Predição concluída: {prediction} ({prediction_proba:.1%})")
             
-            # Liberar memória do modelo após uso
-            self._unload_model()
-            
             return result
             
         except Exception as e:
@@ -507,15 +1011,14 @@ Malignancy: {diagnostic_report['malignancy_probability']}
             import traceback
             traceback.print_exc()
             
-            # Liberar memória mesmo em caso de erro
-            self._unload_model()
-            
             return {
                 'success': False,
                 'error': str(e),
                 'model': 'EfficientNetV2 (Trained on CBIS-DDSM)'
             }
         finally:
+            # Aplicar política de residência (mantém o modelo ou libera memória)
+            model_guard.close()
             # Garantir limpeza de memória
             if img is not None:
                 del img
@@ -523,7 +1026,8 @@ Malignancy: {diagnostic_report['malignancy_probability']}
                 del heatmap_small
             if heatmap_resized is not None:
                 del heatmap_resized
-            gc.collect()
+            if self.residency == "on_demand":
+                gc.collect()
     
     def _format_analysis_text(self, report: Dict[str, Any], probability: float) -> str:
         """Format diagnostic report as readable text"""
@@ -0,0 +1,297 @@
+"""
+Mammogram preprocessing for the trained model, single image and batched
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from services import execution_profile
+
+load_dotenv()
+
+# Threads usadas por preprocess_batch (OpenCV libera o GIL durante decode e filtros);
+# padrão definido pelo perfil de execução (EXECUTION_PROFILE)
+PREPROCESS_WORKERS = execution_profile.setting("PREPROCESS_WORKERS")
+# Segmentação do tecido mamário: "full" (padrão: máscara na resolução original,
+# idêntico ao treino) ou "downscale" (opcional: máscara em uma cópia reduzida,
+# caixa mapeada de volta; a entrada do modelo pode diferir levemente)
+DEFAULT_SEGMENTATION = "full"
+PREPROCESS_SEGMENTATION = os.getenv("PREPROCESS_SEGMENTATION", DEFAULT_SEGMENTATION).lower()
+# Maior lado máximo da cópia reduzida usada no modo "downscale" (reduzida por fator inteiro)
+SEGMENTATION_PROXY_SIZE = int(os.getenv("SEGMENTATION_PROXY_SIZE", "1024"))
+
+SEGMENTATION_MODES = ("full", "downscale")
+# Incrementar sempre que o pipeline mudar; invalida os tensores em cache
+PREPROCESSING_VERSION = 2
+if PREPROCESS_SEGMENTATION not in SEGMENTATION_MODES:
+    print(f"⚠️ Modo de segmentação desconhecido '{PREPROCESS_SEGMENTATION}', usando '{DEFAULT_SEGMENTATION}'")
+    PREPROCESS_SEGMENTATION = DEFAULT_SEGMENTATION
+
+# Um caminho de arquivo ou o conteúdo codificado da imagem (bytes, bytearray, memoryview)
+ImageSource = Union[str, os.PathLike, bytes, bytearray, memoryview]
+
+# uint8 -> float32 em [0, 1], idêntico a img.astype(np.float32) / 255.0
+_UNIT_LUT = np.arange(256, dtype=np.float32) / np.float32(255.0)
+_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (15, 15))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, PREPROCESS_WORKERS), thread_name_prefix="preprocess")
+        return _pool
+
+
+def _resolve_segmentation(segmentation: Optional[str]) -> str:
+    mode = (segmentation or PREPROCESS_SEGMENTATION).lower()
+    if mode not in SEGMENTATION_MODES:
+        raise ValueError(f"Unknown segmentation mode '{mode}', expected one of {SEGMENTATION_MODES}")
+    return mode
+
+
+def decode_image(source: ImageSource, flags: int = cv2.IMREAD_COLOR) -> np.ndarray:
+    """Decode a path or an encoded buffer, like cv2.imread"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        img = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), flags)
+        if img is None:
+            raise ValueError("Could not decode image buffer")
+        return img
+
+    img = cv2.imread(os.fspath(source), flags)
+    if img is None:
+        raise ValueError(f"Could not load image from {source}")
+    return img
+
+
+def _largest_tissue_rect(gray: np.ndarray, kernel: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+    # Threshold to find non-black regions (breast tissue)
+    _, tissue_mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    # Apply morphological operations to clean up the mask
+    tissue_mask = cv2.morphologyEx(tissue_mask, cv2.MORPH_CLOSE, kernel)
+    tissue_mask = cv2.morphologyEx(tissue_mask, cv2.MORPH_OPEN, kernel)
+
+    contours, _ = cv2.findContours(tissue_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+
+    # Get the largest contour (main breast tissue)
+    return cv2.boundingRect(max(contours, key=cv2.contourArea))
+
+
+def _downscaled_tissue_rect(gray: np.ndarray, factor: int) -> Optional[Tuple[int, int, int, int]]:
+    """Find the tissue on a copy reduced by an integer factor and map the box back"""
+    height, width = gray.shape[:2]
+    proxy_w, proxy_h = width // factor, height // factor
+    # Fator inteiro usa o caminho rápido do INTER_AREA (média de blocos factor x factor)
+    proxy = cv2.resize(gray[:proxy_h * factor, :proxy_w * factor], (proxy_w, proxy_h),
+                       interpolation=cv2.INTER_AREA)
+
+    # Kernel proporcional à redução, para limpar a máscara na mesma escala física
+    k = max(3, int(round(15 / factor)) | 1)
+    rect = _largest_tissue_rect(proxy, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (k, k)))
+    if rect is None:
+        return None
+
+    # Cada pixel do proxy cobre um bloco inteiro; caixas na borda incluem o resto da divisão
+    px, py, pw, ph = rect
+    x0, y0 = px * factor, py * factor
+    x1 = width if px + pw == proxy_w else (px + pw) * factor
+    y1 = height if py + ph == proxy_h else (py + ph) * factor
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def find_tissue_bbox(gray: np.ndarray, segmentation: str = None,
+                     proxy_size: int = None) -> Tuple[int, int, int, int]:
+    """
+    Bounding box (x, y, w, h) of the breast tissue with 10% padding, or the
+    whole image when no tissue is found
+
+    Args:
+        gray: Full resolution grayscale image
+        segmentation: "full" or "downscale" (default: PREPROCESS_SEGMENTATION)
+        proxy_size: Maximum longest side of the proxy in "downscale" mode (default: SEGMENTATION_PROXY_SIZE)
+    """
+    height, width = gray.shape[:2]
+    proxy_size = proxy_size or SEGMENTATION_PROXY_SIZE
+
+    factor = -(-max(height, width) // proxy_size)
+    if _resolve_segmentation(segmentation) == "downscale" and factor > 1:
+        rect = _downscaled_tissue_rect(gray, factor)
+    else:
+        rect = _largest_tissue_rect(gray, _KERNEL)
+    if rect is None:
+        return 0, 0, width, height
+    x, y, w, h = rect
+
+    # Add some padding (10%)
+    pad_w, pad_h = int(w * 0.1), int(h * 0.1)
+    x = max(0, x - pad_w)
+    y = max(0, y - pad_h)
+    w = min(width - x, w + 2 * pad_w)
+    h = min(height - y, h + 2 * pad_h)
+    return x, y, w, h
+
+
+def bbox_iou(a: Tuple[int, int, int, int], b: Tuple[int, int, int, int]) -> float:
+    """Intersection over union of two (x, y, w, h) boxes"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    inter_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    inter_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = inter_w * inter_h
+    return inter / (aw * ah + bw * bh - inter)
+
+
+def preprocessing_version(img_size: Tuple[int, int] = (224, 224), segmentation: str = None) -> str:
+    """Identifier of everything that changes the preprocessed output, for cache keys"""
+    mode = _resolve_segmentation(segmentation)
+    if mode == "downscale":
+        mode = f"downscale{SEGMENTATION_PROXY_SIZE}"
+    return f"v{PREPROCESSING_VERSION}-{mode}-{img_size[0]}x{img_size[1]}"
+
+
+def preprocess_uint8(source: ImageSource, img_size: Tuple[int, int] = (224, 224),
+                     segmentation: str = None) -> np.ndarray:
+    """
+    Run the pipeline up to the resized CLAHE output: an (H, W) uint8 image
+    that to_tensor turns into the model input without loss.
+
+    In "full" mode the output is identical to the original RGB pipeline, but
+    every stage after decoding works on a single gray channel: BGR->GRAY
+    equals RGB->GRAY on the swapped image, cropping commutes with the color
+    conversion, and resizing three identical channels equals resizing one and
+    replicating it.
+
+    In "downscale" mode only a small proxy goes through Otsu and morphology;
+    decoding, CLAHE and resize are the same as in "full" mode, so only the
+    crop box can differ.
+    """
+    # Decodificar em cor e converter como no treino: IMREAD_GRAYSCALE arredonda
+    # de outra forma (PNG) ou decodifica o JPEG direto em luminância
+    gray = cv2.cvtColor(decode_image(source), cv2.COLOR_BGR2GRAY)
+
+    x, y, w, h = find_tissue_bbox(gray, segmentation)
+    crop = gray[y:y + h, x:x + w]
+
+    # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization)
+    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+    return cv2.resize(clahe.apply(crop), img_size)
+
+
+def to_tensor(gray: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """Normalize an (H, W) uint8 image to [0, 1] and replicate it to (H, W, 3) float32"""
+    if out is None:
+        out = np.empty(gray.shape + (3,), dtype=np.float32)
+    out[...] = _UNIT_LUT[gray][..., np.newaxis]
+    return out
+
+
+def preprocess_into(source: ImageSource, out: np.ndarray, img_size: Tuple[int, int] = (224, 224),
+                    segmentation: str = None) -> np.ndarray:
+    """Preprocess one image and write it into ``out`` (shape (H, W, 3), float32)"""
+    return to_tensor(preprocess_uint8(source, img_size, segmentation), out)
+
+
+def preprocess_image(source: ImageSource, img_size: Tuple[int, int] = (224, 224),
+                     segmentation: str = None) -> np.ndarray:
+    """Preprocess one image; returns a (1, H, W, 3) float32 array"""
+    out = np.empty((1, img_size[1], img_size[0], 3), dtype=np.float32)
+    preprocess_into(source, out[0], img_size, segmentation)
+    return out
+
+
+def _rescale_centered(plane: np.ndarray, scale: float) -> np.ndarray:
+    """Zoom a 2D image about its center, keeping its size (zoom out pads with black)"""
+    height, width = plane.shape
+    scaled_w, scaled_h = max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+    scaled = cv2.resize(plane, (scaled_w, scaled_h), interpolation=cv2.INTER_LINEAR)
+    if scale >= 1:
+        y0, x0 = (scaled_h - height) // 2, (scaled_w - width) // 2
+        return scaled[y0:y0 + height, x0:x0 + width]
+    out = np.zeros_like(plane)
+    y0, x0 = (height - scaled_h) // 2, (width - scaled_w) // 2
+    out[y0:y0 + scaled_h, x0:x0 + scaled_w] = scaled
+    return out
+
+
+def tta_variants(tensor: np.ndarray, flip: bool = True, scales: Sequence[float] = (0.9, 1.1)) -> np.ndarray:
+    """
+    Test-time augmentation variants of one preprocessed image, stacked for
+    a single forward pass: horizontal flip and centered zooms
+
+    Args:
+        tensor: (H, W, 3) float32 output of to_tensor (or a (1, H, W, 3) batch of one)
+
+    Returns:
+        (N, H, W, 3) float32 array, without the original image
+    """
+    if tensor.ndim == 4:
+        tensor = tensor[0]
+    # Os três canais são idênticos: transformar um e replicar
+    plane = np.ascontiguousarray(tensor[..., 0])
+    planes = []
+    if flip:
+        planes.append(plane[:, ::-1])
+    for scale in scales:
+        if scale != 1:
+            planes.append(_rescale_centered(plane, scale))
+
+    out = np.empty((len(planes),) + tensor.shape, dtype=np.float32)
+    for i, variant in enumerate(planes):
+        out[i] = variant[..., np.newaxis]
+    return out
+
+
+def preprocess_batch(sources: Sequence[ImageSource], img_size: Tuple[int, int] = (224, 224),
+                     workers: int = None, segmentation: str = None) -> np.ndarray:
+    """
+    Preprocess many images in parallel into one (N, H, W, 3) float32 tensor,
+    ready for a single forward pass
+
+    Args:
+        sources: Image paths or encoded image buffers
+        img_size: Target (width, height)
+        workers: Number of threads (default: PREPROCESS_WORKERS, shared pool)
+        segmentation: "full" or "downscale" (default: PREPROCESS_SEGMENTATION)
+
+    Raises:
+        ValueError: if any image cannot be decoded
+    """
+    batch = np.empty((len(sources), img_size[1], img_size[0], 3), dtype=np.float32)
+    if len(sources) <= 1 or workers == 1:
+        for i, source in enumerate(sources):
+            preprocess_into(source, batch[i], img_size, segmentation)
+        return batch
+
+    def work(i):
+        # Cada thread escreve direto na sua fatia do tensor final, sem np.stack
+        preprocess_into(sources[i], batch[i], img_size, segmentation)
+
+    pool = _get_pool() if workers is None else ThreadPoolExecutor(max_workers=workers,
+                                                                  thread_name_prefix="preprocess")
+    try:
+        # list() propaga a primeira exceção de qualquer worker
+        list(pool.map(work, range(len(sources))))
+    finally:
+        if workers is not None:
+            pool.shutdown(wait=False)
+    return batch
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
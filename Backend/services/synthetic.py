@@ -0,0 +1,61 @@
+"""
+Synthetic mammograms and DICOM files for benchmarks, tooling and tests
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+
+def create_synthetic_mammogram(path: str, size: Tuple[int, int] = (1200, 900), seed: int = 0) -> str:
+    """Write a mammogram-like grayscale image (breast over a black background)"""
+    import cv2
+
+    height, width = size
+    rng = np.random.default_rng(seed)
+    img = np.zeros((height, width), dtype=np.uint8)
+    cv2.ellipse(img, (0, height // 2), (int(width * 0.7), int(height * 0.42)), 0, -90, 90, 170, -1)
+    tissue = img > 0
+    noise = rng.normal(0, 25, (height, width)).astype(np.float32)
+    img = np.clip(img + noise * tissue, 0, 255).astype(np.uint8)
+    cv2.circle(img, (width // 3, height // 2), max(width // 20, 2), 250, -1)
+    cv2.imwrite(path, img)
+    return path
+
+
+def create_synthetic_dicom(path: str, size: Tuple[int, int] = (5000, 4000), bits_stored: int = 12,
+                          window: Tuple[float, float] = (2048.0, 3000.0), seed: int = 0,
+                          pixels: np.ndarray = None) -> str:
+    """Write a mammography DICOM (MONOCHROME2, 16 bits allocated; uniform noise by default)"""
+    import pydicom
+    from pydicom.dataset import FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+    if pixels is None:
+        rng = np.random.default_rng(seed)
+        pixels = rng.integers(0, 2 ** bits_stored, size, dtype=np.uint16)
+    height, width = pixels.shape
+
+    file_meta = FileMetaDataset()
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.1.2"  # Digital Mammography X-Ray
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    dataset = pydicom.Dataset()
+    dataset.file_meta = file_meta
+    dataset.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    dataset.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    dataset.Modality = "MG"
+    dataset.PatientID = "SYNTH001"
+    dataset.BodyPartExamined = "BREAST"
+    dataset.Rows, dataset.Columns = height, width
+    dataset.SamplesPerPixel = 1
+    dataset.PhotometricInterpretation = "MONOCHROME2"
+    dataset.BitsAllocated = 16
+    dataset.BitsStored = bits_stored
+    dataset.HighBit = bits_stored - 1
+    dataset.PixelRepresentation = 0
+    dataset.WindowCenter, dataset.WindowWidth = window
+    dataset.PixelData = pixels.tobytes()
+    dataset.save_as(path, enforce_file_format=True)
+    return path
+
@@ -0,0 +1,63 @@
+"""
+TFLite runtime for the trained model converted by convert_model.py
+"""
+
+import threading
+import warnings
+from typing import Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from services import execution_profile
+
+try:
+    # Runtime standalone (pacote ai-edge-litert), sem carregar o TensorFlow completo
+    from ai_edge_litert.interpreter import Interpreter
+except ImportError:
+    from tensorflow.lite.python.interpreter import Interpreter
+
+load_dotenv()
+
+# Threads do interpretador TFLite (equivalente ao intra_op do backend Keras)
+TFLITE_NUM_THREADS = execution_profile.setting("TFLITE_NUM_THREADS")
+
+# Quantizações aceitas por convert_model.py
+TFLITE_QUANTIZATIONS = ("none", "dynamic", "float16")
+
+
+class TFLiteModel:
+    """
+    Converted model with one signature that takes a (N, H, W, 3) float32
+    batch and returns the malignancy probabilities and the Grad-CAM
+    heatmaps, so the backend keeps the fused single-pass prediction.
+    """
+
+    def __init__(self, model_path: str, num_threads: int = None):
+        self.model_path = model_path
+        with warnings.catch_warnings():
+            # tf.lite.Interpreter avisa que foi substituído pelo ai-edge-litert
+            warnings.simplefilter("ignore", UserWarning)
+            self.interpreter = Interpreter(
+                model_path=model_path,
+                num_threads=TFLITE_NUM_THREADS if num_threads is None else num_threads
+            )
+        # O SignatureRunner redimensiona a entrada quando o tamanho do lote muda
+        self._runner = self.interpreter.get_signature_runner()
+        input_name = next(iter(self._runner.get_input_details()))
+        self._input_name = input_name
+        self.input_shape = tuple(int(d) for d in self._runner.get_input_details()[input_name]["shape_signature"])
+        # O interpretador não é thread-safe
+        self._lock = threading.Lock()
+
+    def predict(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (probabilities (N,), heatmaps (N, h, w)) for a preprocessed batch"""
+        with self._lock:
+            outputs = self._runner(**{self._input_name: np.ascontiguousarray(batch, dtype=np.float32)})
+            probabilities = heatmaps = None
+            for value in outputs.values():
+                if value.ndim == 1:
+                    probabilities = value.copy()
+                else:
+                    heatmaps = value.copy()
+        return probabilities, heatmaps
@@ -0,0 +1,279 @@
+"""
+Fast NumPy/OpenCV renderer for the trained-model diagnosis visualization
+"""
+
+import base64
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import unicodedata
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Lado de cada um dos três painéis em pixels
+VIZ_PANEL_SIZE = int(os.getenv("VIZ_PANEL_SIZE", "512"))
+# Formato de saída: jpg, png ou webp
+VIZ_FORMAT = os.getenv("VIZ_FORMAT", "jpg").lower()
+# Qualidade para jpg/webp (1-100)
+VIZ_QUALITY = int(os.getenv("VIZ_QUALITY", "90"))
+# Diretório das visualizações renderizadas sob demanda
+VIZ_CACHE_DIR = os.getenv("VIZ_CACHE_DIR", str(Path(__file__).parent.parent / "results" / "visualizations"))
+
+# Incrementar quando o layout mudar, para invalidar imagens e ETags antigos
+RENDERER_VERSION = 1
+MIN_PANEL_SIZE = 64
+MAX_PANEL_SIZE = 2048
+
+SUPPORTED_FORMATS = ("jpg", "png", "webp")
+MEDIA_TYPES = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+
+# Cores em BGR
+_WHITE = (255, 255, 255)
+_BLACK = (0, 0, 0)
+_RED = (0, 0, 255)
+_WHEAT = (179, 222, 245)
+_FONT = cv2.FONT_HERSHEY_SIMPLEX
+_MONO_FONT = cv2.FONT_HERSHEY_PLAIN
+
+
+def _ascii(text: str) -> str:
+    """Fontes Hershey do OpenCV só desenham ASCII"""
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+
+
+def _title_bar(title: str, width: int, height: int) -> np.ndarray:
+    bar = np.full((height, width, 3), _WHITE, dtype=np.uint8)
+    scale = height / 45.0
+    thickness = max(1, round(scale * 2))
+    (text_w, text_h), _ = cv2.getTextSize(title, _FONT, scale, thickness)
+    origin = ((width - text_w) // 2, (height + text_h) // 2)
+    cv2.putText(bar, title, origin, _FONT, scale, _BLACK, thickness, cv2.LINE_AA)
+    return bar
+
+
+def _info_panel(lines, width: int, panel_size: int) -> np.ndarray:
+    scale = panel_size / 320.0
+    thickness = max(1, round(scale))
+    line_height = int(cv2.getTextSize("Ag", _MONO_FONT, scale, thickness)[0][1] * 1.9)
+    margin = line_height // 2
+    box_w = max(cv2.getTextSize(line, _MONO_FONT, scale, thickness)[0][0] for line in lines) + 2 * margin
+    box_h = line_height * len(lines) + 2 * margin
+
+    panel = np.full((box_h + 2 * margin, width, 3), _WHITE, dtype=np.uint8)
+    x0 = max((width - box_w) // 2, 0)
+    y0 = margin
+    cv2.rectangle(panel, (x0, y0), (x0 + box_w, y0 + box_h), _WHEAT, -1)
+    cv2.rectangle(panel, (x0, y0), (x0 + box_w, y0 + box_h), (120, 160, 190), 1, cv2.LINE_AA)
+    for i, line in enumerate(lines):
+        baseline = y0 + margin + line_height * (i + 1) - line_height // 4
+        cv2.putText(panel, line, (x0 + margin, baseline), _MONO_FONT, scale, _BLACK, thickness, cv2.LINE_AA)
+    return panel
+
+
+def render_diagnosis(image_bgr: np.ndarray, heatmap: Optional[np.ndarray],
+                     bbox: Optional[Tuple[int, int, int, int]], diagnostic_report: Dict[str, Any],
+                     bbox_space: Tuple[int, int] = (224, 224), panel_size: int = None) -> np.ndarray:
+    """
+    Compose the three-panel diagnosis image (original, Grad-CAM overlay,
+    suspicious region) with the diagnostic summary underneath
+
+    Args:
+        image_bgr: Original image as loaded by cv2.imread
+        heatmap: Grad-CAM heatmap in [0, 1] at any resolution
+        bbox: Bounding box (x, y, w, h) in bbox_space coordinates
+        diagnostic_report: Diagnostic report dictionary
+        bbox_space: (width, height) of the space the bbox was computed in
+        panel_size: Side of each panel in pixels (default: VIZ_PANEL_SIZE)
+
+    Returns:
+        BGR uint8 image
+    """
+    panel_size = panel_size or VIZ_PANEL_SIZE
+    base = cv2.resize(image_bgr, (panel_size, panel_size), interpolation=cv2.INTER_AREA)
+
+    # Painel 2: mapa de atenção com colormap jet e alpha 0.5
+    overlay = base.copy()
+    if heatmap is not None:
+        heatmap_u8 = np.clip(heatmap * 255.0, 0, 255).astype(np.uint8)
+        heatmap_u8 = cv2.resize(heatmap_u8, (panel_size, panel_size), interpolation=cv2.INTER_LINEAR)
+        colored = cv2.applyColorMap(heatmap_u8, cv2.COLORMAP_JET)
+        cv2.addWeighted(base, 0.5, colored, 0.5, 0, dst=overlay)
+
+    # Painel 3: região suspeita com retângulo e mira no centro
+    region = base.copy()
+    if bbox is not None:
+        x, y, w, h = bbox
+        sx = panel_size / bbox_space[0]
+        sy = panel_size / bbox_space[1]
+        thickness = max(2, panel_size // 112)
+        top_left = (int(round(x * sx)), int(round(y * sy)))
+        bottom_right = (int(round((x + w) * sx)), int(round((y + h) * sy)))
+        cv2.rectangle(region, top_left, bottom_right, _RED, thickness, cv2.LINE_AA)
+        center = (int(round((x + w // 2) * sx)), int(round((y + h // 2) * sy)))
+        cv2.drawMarker(region, center, _RED, cv2.MARKER_CROSS, max(10, panel_size // 11), thickness, cv2.LINE_AA)
+
+    gap = max(4, panel_size // 32)
+    spacer = np.full((panel_size, gap, 3), _WHITE, dtype=np.uint8)
+    panels = np.hstack([base, spacer, overlay, spacer, region])
+    width = panels.shape[1]
+
+    title_height = max(24, panel_size // 10)
+    titles = np.hstack([
+        _title_bar("Original Image", panel_size, title_height),
+        np.full((title_height, gap, 3), _WHITE, dtype=np.uint8),
+        _title_bar("Attention Map (Grad-CAM)", panel_size, title_height),
+        np.full((title_height, gap, 3), _WHITE, dtype=np.uint8),
+        _title_bar("Suspicious Region", panel_size, title_height),
+    ])
+
+    lines = [_ascii(line) for line in (
+        f"DIAGNOSIS: {diagnostic_report['primary_diagnosis']}",
+        f"Risk Level: {diagnostic_report['risk_level']}",
+        f"Malignancy: {diagnostic_report['malignancy_probability']}",
+        diagnostic_report['birads_equivalent'],
+        diagnostic_report['recommendation'],
+    )]
+    info = _info_panel(lines, width, panel_size)
+
+    return np.vstack([titles, panels, info])
+
+
+def encode_image(image_bgr: np.ndarray, fmt: str = None, quality: int = None) -> bytes:
+    """Encode a BGR image as jpg, png or webp"""
+    fmt = (fmt or VIZ_FORMAT).lower()
+    if fmt not in SUPPORTED_FORMATS:
+        raise ValueError(f"Formato de visualização não suportado: {fmt}")
+    quality = quality or VIZ_QUALITY
+    params = {
+        "jpg": [cv2.IMWRITE_JPEG_QUALITY, quality],
+        "png": [cv2.IMWRITE_PNG_COMPRESSION, 3],
+        "webp": [cv2.IMWRITE_WEBP_QUALITY, quality],
+    }[fmt]
+    ok, buffer = cv2.imencode(f".{fmt}", image_bgr, params)
+    if not ok:
+        raise RuntimeError(f"Falha ao codificar visualização como {fmt}")
+    return buffer.tobytes()
+
+
+def encode_heatmap(heatmap: Optional[np.ndarray], dtype: str = "float16") -> Optional[Dict[str, Any]]:
+    """Serialize the raw Grad-CAM heatmap (e.g. 7x7) as base64 (float16 by default)"""
+    if heatmap is None:
+        return None
+    data = np.ascontiguousarray(heatmap, dtype=dtype)
+    return {
+        "shape": list(data.shape),
+        "dtype": dtype,
+        "data": base64.b64encode(data.tobytes()).decode("ascii"),
+    }
+
+
+def decode_heatmap(encoded: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+    if not encoded:
+        return None
+    data = np.frombuffer(base64.b64decode(encoded["data"]), dtype=encoded.get("dtype", "float16"))
+    return data.reshape(encoded["shape"]).astype(np.float32)
+
+
+def build_state(heatmap: Optional[np.ndarray], bbox: Optional[Tuple[int, int, int, int]],
+                target_size: Tuple[int, int], diagnostic_report: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Everything needed to render the visualization later, small enough to be
+    stored with the analysis
+
+    Args:
+        heatmap: Raw Grad-CAM heatmap at the last conv layer resolution
+        bbox: Bounding box (x, y, w, h) in target_size coordinates
+        target_size: (width, height) the bbox was computed in
+        diagnostic_report: Diagnostic report dictionary
+    """
+    return {
+        "heatmap": encode_heatmap(heatmap),
+        "bbox": [int(v) for v in bbox] if bbox is not None else None,
+        "target_size": list(target_size),
+        "diagnostic_report": diagnostic_report,
+    }
+
+
+def render_from_state(image_path: str, state: Dict[str, Any], fmt: str = None,
+                      panel_size: int = None) -> bytes:
+    """Render and encode the visualization described by build_state"""
+    img = cv2.imread(image_path)
+    if img is None:
+        raise ValueError(f"Não foi possível ler a imagem: {image_path}")
+
+    target_size = tuple(state["target_size"])
+    heatmap = decode_heatmap(state.get("heatmap"))
+    if heatmap is not None:
+        # Mesmo redimensionamento feito na predição antes de calcular a bbox
+        heatmap = cv2.resize(heatmap, target_size, interpolation=cv2.INTER_LINEAR)
+    bbox = tuple(state["bbox"]) if state.get("bbox") else None
+
+    canvas = render_diagnosis(img, heatmap, bbox, state["diagnostic_report"],
+                              bbox_space=target_size, panel_size=panel_size)
+    return encode_image(canvas, fmt)
+
+
+class VisualizationCache:
+    """
+    On-disk cache of rendered visualizations.
+
+    Entries are named ``{analysis_id}_{etag}.{fmt}``; the ETag is derived from
+    the stored state, the renderer version and the rendering options, so a new
+    analysis of the same image never serves a stale file.
+    """
+
+    def __init__(self, cache_dir: str = VIZ_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def etag(state: Dict[str, Any], fmt: str, panel_size: int) -> str:
+        payload = json.dumps(state, sort_keys=True, separators=(",", ":"))
+        digest = hashlib.md5(f"{RENDERER_VERSION}|{fmt}|{panel_size}|{payload}".encode()).hexdigest()
+        return digest[:20]
+
+    def path(self, analysis_id: int, etag: str, fmt: str) -> str:
+        return os.path.join(self.cache_dir, f"{analysis_id}_{etag}.{fmt}")
+
+    def get_or_render(self, analysis_id: int, image_path: str, state: Dict[str, Any],
+                      fmt: str, panel_size: int) -> Tuple[str, str]:
+        """
+        Return (path, etag) of the rendered visualization, rendering it only
+        if it is not cached yet
+        """
+        etag = self.etag(state, fmt, panel_size)
+        path = self.path(analysis_id, etag, fmt)
+        if os.path.exists(path):
+            return path, etag
+
+        data = render_from_state(image_path, state, fmt, panel_size)
+        # Escrita atômica: requisições concorrentes nunca leem um arquivo pela metade
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path, etag
+
+    def invalidate(self, analysis_id: int) -> int:
+        """Remove every cached rendering of an analysis"""
+        removed = 0
+        for path in glob.glob(os.path.join(self.cache_dir, f"{analysis_id}_*")):
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
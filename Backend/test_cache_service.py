@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Teste dos caches em disco do modelo treinado (services/cache_service.py)
+"""
+
+import json
+import os
+import tempfile
+
+import numpy as np
+
+
+def test_tensor_cache_lru_eviction_and_restart():
+    from services.cache_service import TensorCache
+
+    with tempfile.TemporaryDirectory() as workdir:
+        entry = np.zeros((224, 224), dtype=np.uint8)
+        entry_bytes = entry.nbytes + 128  # cabeçalho do .npy
+        cache = TensorCache(workdir, max_bytes=3 * entry_bytes, low_water=1.0)
+
+        for i in range(3):
+            cache.put(f"hash{i}", "v1", np.full_like(entry, i))
+        # Acessar hash0 o torna o mais recente; hash1 passa a ser o próximo removido
+        assert cache.get("hash0", "v1")[0, 0] == 0
+        cache.put("hash3", "v1", np.full_like(entry, 3))
+
+        assert cache.get("hash1", "v1") is None
+        assert cache.get("hash0", "v1") is not None
+        assert cache.get("hash0", "v2") is None  # outra versão do pré-processamento
+        stats = cache.get_stats()
+        assert stats["entries"] == 3 and stats["evictions"] == 1
+        assert stats["hits"] == 2 and stats["misses"] == 2
+
+        # O índice é reconstruído a partir do disco
+        reopened = TensorCache(workdir, max_bytes=3 * entry_bytes, low_water=1.0)
+        assert reopened.get_stats()["entries"] == 3
+        cached = reopened.get("hash3", "v1")
+        assert isinstance(cached, np.memmap) and cached.dtype == np.uint8 and cached[0, 0] == 3
+        assert sorted(os.listdir(workdir)) == ["hash0-v1.npy", "hash2-v1.npy", "hash3-v1.npy"]
+
+        # Outro worker (ou versão do modelo) no mesmo diretório: o limite vale para o diretório todo
+        other = TensorCache(workdir, max_bytes=3 * entry_bytes, low_water=1.0)
+        other.put("hash4", "v1", np.full_like(entry, 4))
+        reopened.put("hash5", "v1", np.full_like(entry, 5))
+        assert sorted(os.listdir(workdir)) == ["hash3-v1.npy", "hash4-v1.npy", "hash5-v1.npy"]
+        assert other.get_stats()["entries"] == 3 and reopened.get("hash4", "v1")[0, 0] == 4
+
+        # Acima do limite, remove até low_water dele: folga até a próxima varredura
+        roomy = TensorCache(workdir, max_bytes=4 * entry_bytes, low_water=0.5)
+        roomy.put("hash6", "v1", np.full_like(entry, 6))
+        roomy.put("hash7", "v1", np.full_like(entry, 7))
+        assert sorted(os.listdir(workdir)) == ["hash6-v1.npy", "hash7-v1.npy"]
+
+
+def test_result_cache_keys_and_model_invalidation():
+    from services.cache_service import ResultCache
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cache = ResultCache(workdir)
+        entry = {"probability": 0.73, "heatmap": None, "bbox": [10, 20, 30, 40]}
+        cache.put("model-a", "hash0", 0.5, entry)
+
+        assert cache.contains("model-a", "hash0", 0.5)
+        assert cache.get("model-a", "hash0", 0.5) == entry
+        assert cache.get("model-a", "hash0", 0.6) is None  # outro limiar
+        assert cache.get("model-b", "hash0", 0.5) is None  # outro modelo
+        stats = cache.get_stats()
+        assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 2, 0.333)
+
+        # Um novo checksum de modelo descarta os resultados dos anteriores
+        cache.put("model-b", "hash0", 0.5, entry)
+        assert cache.purge_stale("model-b") == 1
+        assert not cache.contains("model-a", "hash0", 0.5)
+        assert cache.contains("model-b", "hash0", 0.5)
+
+    # Tamanho total limitado: os resultados menos usados recentemente saem primeiro
+    with tempfile.TemporaryDirectory() as workdir:
+        entry_bytes = len(json.dumps(entry))
+        cache = ResultCache(workdir, max_bytes=3 * entry_bytes, low_water=1.0)
+        for i in range(3):
+            cache.put("model-a", f"hash{i}", 0.5, entry)
+        assert cache.get("model-a", "hash0", 0.5) == entry
+        cache.put("model-b", "hash3", 0.5, entry)
+        assert not cache.contains("model-a", "hash1", 0.5)
+        assert all(cache.contains(model, image_hash, 0.5)
+                   for model, image_hash in (("model-a", "hash0"), ("model-a", "hash2"), ("model-b", "hash3")))
+        stats = cache.get_stats()
+        assert stats["entries"] == 3 and stats["evictions"] == 1
+
+
+if __name__ == "__main__":
+    test_tensor_cache_lru_eviction_and_restart()
+    test_result_cache_keys_and_model_invalidation()
+    print("✅ Cache de tensores com LRU por tamanho")
+    print("✅ Cache de resultados por imagem, modelo e limiar, com LRU por tamanho")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Teste da conversão DICOM para 8 bits (services/dicom_processing.py)
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+
+def float64_windowing(pixel_array, window):
+    """Conversão original: corte e normalização em float64 no quadro inteiro"""
+    if window is not None:
+        pixel_array = np.clip(pixel_array, *window)
+    pixel_min = pixel_array.min()
+    pixel_max = pixel_array.max()
+    if pixel_max <= pixel_min:
+        return np.zeros(pixel_array.shape, dtype=np.uint8)
+    return ((pixel_array - pixel_min) / (pixel_max - pixel_min) * 255).astype(np.uint8)
+
+
+def test_lut_matches_float64_windowing():
+    from services.dicom_processing import to_uint8
+
+    rng = np.random.default_rng(0)
+    arrays = [
+        rng.integers(0, 4096, (300, 200)).astype(np.uint16),      # 12 bits armazenados
+        rng.integers(0, 65536, (300, 200)).astype(np.uint16),
+        rng.integers(-2000, 2000, (300, 200)).astype(np.int16),   # PixelRepresentation = 1
+        rng.integers(0, 256, (60, 40, 3)).astype(np.uint8),       # RGB
+        np.full((50, 50), 7, dtype=np.uint16),                    # imagem constante
+    ]
+    for pixel_array in arrays:
+        for window in (None, (1000.5, 3000.25), (-500.0, 500.0), (-10.0, -5.0)):
+            expected = float64_windowing(pixel_array, window)
+            assert np.array_equal(to_uint8(pixel_array, window), expected), (pixel_array.dtype, window)
+
+
+def test_decode_dicom_single_pass():
+    from services.synthetic import create_synthetic_dicom
+    from services.dicom_processing import decode_dicom, read_dicom
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = create_synthetic_dicom(os.path.join(workdir, "mg.dcm"), size=(400, 300), window=(2048.0, 3000.0))
+        pixels, metadata = decode_dicom(path)
+        assert pixels.dtype == np.uint8 and pixels.shape == (400, 300)
+        assert metadata["rows"] == 400 and metadata["columns"] == 300 and metadata["modality"] == "MG"
+
+        raw = read_dicom(path).pixel_array
+        assert np.array_equal(pixels, float64_windowing(raw, (548.0, 3548.0)))
+
+        with open(path, "rb") as f:
+            assert np.array_equal(decode_dicom(f.read())[0], pixels)
+
+    # Arquivo sem Transfer Syntax UID nem SamplesPerPixel
+    fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_mammography.dcm")
+    pixels, metadata = decode_dicom(fixture)
+    assert pixels.shape == (512, 512) and metadata["patient_id"] == "TEST001"
+
+
+def test_pixel_store_renders_new_windows():
+    import cv2
+    from services.dicom_processing import DicomPixelStore, render_window, to_uint8, window_from_center
+
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 4096, (400, 300)).astype(np.uint16)
+    with tempfile.TemporaryDirectory() as workdir:
+        store = DicomPixelStore(workdir)
+        assert store.load("hash") is None
+        store.save("hash", pixels)
+        stored = store.load("hash")
+        assert isinstance(stored, np.memmap) and stored.dtype == np.uint16
+        assert np.array_equal(stored, pixels) and os.listdir(workdir) == ["hash.npy"]
+
+        window = window_from_center(1800.0, 1200.0)
+        view = cv2.imdecode(np.frombuffer(render_window(stored, window), np.uint8), cv2.IMREAD_UNCHANGED)
+        assert view.shape == (400, 300)
+        assert np.abs(view.astype(np.int16) - to_uint8(pixels, window)).mean() < 8
+        preview = cv2.imdecode(np.frombuffer(render_window(stored, window, 200), np.uint8), cv2.IMREAD_UNCHANGED)
+        assert preview.shape == (200, 150)
+
+        del stored, view
+        assert store.invalidate("hash") and store.load("hash") is None
+        assert store.get_stats()["saves"] == 1
+
+
+if __name__ == "__main__":
+    test_lut_matches_float64_windowing()
+    test_decode_dicom_single_pass()
+    test_pixel_store_renders_new_windows()
+    print("✅ Tabela uint16 -> uint8 idêntica ao windowing em float64")
+    print("✅ DICOM decodificado uma única vez, inclusive sem Transfer Syntax UID")
+    print("✅ Pixels originais em .npy mapeado em memória e novas janelas sob demanda")
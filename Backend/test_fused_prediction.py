@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Teste de regressão da predição fundida (probabilidade + Grad-CAM em um único passo)
+Compara com o caminho antigo: model.predict seguido do Grad-CAM com sub-modelos reconstruídos
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from services.synthetic import create_synthetic_mammogram
+from test_support import trained_or_synthetic_model
+
+PROBABILITY_TOLERANCE = 1e-5
+HEATMAP_TOLERANCE = 1e-4
+# O XLA funde operações e pode reordenar somas em ponto flutuante
+XLA_TOLERANCE = 1e-4
+
+
+def test_fused_prediction_matches_separate_passes():
+    from predict import get_gradcam_heatmap as legacy_gradcam_heatmap
+    from services.model_service import ModelService
+
+    with tempfile.TemporaryDirectory() as workdir:
+        model_path = trained_or_synthetic_model(workdir)
+
+        service = ModelService(model_path, residency="resident", idle_timeout=0, batching=False)
+        images = [
+            service.preprocess_image(create_synthetic_mammogram(os.path.join(workdir, f"{seed}.png"), seed=seed))
+            for seed in range(3)
+        ]
+
+        with service._use_model() as model:
+            for img in images:
+                expected_proba = float(model.predict(img, verbose=0)[0][0])
+                expected_heatmap = legacy_gradcam_heatmap(model, img)
+
+                proba, heatmap = service.predict_with_heatmap_batch(img)[0]
+                assert abs(proba - expected_proba) <= PROBABILITY_TOLERANCE, (proba, expected_proba)
+                assert np.allclose(heatmap, expected_heatmap, atol=HEATMAP_TOLERANCE)
+
+            # Um lote com várias imagens deve dar o mesmo resultado que cada imagem isolada
+            batched = service.predict_with_heatmap_batch(np.concatenate(images))
+            for img, (proba, heatmap) in zip(images, batched):
+                single_proba, single_heatmap = service.predict_with_heatmap_batch(img)[0]
+                assert abs(proba - single_proba) <= PROBABILITY_TOLERANCE
+                assert np.allclose(heatmap, single_heatmap, atol=HEATMAP_TOLERANCE)
+
+        service.shutdown()
+
+
+def test_tta_batched_variants_match_individual_passes():
+    from services import visualization
+    from services.model_service import ModelService
+    from services.preprocessing import tta_variants
+
+    with tempfile.TemporaryDirectory() as workdir:
+        model_path = trained_or_synthetic_model(workdir)
+
+        service = ModelService(model_path, residency="resident", idle_timeout=0, batching=False)
+        image_path = create_synthetic_mammogram(os.path.join(workdir, "tta.png"), seed=7)
+        img = service.preprocess_image(image_path)
+
+        # Original e variantes no mesmo lote: um único passo pelo modelo
+        passes = []
+        for name in ("predict_with_heatmap_batch", "predict_proba_batch"):
+            method = getattr(service, name)
+            setattr(service, name, lambda batch, *args, _method=method: passes.append(len(batch)) or _method(batch, *args))
+        result = service.predict(image_path, generate_viz=False, tta=True)
+        assert passes == [4], passes
+        del service.predict_with_heatmap_batch, service.predict_proba_batch
+        tta = result["tta"]
+        assert tta["trigger"] == "request" and tta["variants"] == 3 and tta["extra_latency_ms"] > 0
+
+        # As variantes em um único lote dão o mesmo resultado que uma predição por variante
+        with service._use_model() as model:
+            expected = [float(model.predict(v[np.newaxis], verbose=0)[0][0]) for v in tta_variants(img)]
+        assert np.allclose(tta["variant_probabilities"], expected, atol=PROBABILITY_TOLERANCE)
+        assert abs(result["probability"] - np.mean([tta["base_probability"]] + expected)) <= PROBABILITY_TOLERANCE
+        # O heatmap continua o da imagem original
+        base_probability, base_heatmap = service.predict_with_heatmap_batch(img)[0]
+        assert abs(tta["base_probability"] - base_probability) <= PROBABILITY_TOLERANCE
+        assert np.allclose(visualization.decode_heatmap(result["visualization_state"]["heatmap"]),
+                           base_heatmap, atol=1e-2)
+
+        assert service.predict(image_path, generate_viz=False, tta=False)["tta"] is None
+        assert service.get_stats()["tta"]["runs"] == 1
+        service.shutdown()
+
+
+def test_compiled_predict_matches_model_predict():
+    from services.model_service import ModelService
+
+    with tempfile.TemporaryDirectory() as workdir:
+        model_path = trained_or_synthetic_model(workdir)
+
+        for jit_compile, tolerance in ((False, PROBABILITY_TOLERANCE), (True, XLA_TOLERANCE)):
+            service = ModelService(model_path, residency="resident", idle_timeout=0, batching=False,
+                                   jit_compile=jit_compile)
+            images = np.concatenate([
+                service.preprocess_image(create_synthetic_mammogram(os.path.join(workdir, f"{seed}.png"), seed=seed))
+                for seed in range(3)
+            ])
+            with service._use_model() as model:
+                expected = model.predict(images, verbose=0)[:, 0]
+                assert np.allclose(service.predict_proba_batch(images), expected, atol=tolerance)
+                assert np.allclose(service.predict_proba_batch(images[:1]), expected[:1], atol=tolerance)
+                # Grad-CAM compilado com a mesma opção dá a mesma probabilidade
+                probabilities = [p for p, _ in service.predict_with_heatmap_batch(images)]
+                assert np.allclose(probabilities, expected, atol=tolerance)
+            assert service.get_status()["jit_compile"] is jit_compile
+            service.shutdown()
+
+
+if __name__ == "__main__":
+    test_fused_prediction_matches_separate_passes()
+    test_tta_batched_variants_match_individual_passes()
+    test_compiled_predict_matches_model_predict()
+    print("✅ Predição fundida idêntica ao caminho com dois passos")
+    print("✅ TTA em lote idêntico às predições individuais das variantes")
+    print("✅ Forward pass compilado (com e sem XLA) idêntico ao model.predict")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Teste da fila de micro-batching (services/inference_batcher.py), com um batch_fn falso
+"""
+
+import threading
+
+import numpy as np
+
+
+def _image(value: int) -> np.ndarray:
+    return np.full((4, 4, 1), value, dtype=np.float32)
+
+
+def _first_pixels(batch: np.ndarray):
+    return [int(row[0, 0, 0]) for row in batch]
+
+
+def _infer_concurrently(batcher, values):
+    """Chama infer() de uma thread por valor, todas liberadas ao mesmo tempo"""
+    barrier = threading.Barrier(len(values))
+    results = {}
+    errors = {}
+
+    def call(value):
+        barrier.wait()
+        try:
+            results[value] = batcher.infer(_image(value), timeout=10)
+        except Exception as e:
+            errors[value] = e
+
+    threads = [threading.Thread(target=call, args=(value,)) for value in values]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_requests_coalesce_into_bounded_batches():
+    from services.inference_batcher import InferenceBatcher
+
+    batch_sizes = []
+
+    def batch_fn(batch):
+        batch_sizes.append(len(batch))
+        return _first_pixels(batch)
+
+    batcher = InferenceBatcher(batch_fn, max_batch_size=4, max_wait_ms=500)
+    try:
+        results, errors = _infer_concurrently(batcher, range(6))
+    finally:
+        batcher.close()
+
+    assert not errors
+    # Cada chamador recebe a sua própria linha do lote
+    assert results == {value: value for value in range(6)}
+    assert sum(batch_sizes) == 6 and len(batch_sizes) == 2 and max(batch_sizes) == 4
+    stats = batcher.get_stats()
+    assert stats["total_requests"] == 6 and stats["total_batches"] == 2
+
+
+def test_batch_errors_reach_every_caller():
+    from services.inference_batcher import InferenceBatcher
+
+    def failing(batch):
+        raise ValueError("falha no forward pass")
+
+    def short(batch):
+        return _first_pixels(batch)[:-1]
+
+    for batch_fn, error in ((failing, ValueError), (short, RuntimeError)):
+        batcher = InferenceBatcher(batch_fn, max_batch_size=3, max_wait_ms=500)
+        try:
+            results, errors = _infer_concurrently(batcher, range(3))
+        finally:
+            batcher.close()
+        assert not results
+        assert sorted(errors) == [0, 1, 2] and all(isinstance(e, error) for e in errors.values())
+
+
+def test_close_serves_queued_requests_then_rejects():
+    from services.inference_batcher import InferenceBatcher
+
+    release = threading.Event()
+
+    def batch_fn(batch):
+        release.wait(timeout=10)
+        return _first_pixels(batch)
+
+    batcher = InferenceBatcher(batch_fn, max_batch_size=1, max_wait_ms=0)
+    futures = [batcher.submit(_image(value)) for value in range(3)]
+
+    # close() espera o worker, que está preso no primeiro lote
+    closer = threading.Thread(target=batcher.close)
+    closer.start()
+    release.set()
+    closer.join(timeout=10)
+    assert not closer.is_alive()
+
+    assert [future.result(timeout=0) for future in futures] == [0, 1, 2]
+    try:
+        batcher.submit(_image(3))
+        raise AssertionError("submit() deveria falhar após close()")
+    except RuntimeError:
+        pass
+
+    # Um submit() que passou da primeira verificação antes de close() não reinicia o worker
+    from services.inference_batcher import _PendingRequest
+    try:
+        batcher._enqueue(_PendingRequest(_image(4)))
+        raise AssertionError("_enqueue() deveria falhar após close()")
+    except RuntimeError:
+        pass
+    assert batcher._thread is None
+
+
+if __name__ == "__main__":
+    test_concurrent_requests_coalesce_into_bounded_batches()
+    print("✅ Pedidos concorrentes agrupados em lotes de até max_batch_size, uma linha por chamador")
+    test_batch_errors_reach_every_caller()
+    print("✅ Erros do batch_fn e número errado de resultados chegam a todos os pedidos do lote")
+    test_close_serves_queued_requests_then_rejects()
+    print("✅ close() atende a fila e recusa novos pedidos sem reiniciar o worker")
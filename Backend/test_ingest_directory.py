@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Teste da ingestão em massa de um diretório (ingest_directory.py)
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def create_database(path: str):
+    """Tabela analyses com as colunas usadas pela ingestão (criada pelo app.py em produção)"""
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE analyses (id INTEGER PRIMARY KEY, filename VARCHAR(255) NOT NULL, "
+            "original_filename VARCHAR(255) NOT NULL, file_path VARCHAR(500) NOT NULL, file_size INTEGER NOT NULL, "
+            "upload_date DATETIME, gemini_analysis TEXT, processing_status VARCHAR(50), processing_date DATETIME, "
+            "error_message TEXT, info TEXT, image_hash VARCHAR(32), model_result TEXT, model_version VARCHAR(64), "
+            "confidence_score FLOAT, is_processed BOOLEAN)"
+        )
+
+
+def test_ingest_directory_is_resumable_and_deduplicated():
+    from services.synthetic import create_synthetic_mammogram
+    from ingest_directory import ingest_directory
+    from services.ingest_service import md5_file
+
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, "mias")
+        os.makedirs(os.path.join(source, "lote2"))
+        images = [create_synthetic_mammogram(os.path.join(source, f"mdb00{i}.png"), size=(300, 200), seed=i)
+                  for i in range(3)]
+        shutil.copyfile(images[0], os.path.join(source, "lote2", "copia.png"))
+        shutil.copyfile(os.path.join(BACKEND_DIR, "test_mammography.dcm"), os.path.join(source, "lote2", "a.dcm"))
+        with open(os.path.join(source, "Info.txt"), "w") as f:
+            f.write("metadados")
+        with open(os.path.join(source, "corrompida.jpg"), "wb") as f:
+            f.write(b"nao e uma imagem")
+        # Listado pelo os.walk, mas ilegível: conta como falha sem interromper a execução
+        os.symlink(os.path.join(workdir, "removida.png"), os.path.join(source, "quebrada.png"))
+        db_path = os.path.join(workdir, "analises.db")
+        upload_dir = os.path.join(workdir, "uploads")
+        create_database(db_path)
+
+        # Execução "interrompida": só parte do diretório foi gravada no banco,
+        # mas o arquivo de uma imagem ainda não cadastrada já está em uploads/
+        partial = os.path.join(workdir, "parcial")
+        os.makedirs(partial)
+        shutil.copyfile(images[1], os.path.join(partial, "mdb001.png"))
+        ingest_directory(partial, db_path, upload_dir, workers=2, log=lambda message: None)
+        os.makedirs(upload_dir, exist_ok=True)
+        shutil.copyfile(images[2], os.path.join(upload_dir, f"ingest-{md5_file(images[2])}.png"))
+
+        stats = ingest_directory(source, db_path, upload_dir, workers=2, batch_size=2,
+                                 store_dicom_pixels=False, log=lambda message: None)
+        assert stats["found"] == 7 and stats["already_ingested"] == 1 and stats["duplicates"] == 1
+        assert stats["inserted"] == 3 and stats["failed"] == 2
+
+        with sqlite3.connect(db_path) as conn:
+            rows = conn.execute("SELECT original_filename, file_path, image_hash, info FROM analyses").fetchall()
+        assert len(rows) == 4 and len({row[2] for row in rows}) == 4
+        for name, file_path, image_hash, info in rows:
+            assert os.path.exists(file_path) and info
+            if name.endswith(".png"):
+                # Hardlink: o mesmo arquivo, sem recodificação
+                assert os.path.samefile(file_path, os.path.join(partial if name == "mdb001.png" else source, name))
+            else:
+                assert name == os.path.join("lote2", "a.dcm") and file_path.endswith(".jpg")
+        assert not [f for f in os.listdir(upload_dir) if f.endswith(".part")]
+
+        # Nova execução: nada a fazer (a cópia também já está cadastrada)
+        stats = ingest_directory(source, db_path, upload_dir, workers=2, log=lambda message: None)
+        assert stats["inserted"] == 0 and stats["already_ingested"] == 5 and stats["failed"] == 2
+
+
+if __name__ == "__main__":
+    test_ingest_directory_is_resumable_and_deduplicated()
+    print("✅ Diretório cadastrado em lotes, sem duplicatas e retomável")
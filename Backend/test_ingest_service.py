@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Teste da ingestão de uploads em blocos (services/ingest_service.py)
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+
+from fastapi import UploadFile
+
+
+def make_upload(data: bytes, declare_size: bool) -> UploadFile:
+    return UploadFile(io.BytesIO(data), size=len(data) if declare_size else None, filename="imagem.png")
+
+
+def test_spool_upload_hashes_in_chunks_and_enforces_limit():
+    from services.ingest_service import UploadTooLarge, spool_stream, spool_upload
+
+    data = os.urandom(5 * 1024 * 1024 + 123)
+    with tempfile.TemporaryDirectory() as workdir:
+        upload = asyncio.run(spool_upload(make_upload(data, True), workdir, len(data), chunk_size=64 * 1024))
+        assert upload.size == len(data) and upload.md5 == hashlib.md5(data).hexdigest()
+        destination = upload.commit(os.path.join(workdir, "final.png"))
+        with open(destination, "rb") as f:
+            assert f.read() == data
+        assert os.listdir(workdir) == ["final.png"]
+
+        # Tamanho declarado acima do limite: recusado sem ler o conteúdo
+        source = make_upload(data, True)
+        try:
+            asyncio.run(spool_upload(source, workdir, len(data) - 1))
+            assert False, "upload acima do limite deveria falhar"
+        except UploadTooLarge:
+            pass
+        assert source.file.tell() == 0
+
+        # Tamanho desconhecido: interrompido no primeiro bloco além do limite
+        source = make_upload(data, False)
+        try:
+            asyncio.run(spool_upload(source, workdir, 1024 * 1024, chunk_size=64 * 1024))
+            assert False, "upload acima do limite deveria falhar"
+        except UploadTooLarge:
+            pass
+        assert source.file.tell() <= 1024 * 1024 + 64 * 1024
+        assert os.listdir(workdir) == ["final.png"]
+
+        # spool_stream (membros de ZIP/TAR) segue o mesmo limite e a mesma limpeza
+        stream = io.BytesIO(data)
+        try:
+            spool_stream(stream, workdir, 1024 * 1024, chunk_size=64 * 1024)
+            assert False, "membro acima do limite deveria falhar"
+        except UploadTooLarge:
+            pass
+        assert stream.tell() <= 1024 * 1024 + 64 * 1024
+        assert os.listdir(workdir) == ["final.png"]
+        with spool_stream(io.BytesIO(data), workdir, len(data)) as streamed:
+            assert streamed.size == len(data) and streamed.md5 == hashlib.md5(data).hexdigest()
+        assert os.listdir(workdir) == ["final.png"]
+
+        # Upload não confirmado é removido
+        with asyncio.run(spool_upload(make_upload(b"abc", False), workdir, 1024)) as discarded:
+            assert os.path.exists(discarded.path)
+        assert os.listdir(workdir) == ["final.png"]
+
+
+def test_ingest_stats_by_outcome():
+    from services.ingest_service import IngestStats
+
+    stats = IngestStats(max_samples=2)
+    for elapsed in (0.004, 0.002, 0.003):
+        stats.record("dedup_hit", elapsed)
+    stats.record("decoded", 0.080)
+    summary = stats.get_stats()
+    assert summary["dedup_hit"]["count"] == 3 and summary["dedup_hit"]["p50_ms"] == 2.5
+    assert summary["info_reused"] == {"count": 0, "p50_ms": None, "p99_ms": None}
+    assert summary["dedup_hit_rate"] == 0.75
+
+
+def test_header_validation_and_lazy_derivative():
+    from concurrent.futures import ThreadPoolExecutor
+    from PIL import Image
+    from services.synthetic import create_synthetic_mammogram
+    from services.derivatives import DerivativeCache
+    from services.ingest_service import InvalidImage, validate_image
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = create_synthetic_mammogram(os.path.join(workdir, "grande.png"), size=(3000, 2400))
+        info = validate_image(path, "grande.png")
+        assert info["original_dimensions"] == (2400, 3000) and info["dimensions"] == (1638, 2048)
+        assert info["was_resized"] and info["format"] == "PNG"
+
+        # Arquivo truncado: o cabeçalho é válido, só a decodificação detecta
+        truncated = os.path.join(workdir, "truncada.png")
+        with open(path, "rb") as src, open(truncated, "wb") as dst:
+            dst.write(src.read()[: os.path.getsize(path) // 2])
+        assert validate_image(truncated, "truncada.png", "header")["original_dimensions"] == (2400, 3000)
+        try:
+            validate_image(truncated, "truncada.png", "decode")
+            assert False, "arquivo truncado deveria falhar na decodificação"
+        except InvalidImage:
+            pass
+        try:
+            validate_image(create_synthetic_mammogram(os.path.join(workdir, "p.png"), size=(80, 60)), "p.png")
+            assert False, "imagem pequena deveria falhar"
+        except InvalidImage:
+            pass
+
+        # Imagem otimizada: gerada uma vez (segundo plano + requisição) com as dimensões do info
+        cache = DerivativeCache(os.path.join(workdir, "derivatives"))
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            assert cache.prefetch(executor, "hash", path)
+            derivative = cache.get_or_render("hash", path)
+        with Image.open(derivative) as image:
+            assert image.size == info["dimensions"] and image.mode == "RGB"
+        assert not cache.prefetch(executor, "hash", path)
+        assert cache.get_stats()["renders"] == 1
+        assert cache.invalidate("hash") == 1 and not os.path.exists(derivative)
+
+
+def test_expand_archive_streams_images_only():
+    import tarfile
+    import zipfile
+    from services.ingest_service import BatchLimitExceeded, SpooledUpload, expand_archive
+
+    images = {f"mias/mdb00{i}.pgm": os.urandom(2048 + i) for i in range(3)}
+    with tempfile.TemporaryDirectory() as workdir:
+        zip_path = os.path.join(workdir, "mias.zip")
+        with zipfile.ZipFile(zip_path, "w") as archive:
+            for name, data in images.items():
+                archive.writestr(name, data)
+            archive.writestr("mias/Info.txt", b"metadados")
+            archive.writestr("__MACOSX/mias/._mdb001.pgm", b"x")
+            archive.writestr("mias/grande.png", b"\0" * (11 * 1024 * 1024))
+        entries = expand_archive(zip_path, "mias.zip", workdir)
+        assert [name for name, _ in entries] == list(images) + ["mias/grande.png"]
+        for name, entry in entries[:3]:
+            assert isinstance(entry, SpooledUpload) and entry.md5 == hashlib.md5(images[name]).hexdigest()
+            entry.discard()
+        assert "muito grande" in entries[3][1]
+
+        tar_path = os.path.join(workdir, "mias.tar.gz")
+        with tarfile.open(tar_path, "w:gz") as archive:
+            for name, data in images.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        entries = expand_archive(tar_path, "mias.tar.gz", workdir, max_files=3)
+        assert [entry.size for _, entry in entries] == [len(data) for data in images.values()]
+        for _, entry in entries:
+            entry.discard()
+        try:
+            expand_archive(tar_path, "mias.tar.gz", workdir, max_files=2)
+            assert False, "limite de imagens ignorado"
+        except BatchLimitExceeded:
+            pass
+        # Nada extraído fica para trás quando o lote é recusado
+        assert not [f for f in os.listdir(workdir) if f.endswith(".part")]
+
+
+if __name__ == "__main__":
+    test_spool_upload_hashes_in_chunks_and_enforces_limit()
+    test_ingest_stats_by_outcome()
+    test_header_validation_and_lazy_derivative()
+    test_expand_archive_streams_images_only()
+    print("✅ Upload copiado em blocos com hash incremental e limite de tamanho")
+    print("✅ Latência da ingestão por resultado (deduplicação, reutilização, decodificação)")
+    print("✅ Validação pelo cabeçalho e imagem otimizada gerada sob demanda")
+    print("✅ Imagens extraídas de ZIP/TAR em blocos, com limites por arquivo e por lote")
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Teste da fila de jobs de análise (services/job_service.py)
+"""
+
+import asyncio
+
+
+def test_submit_deduplicates_by_options():
+    from services.job_service import JobManager
+
+    async def scenario():
+        manager = JobManager(workers=1)
+        await manager.start()
+        release = asyncio.Event()
+
+        async def handler(job):
+            await release.wait()
+            return {"tta": job.options.get("tta")}
+
+        try:
+            plain = manager.submit("trained", 1, handler, {"tta": False})
+            assert manager.submit("trained", 1, handler, {"tta": False}) is plain
+            # tta=true não se anexa ao job sem TTA em andamento
+            augmented = manager.submit("trained", 1, handler, {"tta": True})
+            assert augmented is not plain
+            release.set()
+            for job in (plain, augmented):
+                async for event in job.subscribe():
+                    if event and event["status"] == "completed":
+                        break
+            assert plain.result == {"tta": False} and augmented.result == {"tta": True}
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    test_submit_deduplicates_by_options()
+    print("✅ Jobs em andamento deduplicados por análise, tipo e opções (tta)")
@@ -44,8 +44,11 @@ def test_model_lazy_loading():
     print("="*70)
     print(f"✅ Modelo NÃO é carregado no __init__ (economiza memória)")
     print(f"✅ Modelo é carregado sob demanda quando predict() é chamado")
-    print(f"✅ Modelo é descarregado automaticamente após cada predição")
-    print(f"✅ Memória é liberada com garbage collection")
+    if model_service.residency == "on_demand":
+        print(f"✅ Modelo é descarregado automaticamente após cada predição")
+        print(f"✅ Memória é liberada com garbage collection")
+    else:
+        print(f"✅ Modelo permanece residente (descarga após {model_service.idle_timeout:.0f}s ociosos)")
     print("="*70)
 
 if __name__ == "__main__":
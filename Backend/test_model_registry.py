@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Teste do registro de versões do modelo treinado (services/model_registry.py)
+Troca de versão em segundo plano com uma análise em andamento na versão anterior
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from services.synthetic import create_synthetic_mammogram
+from test_support import trained_or_synthetic_model
+
+SWAP_TIMEOUT_S = 300
+
+
+def wait_for(condition, timeout: float = SWAP_TIMEOUT_S):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timeout"
+        time.sleep(0.1)
+
+
+def test_hot_swap_waits_for_leases():
+    import numpy as np
+    from tensorflow import keras
+    from services.model_registry import ModelRegistry
+
+    with tempfile.TemporaryDirectory() as workdir:
+        models_dir = os.path.join(workdir, "models")
+        os.makedirs(models_dir)
+        source = trained_or_synthetic_model(workdir)
+        for version in ("v1", "v2"):
+            shutil.copy(source, os.path.join(models_dir, f"{version}.keras"))
+
+        registry = ModelRegistry(models_dir, initial_version="v1")
+        image_path = create_synthetic_mammogram(os.path.join(workdir, "image.png"))
+        assert {"default", "v1", "v2"} <= {v["version"] for v in registry.list_versions()}
+
+        with registry.lease() as old_service:
+            assert old_service.version == "v1"
+            assert old_service.predict(image_path, generate_viz=False)["success"]
+            img = old_service.preprocess_image(image_path)
+            (expected_proba, expected_heatmap), = old_service.predict_with_heatmap_batch(img)
+
+            assert registry.activate("v2")["status"] == "loading"
+            wait_for(lambda: registry.active_version == "v2")
+
+            # A análise em andamento continua com a versão que pegou no início
+            assert old_service.is_loaded() or old_service.residency == "on_demand"
+            assert old_service.predict(image_path, generate_viz=False)["success"]
+            uid = keras.backend.get_uid("registry-test")
+
+        # Sem leases, a versão anterior é descarregada sem zerar o estado global
+        # do Keras (clear_session) sob a nova versão, que continua servindo
+        wait_for(lambda: not old_service.is_loaded())
+        assert keras.backend.get_uid("registry-test") == uid + 1, "clear_session com outro modelo carregado"
+        with registry.lease() as new_service:
+            assert new_service.version == "v2"
+            assert new_service.predict(image_path, generate_viz=False)["success"]
+            (proba, heatmap), = new_service.predict_with_heatmap_batch(img)
+            assert abs(proba - expected_proba) <= 1e-5 and np.allclose(heatmap, expected_heatmap, atol=1e-4)
+
+        assert registry.activate("v2")["status"] == "active"
+        try:
+            registry.activate("missing")
+            assert False, "versão inexistente deveria falhar"
+        except KeyError:
+            pass
+        registry.shutdown()
+
+
+if __name__ == "__main__":
+    test_hot_swap_waits_for_leases()
+    print("✅ Troca de versão do modelo sem interromper análises em andamento")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Teste do servidor de modelo fora do processo (model_server.py + services/model_server.py)
+Workers sem TensorFlow enviam tensores por memória compartilhada e recebem o mesmo resultado
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from services.synthetic import create_synthetic_mammogram
+from test_support import trained_or_synthetic_model
+
+PROBABILITY_TOLERANCE = 1e-5
+HEATMAP_TOLERANCE = 1e-4
+STARTUP_TIMEOUT_S = 300
+
+
+def start_server(socket_path: str, workdir: str) -> subprocess.Popen:
+    env = dict(os.environ, MODEL_SERVER_SOCKET=socket_path, MODELS_DIR=os.path.join(workdir, "models"))
+    process = subprocess.Popen([sys.executable, "model_server.py", "--no-warmup"], env=env,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = time.monotonic() + STARTUP_TIMEOUT_S
+    while not os.path.exists(socket_path):
+        assert process.poll() is None, "servidor de modelo encerrou ao iniciar"
+        assert time.monotonic() < deadline, "timeout ao iniciar o servidor de modelo"
+        time.sleep(0.2)
+    return process
+
+
+def shared_segments() -> set:
+    return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")} if os.path.isdir("/dev/shm") else set()
+
+
+def test_worker_does_not_import_tensorflow():
+    env = dict(os.environ, MODEL_SERVER_SOCKET="/tmp/unused-model.sock")
+    env.pop("MODEL_SERVER_ROLE", None)
+    output = subprocess.run(
+        [sys.executable, "-c", "import sys, services.model_service; print('tensorflow' in sys.modules)"],
+        env=env, cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+    ).stdout
+    assert output.strip().splitlines()[-1] == "False", output
+
+
+def test_remote_inference_matches_in_process():
+    from services.model_service import ModelService
+
+    with tempfile.TemporaryDirectory() as workdir:
+        model_path = trained_or_synthetic_model(workdir)
+
+        segments_before = shared_segments()
+        socket_path = os.path.join(workdir, "model.sock")
+        server = start_server(socket_path, workdir)
+        try:
+            local = ModelService(model_path, residency="resident", idle_timeout=0, batching=False, server_socket="")
+            remote = ModelService(model_path, residency="resident", idle_timeout=0, batching=False,
+                                  server_socket=socket_path)
+            images = [
+                local.preprocess_image(create_synthetic_mammogram(os.path.join(workdir, f"{seed}.png"), seed=seed))
+                for seed in range(3)
+            ]
+            batch = np.concatenate(images)
+
+            expected = local.predict_with_heatmap_batch(batch)
+            for (proba, heatmap), (expected_proba, expected_heatmap) in zip(
+                    remote.predict_with_heatmap_batch(batch), expected):
+                assert abs(proba - expected_proba) <= PROBABILITY_TOLERANCE
+                assert np.allclose(heatmap, expected_heatmap, atol=HEATMAP_TOLERANCE)
+            assert np.allclose(remote.predict_proba_batch(batch), [p for p, _ in expected], atol=PROBABILITY_TOLERANCE)
+
+            # Imagens isoladas de várias threads passam pelo micro-batching do servidor
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                results = list(pool.map(lambda img: remote.predict_with_heatmap_batch(img)[0], images * 2))
+            for (proba, _), (expected_proba, _) in zip(results, expected * 2):
+                assert abs(proba - expected_proba) <= PROBABILITY_TOLERANCE
+
+            stats = remote.get_stats()
+            assert stats["model_server"] == socket_path
+            assert stats["model_server_stats"]["pid"] == server.pid
+            assert remote.predict(os.path.join(workdir, "0.png"), generate_viz=False)["success"]
+
+            remote.shutdown()
+            local.shutdown()
+            assert shared_segments() <= segments_before, "segmentos de memória compartilhada não liberados"
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+        assert not os.path.exists(socket_path)
+
+
+if __name__ == "__main__":
+    test_worker_does_not_import_tensorflow()
+    test_remote_inference_matches_in_process()
+    print("✅ Workers da API sem TensorFlow")
+    print("✅ Inferência no servidor de modelo idêntica à inferência no processo")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Teste do pré-processamento do modelo treinado (services/preprocessing.py)
+Compara com o pipeline original em RGB de predict.py e verifica a concordância
+do recorte da segmentação em resolução reduzida
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from services.synthetic import create_synthetic_mammogram
+
+# Concordância mínima entre a caixa do modo "downscale" e a da resolução original
+CROP_IOU_TOLERANCE = 0.98
+# Deslocamento máximo de cada lado, como fração da largura/altura da imagem
+CROP_EDGE_TOLERANCE = 0.01
+
+
+def test_batch_preprocessing_matches_legacy_pipeline():
+    from predict import preprocess_image as legacy_preprocess_image
+    from services.preprocessing import preprocess_batch, preprocess_image
+
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = [
+            create_synthetic_mammogram(os.path.join(workdir, f"{seed}.png"), size=(600 + 40 * seed, 450), seed=seed)
+            for seed in range(4)
+        ]
+        expected = np.concatenate([legacy_preprocess_image(path, segmentation="full") for path in paths])
+
+        for i, path in enumerate(paths):
+            assert np.array_equal(preprocess_image(path, segmentation="full"), expected[i:i + 1])
+
+        batch = preprocess_batch(paths, workers=3, segmentation="full")
+        assert batch.shape == (4, 224, 224, 3) and batch.dtype == np.float32
+        assert np.array_equal(batch, expected)
+
+        # Buffers codificados produzem o mesmo tensor que os arquivos
+        buffers = [open(path, "rb").read() for path in paths]
+        assert np.array_equal(preprocess_batch(buffers, segmentation="full"), expected)
+
+
+def test_downscale_segmentation_crop_agreement():
+    import cv2
+    from services.preprocessing import bbox_iou, find_tissue_bbox, preprocess_image
+
+    with tempfile.TemporaryDirectory() as workdir:
+        images = [
+            cv2.imread(create_synthetic_mammogram(os.path.join(workdir, f"{i}.png"), size=size, seed=i),
+                       cv2.IMREAD_GRAYSCALE)
+            for i, size in enumerate([(1200, 900), (3000, 2400), (6000, 4500), (4000, 7000)])
+        ]
+        # Mama afastada das bordas, para que todos os lados da caixa sejam comparados
+        centered = np.zeros((5000, 4000), dtype=np.uint8)
+        cv2.ellipse(centered, (1700, 2600), (1100, 1600), 15, 0, 360, 160, -1)
+        images.append(centered)
+
+        for gray in images:
+            full = find_tissue_bbox(gray, "full")
+            downscaled = find_tissue_bbox(gray, "downscale", proxy_size=1024)
+            height, width = gray.shape
+            assert bbox_iou(full, downscaled) >= CROP_IOU_TOLERANCE, (gray.shape, full, downscaled)
+            for edge_full, edge_down, extent in zip(full, downscaled, (width, height, width, height)):
+                assert abs(edge_full - edge_down) <= CROP_EDGE_TOLERANCE * extent, (gray.shape, full, downscaled)
+
+        # Imagens menores que o proxy seguem o caminho original
+        small = images[0][:800, :600]
+        assert find_tissue_bbox(small, "downscale", proxy_size=1024) == find_tissue_bbox(small, "full")
+
+        path = os.path.join(workdir, "centered.png")
+        cv2.imwrite(path, centered)
+        assert preprocess_image(path, segmentation="downscale").shape == (1, 224, 224, 3)
+
+        # Mesma decodificação do treino (cor + BGR2GRAY) em imagens coloridas:
+        # com a mesma caixa, o modo "downscale" produz a mesma entrada
+        from predict import preprocess_image as legacy_preprocess_image
+        rng = np.random.default_rng(0)
+        color = cv2.cvtColor(images[0][:800, :600], cv2.COLOR_GRAY2BGR)
+        color = np.clip(color.astype(np.int16) + rng.integers(-40, 40, color.shape), 0, 255).astype(np.uint8)
+        for name in ("color.png", "color.jpg"):
+            path = os.path.join(workdir, name)
+            cv2.imwrite(path, color)
+            assert np.array_equal(preprocess_image(path, segmentation="downscale"),
+                                  legacy_preprocess_image(path, segmentation="full"))
+
+
+if __name__ == "__main__":
+    test_batch_preprocessing_matches_legacy_pipeline()
+    test_downscale_segmentation_crop_agreement()
+    print("✅ Pré-processamento em lote idêntico ao pipeline original")
+    print("✅ Segmentação reduzida concorda com a resolução original")
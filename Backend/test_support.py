@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Modelos sintéticos compartilhados pelos testes do modelo treinado
+"""
+
+import os
+
+
+def build_synthetic_model(path: str) -> str:
+    """Salva um modelo com a arquitetura do modelo treinado e pesos aleatórios"""
+    from tensorflow import keras
+
+    keras.utils.set_random_seed(0)
+    base = keras.applications.EfficientNetV2B0(include_top=False, weights=None, input_shape=(224, 224, 3))
+    inputs = keras.Input((224, 224, 3))
+    x = base(inputs)
+    x = keras.layers.GlobalAveragePooling2D()(x)
+    x = keras.layers.Dropout(0.3)(x)
+    outputs = keras.layers.Dense(1, activation="sigmoid")(x)
+    keras.Model(inputs, outputs).save(path)
+    return path
+
+
+def trained_or_synthetic_model(workdir: str) -> str:
+    """Caminho do .keras treinado ou, se ele não existir, de um modelo sintético criado em workdir"""
+    from services.model_service import DEFAULT_MODEL_PATH
+
+    if os.path.exists(DEFAULT_MODEL_PATH):
+        return DEFAULT_MODEL_PATH
+    print("⚠️ Modelo treinado não encontrado, usando modelo sintético")
+    return build_synthetic_model(os.path.join(workdir, "synthetic.keras"))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Teste do backend TFLite (convert_model.py + services/tflite_backend.py)
+Converte o modelo com quantização dinâmica e mede o desvio contra o modelo Keras
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from services.synthetic import create_synthetic_mammogram
+from test_support import trained_or_synthetic_model
+
+# Desvio máximo aceito para a quantização dinâmica (pesos int8)
+PROBABILITY_TOLERANCE = 1e-2
+HEATMAP_TOLERANCE = 0.15
+BBOX_IOU_TOLERANCE = 0.8
+
+
+def test_tflite_backend_drift_and_batching():
+    from convert_model import convert_to_tflite, drift_report
+    from services.model_service import ModelService
+
+    with tempfile.TemporaryDirectory() as workdir:
+        model_path = trained_or_synthetic_model(workdir)
+
+        tflite_path = os.path.join(workdir, "model.tflite")
+        assert convert_to_tflite(model_path, tflite_path, "dynamic") < os.path.getsize(model_path)
+
+        paths = [create_synthetic_mammogram(os.path.join(workdir, f"{seed}.png"), seed=seed) for seed in range(3)]
+        report = drift_report(model_path, tflite_path, paths)
+        assert report["probability_max_abs_diff"] <= PROBABILITY_TOLERANCE, report
+        assert report["heatmap_max_abs_diff"] <= HEATMAP_TOLERANCE, report
+        assert report["bbox_min_iou"] >= BBOX_IOU_TOLERANCE, report
+
+        # Um lote com várias imagens deve dar o mesmo resultado que cada imagem isolada
+        service = ModelService(tflite_path, residency="resident", idle_timeout=0, batching=False, backend="tflite")
+        images = [service.preprocess_image(path) for path in paths]
+        batched = service.predict_with_heatmap_batch(np.concatenate(images))
+        for img, (proba, heatmap) in zip(images, batched):
+            single_proba, single_heatmap = service.predict_with_heatmap_batch(img)[0]
+            assert abs(proba - single_proba) <= 1e-5
+            assert np.allclose(heatmap, single_heatmap, atol=1e-4)
+
+        result = service.predict(paths[0], generate_viz=False)
+        assert result["success"] and service.get_status()["backend"] == "tflite"
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    test_tflite_backend_drift_and_batching()
+    print("✅ Backend TFLite dentro da tolerância de desvio do modelo Keras")
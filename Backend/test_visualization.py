@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Teste da visualização do diagnóstico (services/visualization.py)
+"""
+
+import json
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+REPORT = {
+    "primary_diagnosis": "Achado suspeito",
+    "risk_level": "Alto",
+    "malignancy_probability": "87.0%",
+    "birads_equivalent": "BI-RADS 4-5",
+    "recommendation": "Biópsia recomendada",
+}
+
+
+def test_render_diagnosis_panels():
+    from services.visualization import encode_image, render_diagnosis
+
+    rng = np.random.default_rng(0)
+    gray = rng.integers(0, 256, (600, 400), dtype=np.uint8)
+    image = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+    heatmap = np.zeros((7, 7), dtype=np.float32)
+    heatmap[2:5, 2:5] = 1.0
+    panel, gap = 256, 8  # gap = max(4, panel // 32)
+
+    canvas = render_diagnosis(image, heatmap, (60, 60, 100, 100), REPORT, panel_size=panel)
+    assert canvas.dtype == np.uint8 and canvas.shape[1] == 3 * panel + 2 * gap
+
+    decoded = cv2.imdecode(np.frombuffer(encode_image(canvas, "png"), np.uint8), cv2.IMREAD_COLOR)
+    assert decoded.shape == canvas.shape and np.array_equal(decoded, canvas)
+
+    title_height = max(24, panel // 10)
+    rows = slice(title_height, title_height + panel)
+    original = canvas[rows, :panel].astype(np.int16)
+    overlay = canvas[rows, panel + gap:2 * panel + gap].astype(np.int16)
+    region = canvas[rows, 2 * panel + 2 * gap:].astype(np.int16)
+    # Painel original em tons de cinza; o Grad-CAM colore o painel do meio (jet + alpha 0.5)
+    assert np.array_equal(original[..., 0], original[..., 2])
+    assert np.abs(overlay[..., 0] - overlay[..., 2]).mean() > 20
+    assert np.abs(overlay - original).mean() > 20
+    # Bbox desenhada em vermelho no terceiro painel
+    assert ((region[..., 2] == 255) & (region[..., 0] < 50)).sum() > 100
+
+    # Sem heatmap nem bbox, os três painéis são a imagem original
+    plain = render_diagnosis(image, None, None, REPORT, panel_size=panel)
+    assert np.array_equal(plain[rows, panel + gap:2 * panel + gap], plain[rows, :panel])
+
+
+def test_visualization_endpoint_cache_and_etag():
+    from fastapi.testclient import TestClient
+    from services import visualization
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # O banco do app é relativo ao diretório atual: usar um banco temporário
+        os.chdir(workdir)
+        try:
+            import app
+            app.visualization_cache = visualization.VisualizationCache(os.path.join(workdir, "visualizations"))
+            image_path = os.path.join(workdir, "mg.png")
+            cv2.imwrite(image_path, np.random.default_rng(0).integers(0, 256, (300, 200), dtype=np.uint8))
+            state = visualization.build_state(np.eye(7, dtype=np.float32), (20, 20, 80, 80), (224, 224), REPORT)
+
+            db = app.SessionLocal()
+            analysis = app.Analysis(filename="mg.png", original_filename="mg.png", file_path=image_path,
+                                    file_size=os.path.getsize(image_path),
+                                    model_result=json.dumps({"visualization": state}))
+            db.add(analysis)
+            db.commit()
+            analysis_id = analysis.id
+            db.close()
+
+            renders = []
+            render_from_state = visualization.render_from_state
+            visualization.render_from_state = lambda *args: renders.append(args) or render_from_state(*args)
+            try:
+                client = TestClient(app.app)
+                url = f"/api/v1/analysis/{analysis_id}/visualization?format=png&size=128"
+                first = client.get(url)
+                assert first.status_code == 200 and first.headers["content-type"] == "image/png"
+                etag = first.headers["etag"]
+                decoded = cv2.imdecode(np.frombuffer(first.content, np.uint8), cv2.IMREAD_COLOR)
+                assert decoded.shape[1] == 3 * 128 + 2 * 4
+
+                # Cliente com a mesma versão: 304 sem corpo nem renderização
+                cached = client.get(url, headers={"If-None-Match": etag})
+                assert cached.status_code == 304 and cached.headers["etag"] == etag and not cached.content
+                # Sem If-None-Match: arquivo servido do cache em disco
+                again = client.get(url)
+                assert again.status_code == 200 and again.content == first.content and len(renders) == 1
+                cache_files = os.listdir(app.visualization_cache.cache_dir)
+                assert len(cache_files) == 1 and cache_files[0].startswith(f"{analysis_id}_")
+
+                assert client.delete(f"/api/v1/analysis/{analysis_id}").status_code == 200
+                assert os.listdir(app.visualization_cache.cache_dir) == []
+                assert client.get(url).status_code == 404
+            finally:
+                visualization.render_from_state = render_from_state
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    test_render_diagnosis_panels()
+    test_visualization_endpoint_cache_and_etag()
+    print("✅ Visualização com imagem original, sobreposição Grad-CAM e região suspeita")
+    print("✅ Visualização renderizada uma vez, 304 com o mesmo ETag e removida ao excluir a análise")
@@ -76,4 +76,5 @@ export interface AnalysisResponse {
   status: string
   model?: string
   analysis?: string
+  visualizationUrl?: string
 }
@@ -125,6 +125,11 @@ class ApiService {
   getImageUrl(filename: string): string {
     return `${API_BASE_URL}/uploads/${filename}`
   }
+
+  // Obter URL absoluta de um caminho da API (ex.: visualização do diagnóstico)
+  getApiUrl(path: string): string {
+    return `${API_BASE_URL}${path}`
+  }
 }
 
 export const apiService = new ApiService()